@@ -1,19 +1,47 @@
-from fastapi import FastAPI, APIRouter, HTTPException, Depends, status, BackgroundTasks
+from fastapi import FastAPI, APIRouter, HTTPException, Depends, status, BackgroundTasks, WebSocket, WebSocketDisconnect, Query, Response
+from fastapi.responses import JSONResponse, StreamingResponse
 from fastapi.security import HTTPBearer, HTTPAuthorizationCredentials
 from dotenv import load_dotenv
 from starlette.middleware.cors import CORSMiddleware
+from starlette.websockets import WebSocketState
 from motor.motor_asyncio import AsyncIOMotorClient
+from pymongo import IndexModel, UpdateOne, ReplaceOne, DeleteOne, CursorType, ReturnDocument, ASCENDING, DESCENDING
+from pymongo.errors import CollectionInvalid, DuplicateKeyError, OperationFailure
+from bson import ObjectId, json_util
+from bson.errors import InvalidId
 import os
 import logging
 import json
 import asyncio
+import base64
+import csv
+import gzip
+import io
+import shutil
+import socket
+import time
+from abc import ABC, abstractmethod
+from collections import OrderedDict
 from pathlib import Path
 from pydantic import BaseModel, Field, ConfigDict
 from typing import List, Optional
 import uuid
 from datetime import datetime, timezone, timedelta
+from zoneinfo import ZoneInfo, ZoneInfoNotFoundError
 import jwt
 import hashlib
+import hmac
+import secrets
+import sys
+import re
+import unicodedata
+import bcrypt
+from concurrent.futures import ThreadPoolExecutor
+
+try:
+    import zstandard
+except ImportError:  # optional: zstd-compressed backups
+    zstandard = None
 
 ROOT_DIR = Path(__file__).parent
 load_dotenv(ROOT_DIR / '.env')
@@ -31,10 +59,69 @@ BACKUP_DIR.mkdir(exist_ok=True)
 JWT_SECRET = os.environ.get('JWT_SECRET', 'transfers-admin-secret-key-2024')
 JWT_ALGORITHM = "HS256"
 JWT_EXPIRATION_HOURS = 24
+TOKEN_CACHE_SIZE = int(os.environ.get('TOKEN_CACHE_SIZE', 4096))
+TOKEN_REVOCATION_REFRESH_SECONDS = int(os.environ.get('TOKEN_REVOCATION_REFRESH_SECONDS', 30))
+
+# Password hashing settings
+PASSWORD_HASH_SCHEME = os.environ.get('PASSWORD_HASH_SCHEME', 'bcrypt')  # bcrypt or scrypt
+BCRYPT_ROUNDS = int(os.environ.get('BCRYPT_ROUNDS', 12))
+SCRYPT_N = int(os.environ.get('SCRYPT_N', 2 ** 14))
+SCRYPT_R = int(os.environ.get('SCRYPT_R', 8))
+SCRYPT_P = int(os.environ.get('SCRYPT_P', 1))
+PASSWORD_HASH_WORKERS = int(os.environ.get('PASSWORD_HASH_WORKERS', 4))
+
+# User search settings
+SEARCH_TEXT_INDEX = os.environ.get('SEARCH_TEXT_INDEX', 'false').lower() == 'true'
+USER_SEARCH_INDEX = os.environ.get('USER_SEARCH_INDEX', 'false').lower() == 'true'  # in-process prefix trie
+USER_SEARCH_INDEX_REFRESH_SECONDS = int(os.environ.get('USER_SEARCH_INDEX_REFRESH_SECONDS', 15))
+
+# Real-time chat settings
+CHAT_BROKER = os.environ.get('CHAT_BROKER', 'memory')  # memory (single worker) or mongo (shared by workers)
+CHAT_WS_QUEUE_SIZE = int(os.environ.get('CHAT_WS_QUEUE_SIZE', 256))
+CHAT_WS_AUTH_TIMEOUT_SECONDS = float(os.environ.get('CHAT_WS_AUTH_TIMEOUT_SECONDS', 10))
+CHAT_EVENTS_CAPPED_BYTES = int(os.environ.get('CHAT_EVENTS_CAPPED_BYTES', 16 * 1024 * 1024))
+
+# Trash settings
+TRASH_INSERT_CHUNK_SIZE = int(os.environ.get('TRASH_INSERT_CHUNK_SIZE', 1000))
+TRASH_MOVE_MODE = os.environ.get('TRASH_MOVE_MODE', 'merge')  # merge (server-side $merge) or batch
+
+# Admin response cache (per process; TTL bounds staleness across workers)
+RESPONSE_CACHE_ENABLED = os.environ.get('RESPONSE_CACHE_ENABLED', 'true').lower() == 'true'
+RESPONSE_CACHE_MAX_ENTRIES = int(os.environ.get('RESPONSE_CACHE_MAX_ENTRIES', 512))
+RESPONSE_CACHE_TTL_SECONDS = {
+    "users": int(os.environ.get('CACHE_TTL_USERS', 30)),
+    "drivers": int(os.environ.get('CACHE_TTL_DRIVERS', 30)),
+    "restaurants": int(os.environ.get('CACHE_TTL_RESTAURANTS', 60)),
+    "promotions": int(os.environ.get('CACHE_TTL_PROMOTIONS', 60)),
+    "stats": int(os.environ.get('CACHE_TTL_STATS', 10)),
+}
+
+# Admin list pagination
+LIST_DEFAULT_LIMIT = int(os.environ.get('LIST_DEFAULT_LIMIT', 1000))
+LIST_MAX_LIMIT = int(os.environ.get('LIST_MAX_LIMIT', 5000))
+EXPORT_BATCH_SIZE = int(os.environ.get('EXPORT_BATCH_SIZE', 2000))
+
+# Stats counters reconciliation
+METRICS_RECONCILE_INTERVAL_MINUTES = int(os.environ.get('METRICS_RECONCILE_INTERVAL_MINUTES', 60))
 
 # Auto backup settings
 AUTO_BACKUP_INTERVAL_HOURS = 6
-last_auto_backup = None
+BACKUP_COMPRESSION = os.environ.get('BACKUP_COMPRESSION', 'zstd' if zstandard else 'gzip')  # zstd, gzip or none
+BACKUP_COMPRESSION_LEVEL = int(os.environ.get('BACKUP_COMPRESSION_LEVEL', 3 if BACKUP_COMPRESSION == 'zstd' else 6))
+BACKUP_BATCH_SIZE = int(os.environ.get('BACKUP_BATCH_SIZE', 5000))
+BACKUP_IO_WORKERS = int(os.environ.get('BACKUP_IO_WORKERS', 1))
+BACKUP_JOB_CONCURRENCY = int(os.environ.get('BACKUP_JOB_CONCURRENCY', 1))  # across all server processes
+BACKUP_JOB_LEASE_SECONDS = int(os.environ.get('BACKUP_JOB_LEASE_SECONDS', 60))
+BACKUP_JOB_HEARTBEAT_SECONDS = int(os.environ.get('BACKUP_JOB_HEARTBEAT_SECONDS', 2))
+BACKUP_JOB_POLL_SECONDS = int(os.environ.get('BACKUP_JOB_POLL_SECONDS', 2))
+# Retention: newest backup of each of the last N hours / days / weeks is kept
+BACKUP_KEEP_HOURLY = int(os.environ.get('BACKUP_KEEP_HOURLY', 24))
+BACKUP_KEEP_DAILY = int(os.environ.get('BACKUP_KEEP_DAILY', 7))
+BACKUP_KEEP_WEEKLY = int(os.environ.get('BACKUP_KEEP_WEEKLY', 4))
+BACKUP_MIN_FREE_MB = int(os.environ.get('BACKUP_MIN_FREE_MB', 1024))  # refuse new backups below this
+BACKUP_ORPHAN_GRACE_HOURS = int(os.environ.get('BACKUP_ORPHAN_GRACE_HOURS', 24))
+# Auto backups are incremental until the last full backup is this old (0 = always full)
+BACKUP_FULL_INTERVAL_HOURS = int(os.environ.get('BACKUP_FULL_INTERVAL_HOURS', 24))
 
 # Create the main app
 app = FastAPI(title="Transfers Admin API")
@@ -293,6 +380,11 @@ class RestoreConversationRequest(BaseModel):
     requestedBy: str
     reason: Optional[str] = None
 
+class RestoreRequest(BaseModel):
+    messageId: str
+    requestedBy: str
+    reason: Optional[str] = None
+
 # نموذج الرسائل المحذوفة (للأرشيف)
 class DeletedMessage(BaseModel):
     model_config = ConfigDict(extra="ignore")
@@ -317,7 +409,7 @@ class Conversation(BaseModel):
     name: Optional[str] = None
     participants: List[str]
     createdBy: str
-    lastMessage: Optional[str] = None
+    lastMessage: Optional[dict] = None  # ملخص آخر رسالة (id, text, senderId, senderName, timestamp, read)
     lastMessageAt: Optional[str] = None
     createdAt: str = Field(default_factory=lambda: datetime.now(timezone.utc).isoformat())
 
@@ -343,22 +435,146 @@ class Stats(BaseModel):
 
 class BackupInfo(BaseModel):
     id: str
-    filename: str
+    filename: str  # legacy .json file or a backup directory
     created_at: str
     size: int
     type: str  # manual or auto
     collections: List[str]
+    format: str = "json"  # json (legacy, single file) or ndjson (directory + manifest)
+    compression: Optional[str] = None
+    documents: Optional[dict] = None  # collection -> document (or change) count
+    kind: str = "full"  # full or incremental
+    base_id: Optional[str] = None  # full backup an incremental chain starts from
+    parent_id: Optional[str] = None  # previous backup in the chain
 
 class BackupSettings(BaseModel):
     auto_backup_enabled: bool = True
     interval_hours: int = 6
     last_backup: Optional[str] = None
     next_backup: Optional[str] = None
+    retention_enabled: bool = True
+    keep_hourly: int = 24
+    keep_daily: int = 7
+    keep_weekly: int = 4
+    backup_count: int = 0
+    backups_size: int = 0  # bytes used by all backups
+    disk_total: Optional[int] = None  # bytes on the backup volume
+    disk_free: Optional[int] = None
 
 # ============== HELPER FUNCTIONS ==============
 
-def hash_password(password: str) -> str:
-    return hashlib.sha256(password.encode()).hexdigest()
+class BcryptHasher:
+    """bcrypt with a configurable cost factor"""
+    scheme = "bcrypt"
+
+    def __init__(self, rounds: int = 12):
+        self.rounds = rounds
+
+    def identify(self, hashed: str) -> bool:
+        return hashed.startswith(("$2a$", "$2b$", "$2y$"))
+
+    def hash(self, password: str) -> str:
+        return bcrypt.hashpw(password.encode(), bcrypt.gensalt(rounds=self.rounds)).decode()
+
+    def verify(self, password: str, hashed: str) -> bool:
+        return bcrypt.checkpw(password.encode(), hashed.encode())
+
+    def needs_rehash(self, hashed: str) -> bool:
+        return int(hashed.split("$")[2]) != self.rounds
+
+class ScryptHasher:
+    """scrypt stored as scrypt$n$r$p$salt$hash (base64)"""
+    scheme = "scrypt"
+
+    def __init__(self, n: int = 2 ** 14, r: int = 8, p: int = 1):
+        self.n, self.r, self.p = n, r, p
+
+    def identify(self, hashed: str) -> bool:
+        return hashed.startswith("scrypt$")
+
+    def _derive(self, password: str, salt: bytes, n: int, r: int, p: int) -> bytes:
+        return hashlib.scrypt(password.encode(), salt=salt, n=n, r=r, p=p, maxmem=256 * n * r + 1024 * 1024, dklen=32)
+
+    def hash(self, password: str) -> str:
+        salt = secrets.token_bytes(16)
+        digest = self._derive(password, salt, self.n, self.r, self.p)
+        return "$".join(["scrypt", str(self.n), str(self.r), str(self.p),
+                         base64.b64encode(salt).decode(), base64.b64encode(digest).decode()])
+
+    def verify(self, password: str, hashed: str) -> bool:
+        _, n, r, p, salt, digest = hashed.split("$")
+        candidate = self._derive(password, base64.b64decode(salt), int(n), int(r), int(p))
+        return hmac.compare_digest(candidate, base64.b64decode(digest))
+
+    def needs_rehash(self, hashed: str) -> bool:
+        _, n, r, p, _, _ = hashed.split("$")
+        return (int(n), int(r), int(p)) != (self.n, self.r, self.p)
+
+class LegacySha256Hasher:
+    """Unsalted single-round SHA-256 used before the KDF migration; verify only"""
+    scheme = "sha256"
+
+    def identify(self, hashed: str) -> bool:
+        return len(hashed) == 64 and all(c in "0123456789abcdef" for c in hashed)
+
+    def verify(self, password: str, hashed: str) -> bool:
+        return hmac.compare_digest(hashlib.sha256(password.encode()).hexdigest(), hashed)
+
+    def needs_rehash(self, hashed: str) -> bool:
+        return True
+
+PASSWORD_HASHERS = {
+    "bcrypt": BcryptHasher(BCRYPT_ROUNDS),
+    "scrypt": ScryptHasher(SCRYPT_N, SCRYPT_R, SCRYPT_P),
+}
+password_hasher = PASSWORD_HASHERS[PASSWORD_HASH_SCHEME]
+# KDFs are CPU bound; a bounded pool keeps login storms off the event loop
+password_executor = ThreadPoolExecutor(max_workers=PASSWORD_HASH_WORKERS, thread_name_prefix="password-hash")
+
+def _hasher_for(hashed: str):
+    for hasher in (*PASSWORD_HASHERS.values(), LegacySha256Hasher()):
+        if hasher.identify(hashed):
+            return hasher
+    return None
+
+async def hash_password(password: str) -> str:
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(password_executor, password_hasher.hash, password)
+
+async def verify_password(password: str, hashed: Optional[str]) -> tuple:
+    """Return (valid, needs_rehash) for a stored hash of any supported scheme"""
+    hasher = _hasher_for(hashed or "")
+    if hasher is None:
+        return False, False
+    loop = asyncio.get_running_loop()
+    valid = await loop.run_in_executor(password_executor, hasher.verify, password, hashed)
+    if not valid:
+        return False, False
+    return True, hasher is not password_hasher or hasher.needs_rehash(hashed)
+
+def encode_cursor(values: list) -> str:
+    """Encode keyset pagination values as an opaque URL-safe token"""
+    raw = json.dumps(values, separators=(",", ":"), ensure_ascii=False).encode()
+    return base64.urlsafe_b64encode(raw).decode().rstrip("=")
+
+CURSOR_VALUE_TYPES = (str, int, float, bool, type(None))
+
+def decode_cursor(token: str, size: int) -> list:
+    """Decode a token produced by encode_cursor, validating its arity and value types.
+
+    Values end up inside query filters, so only scalars are accepted; an object
+    such as {"$gt": ""} would otherwise be read as a MongoDB operator.
+    """
+    try:
+        padded = token + "=" * (-len(token) % 4)
+        values = json.loads(base64.urlsafe_b64decode(padded.encode()))
+    except (ValueError, TypeError):
+        raise HTTPException(status_code=400, detail="Invalid cursor")
+    if not isinstance(values, list) or len(values) != size:
+        raise HTTPException(status_code=400, detail="Invalid cursor")
+    if not all(isinstance(value, CURSOR_VALUE_TYPES) for value in values):
+        raise HTTPException(status_code=400, detail="Invalid cursor")
+    return values
 
 def create_token(admin_id: str, email: str) -> str:
     payload = {
@@ -368,15 +584,802 @@ def create_token(admin_id: str, email: str) -> str:
     }
     return jwt.encode(payload, JWT_SECRET, algorithm=JWT_ALGORITHM)
 
-def verify_token(credentials: HTTPAuthorizationCredentials = Depends(security)):
+def _token_signature(token: str) -> str:
+    return token.rsplit(".", 1)[-1]
+
+class VerifiedTokenCache:
+    """Bounded LRU of decoded tokens keyed by signature, plus the revocation list"""
+    def __init__(self, max_entries: int):
+        self.max_entries = max_entries
+        self.entries = OrderedDict()  # signature -> (token, payload, exp)
+        self.revoked = {}  # signature -> exp
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, token: str) -> Optional[dict]:
+        signature = _token_signature(token)
+        entry = self.entries.get(signature)
+        if entry is None or entry[0] != token:
+            self.misses += 1
+            return None
+        # Same rule as jwt.decode: expired once the clock reaches exp
+        if entry[2] is not None and time.time() >= entry[2]:
+            del self.entries[signature]
+            self.misses += 1
+            return None
+        self.entries.move_to_end(signature)
+        self.hits += 1
+        return entry[1]
+
+    def put(self, token: str, payload: dict):
+        self.entries[_token_signature(token)] = (token, payload, payload.get("exp"))
+        self.entries.move_to_end(_token_signature(token))
+        while len(self.entries) > self.max_entries:
+            self.entries.popitem(last=False)
+
+    def is_revoked(self, token: str) -> bool:
+        return _token_signature(token) in self.revoked
+
+    def revoke(self, token: str, exp: Optional[float]):
+        signature = _token_signature(token)
+        self.revoked[signature] = exp
+        self.entries.pop(signature, None)
+
+    def prune_revoked(self):
+        now = time.time()
+        for signature in [s for s, exp in self.revoked.items() if exp is not None and exp < now]:
+            del self.revoked[signature]
+
+token_cache = VerifiedTokenCache(TOKEN_CACHE_SIZE)
+
+async def verify_token(credentials: HTTPAuthorizationCredentials = Depends(security)):
+    # async: a cache hit costs a dict lookup instead of a threadpool hop and an HMAC check
+    return decode_access_token(credentials.credentials)
+
+def decode_access_token(token: str) -> dict:
+    """Verify a bearer token (revocation list, cache, signature) and return its payload"""
+    if token_cache.is_revoked(token):
+        raise HTTPException(status_code=401, detail="Token revoked")
+    
+    payload = token_cache.get(token)
+    if payload is not None:
+        return payload
+    
     try:
-        token = credentials.credentials
         payload = jwt.decode(token, JWT_SECRET, algorithms=[JWT_ALGORITHM])
-        return payload
     except jwt.ExpiredSignatureError:
         raise HTTPException(status_code=401, detail="Token expired")
     except jwt.InvalidTokenError:
         raise HTTPException(status_code=401, detail="Invalid token")
+    token_cache.put(token, payload)
+    return payload
+
+async def load_revoked_tokens():
+    """Sync the in-memory revocation list with tokens revoked by any worker"""
+    revoked = await db.revoked_tokens.find({}, {"_id": 0, "signature": 1, "exp": 1}).to_list(None)
+    for entry in revoked:
+        if entry["signature"] not in token_cache.revoked:
+            token_cache.revoked[entry["signature"]] = entry.get("exp")
+            token_cache.entries.pop(entry["signature"], None)
+    token_cache.prune_revoked()
+
+async def token_revocation_task():
+    """Background task refreshing the revocation list"""
+    while True:
+        try:
+            await load_revoked_tokens()
+        except Exception as e:
+            logger.error(f"Token revocation refresh error: {str(e)}")
+        await asyncio.sleep(TOKEN_REVOCATION_REFRESH_SECONDS)
+
+# ============== DATABASE INDEXES ==============
+
+# Declarative index registry: collection name -> indexes the routes below rely on.
+# Applied idempotently on startup; create_index is a no-op for existing indexes.
+INDEXES = {
+    "admins": [
+        IndexModel([("email", ASCENDING)], name="email_1"),
+    ],
+    "registered_users": [
+        IndexModel([("userId", ASCENDING)], name="userId_unique", unique=True),
+        IndexModel([("email", ASCENDING)], name="email_unique", unique=True),
+        # Normalized search fields: anchored prefix regexes on these use the index
+        IndexModel([("userIdNorm", ASCENDING)], name="userIdNorm_1"),
+        IndexModel([("emailNorm", ASCENDING)], name="emailNorm_1"),
+        IndexModel([("nameNorm", ASCENDING)], name="nameNorm_1"),
+        IndexModel([("nameTokens", ASCENDING)], name="nameTokens_1"),
+        IndexModel([("createdAt", ASCENDING)], name="createdAt_1"),
+    ] + ([
+        IndexModel([("nameNorm", "text"), ("userIdNorm", "text"), ("emailNorm", "text")],
+                   name="search_text", default_language="none",
+                   weights={"userIdNorm": 10, "nameNorm": 5, "emailNorm": 1}),
+    ] if SEARCH_TEXT_INDEX else []),
+    "users": [
+        IndexModel([("id", ASCENDING)], name="id_1"),
+        IndexModel([("email", ASCENDING)], name="email_1"),
+    ],
+    "drivers": [
+        IndexModel([("id", ASCENDING)], name="id_1"),
+        IndexModel([("status", ASCENDING)], name="status_1"),
+    ],
+    "restaurants": [
+        IndexModel([("id", ASCENDING)], name="id_1"),
+    ],
+    "rides": [
+        IndexModel([("id", ASCENDING)], name="id_1"),
+        IndexModel([("date", ASCENDING)], name="date_1"),
+        # Keyset pagination of the admin tables sorts on (field, _id)
+        IndexModel([("date", ASCENDING), ("_id", ASCENDING)], name="date_1__id_1"),
+        IndexModel([("status", ASCENDING), ("_id", ASCENDING)], name="status_1__id_1"),
+    ],
+    "orders": [
+        IndexModel([("id", ASCENDING)], name="id_1"),
+        IndexModel([("status", ASCENDING)], name="status_1"),
+        IndexModel([("date", ASCENDING)], name="date_1"),
+        IndexModel([("status", ASCENDING), ("date", ASCENDING)], name="status_1_date_1"),
+        IndexModel([("date", ASCENDING), ("_id", ASCENDING)], name="date_1__id_1"),
+        IndexModel([("status", ASCENDING), ("date", ASCENDING), ("_id", ASCENDING)], name="status_1_date_1__id_1"),
+    ],
+    "promotions": [
+        IndexModel([("id", ASCENDING)], name="id_1"),
+        IndexModel([("code", ASCENDING)], name="code_unique", unique=True),
+    ],
+    "conversations": [
+        IndexModel([("id", ASCENDING)], name="id_1"),
+        IndexModel([("participants", ASCENDING), ("lastMessageAt", DESCENDING)], name="participants_1_lastMessageAt_-1"),
+        IndexModel([("type", ASCENDING), ("participants", ASCENDING)], name="type_1_participants_1"),
+        IndexModel([("lastMessage.id", ASCENDING)], name="lastMessage.id_1", sparse=True),
+    ],
+    "messages": [
+        IndexModel([("id", ASCENDING)], name="id_1"),
+        IndexModel([("conversationId", ASCENDING), ("createdAt", DESCENDING), ("id", DESCENDING)], name="conversationId_1_createdAt_-1_id_-1"),
+    ],
+    "deleted_messages": [
+        IndexModel([("originalMessageId", ASCENDING)], name="originalMessageId_1"),
+        IndexModel([("originalConversationId", ASCENDING)], name="originalConversationId_1"),
+        IndexModel([("status", ASCENDING), ("deletedAt", DESCENDING)], name="status_1_deletedAt_-1"),
+        IndexModel([("status", ASCENDING), ("restoreRequestedAt", DESCENDING)], name="status_1_restoreRequestedAt_-1"),
+        IndexModel([("senderId", ASCENDING)], name="senderId_1"),
+        IndexModel([("deletedBy", ASCENDING)], name="deletedBy_1"),
+        IndexModel([("restoreRequestedBy", ASCENDING)], name="restoreRequestedBy_1"),
+        IndexModel([("expiresAt", ASCENDING)], name="expiresAt_1"),
+    ],
+    "deleted_conversations": [
+        IndexModel([("originalConversationId", ASCENDING)], name="originalConversationId_1"),
+        IndexModel([("status", ASCENDING), ("deletedAt", DESCENDING)], name="status_1_deletedAt_-1"),
+        IndexModel([("status", ASCENDING), ("restoreRequestedAt", DESCENDING)], name="status_1_restoreRequestedAt_-1"),
+        IndexModel([("participants", ASCENDING)], name="participants_1"),
+        IndexModel([("deletedBy", ASCENDING)], name="deletedBy_1"),
+        IndexModel([("expiresAt", ASCENDING)], name="expiresAt_1"),
+    ],
+    "backups": [
+        IndexModel([("id", ASCENDING)], name="id_1"),
+        IndexModel([("created_at", DESCENDING)], name="created_at_-1"),
+    ],
+    "backup_jobs": [
+        IndexModel([("id", ASCENDING)], name="id_unique", unique=True),
+        IndexModel([("status", ASCENDING), ("created_at", ASCENDING)], name="status_1_created_at_1"),
+    ],
+    "settings": [
+        IndexModel([("type", ASCENDING)], name="type_1"),
+    ],
+    "metrics": [
+        IndexModel([("type", ASCENDING)], name="type_1"),
+    ],
+    "revoked_tokens": [
+        IndexModel([("signature", ASCENDING)], name="signature_unique", unique=True),
+        # Revocations are dropped by MongoDB once the token would have expired anyway
+        IndexModel([("expiresAt", ASCENDING)], name="expiresAt_ttl", expireAfterSeconds=0),
+    ],
+}
+
+index_build_status = {
+    "state": "pending",  # pending, running, completed, completed_with_errors
+    "total": sum(len(models) for models in INDEXES.values()),
+    "built": 0,
+    "current": None,
+    "failed": [],
+    "started_at": None,
+    "finished_at": None
+}
+
+async def ensure_indexes():
+    """Create every index in INDEXES, recording progress in index_build_status"""
+    index_build_status.update({
+        "state": "running",
+        "built": 0,
+        "current": None,
+        "failed": [],
+        "started_at": datetime.now(timezone.utc).isoformat(),
+        "finished_at": None
+    })
+    total = index_build_status["total"]
+
+    for collection_name, models in INDEXES.items():
+        for model in models:
+            name = model.document["name"]
+            index_build_status["current"] = f"{collection_name}.{name}"
+            try:
+                await db[collection_name].create_indexes([model])
+                index_build_status["built"] += 1
+                logger.info(f"Index {collection_name}.{name} ready ({index_build_status['built']}/{total})")
+            except OperationFailure as e:
+                # Duplicate data under a unique index or conflicting options must not block startup
+                index_build_status["failed"].append({
+                    "collection": collection_name,
+                    "index": name,
+                    "error": str(e)
+                })
+                logger.error(f"Index {collection_name}.{name} failed: {str(e)}")
+
+    index_build_status["current"] = None
+    index_build_status["state"] = "completed_with_errors" if index_build_status["failed"] else "completed"
+    index_build_status["finished_at"] = datetime.now(timezone.utc).isoformat()
+    logger.info(f"Index build finished: {index_build_status['built']}/{total} built, {len(index_build_status['failed'])} failed")
+
+@api_router.get("/indexes")
+async def get_indexes(payload: dict = Depends(verify_token)):
+    """List the active indexes of every registered collection with the build status"""
+    collections = {}
+    for collection_name, models in INDEXES.items():
+        active = await db[collection_name].index_information()
+        collections[collection_name] = {
+            "expected": [model.document["name"] for model in models],
+            "active": [
+                {
+                    "name": name,
+                    "key": [[field, direction] for field, direction in info.get("key", [])],
+                    "unique": info.get("unique", False)
+                }
+                for name, info in active.items()
+            ],
+            "missing": [model.document["name"] for model in models if model.document["name"] not in active]
+        }
+    return {"status": index_build_status, "collections": collections}
+
+# ============== RESPONSE CACHE ==============
+
+class ResponseCache:
+    """TTL + LRU cache of read endpoint responses, invalidated by the write routes"""
+    def __init__(self, max_entries: int, ttl_seconds: dict):
+        self.max_entries = max_entries
+        self.ttl_seconds = ttl_seconds
+        self.entries = OrderedDict()  # (route, params) -> (expires_at, value)
+        self.generations = {}  # route -> bumped on every invalidation
+        self.hits = {}
+        self.misses = {}
+        self.evictions = 0
+        self.invalidations = {}
+
+    async def get_or_load(self, route: str, params: dict, loader):
+        if not RESPONSE_CACHE_ENABLED:
+            return await loader()
+        
+        key = (route, tuple(sorted(params.items())))
+        entry = self.entries.get(key)
+        if entry and entry[0] > time.monotonic():
+            self.entries.move_to_end(key)
+            self.hits[route] = self.hits.get(route, 0) + 1
+            return entry[1]
+        
+        self.misses[route] = self.misses.get(route, 0) + 1
+        generation = self.generations.get(route, 0)
+        value = await loader()
+        # A write that landed while loading makes this value stale; do not store it
+        if self.generations.get(route, 0) == generation:
+            self.entries[key] = (time.monotonic() + self.ttl_seconds.get(route, 30), value)
+            self.entries.move_to_end(key)
+            while len(self.entries) > self.max_entries:
+                self.entries.popitem(last=False)
+                self.evictions += 1
+        return value
+
+    def invalidate(self, *routes: str):
+        for route in routes:
+            self.generations[route] = self.generations.get(route, 0) + 1
+            self.invalidations[route] = self.invalidations.get(route, 0) + 1
+        for key in [key for key in self.entries if key[0] in routes]:
+            del self.entries[key]
+
+    def clear(self):
+        self.invalidate(*{key[0] for key in self.entries} | set(self.ttl_seconds))
+
+    def stats(self) -> dict:
+        routes = sorted(set(self.hits) | set(self.misses) | set(self.ttl_seconds))
+        return {
+            "enabled": RESPONSE_CACHE_ENABLED,
+            "entries": len(self.entries),
+            "maxEntries": self.max_entries,
+            "evictions": self.evictions,
+            "routes": {
+                route: {
+                    "ttlSeconds": self.ttl_seconds.get(route),
+                    "hits": self.hits.get(route, 0),
+                    "misses": self.misses.get(route, 0),
+                    "hitRatio": round(self.hits.get(route, 0) / max(self.hits.get(route, 0) + self.misses.get(route, 0), 1), 3),
+                    "invalidations": self.invalidations.get(route, 0)
+                }
+                for route in routes
+            }
+        }
+
+response_cache = ResponseCache(RESPONSE_CACHE_MAX_ENTRIES, RESPONSE_CACHE_TTL_SECONDS)
+
+@api_router.get("/cache/stats")
+async def get_cache_stats(payload: dict = Depends(verify_token)):
+    """Hit/miss counters of the admin response cache"""
+    return response_cache.stats()
+
+# ============== LIST PAGINATION ==============
+
+LIST_FIELD_PATTERN = re.compile(r"^[A-Za-z][A-Za-z0-9_]*$")
+
+class ListParams:
+    """Pagination, filter, sort and projection query parameters shared by the admin list routes"""
+    def __init__(
+        self,
+        limit: int = Query(LIST_DEFAULT_LIMIT, ge=1, le=LIST_MAX_LIMIT),
+        page: Optional[int] = Query(None, ge=1),
+        cursor: Optional[str] = None,
+        sort: Optional[str] = None,
+        order: str = Query("asc", pattern="^(asc|desc)$"),
+        status_filter: Optional[str] = Query(None, alias="status"),
+        fields: Optional[str] = None
+    ):
+        self.limit = limit
+        self.page = page
+        self.cursor = cursor
+        self.sort = sort
+        self.direction = ASCENDING if order == "asc" else DESCENDING
+        self.statuses = [s for s in (status_filter or "").split(",") if s]
+        self.fields = [f for f in (fields or "").split(",") if f]
+        for field in self.fields:
+            if not LIST_FIELD_PATTERN.match(field):
+                raise HTTPException(status_code=400, detail=f"Invalid field: {field}")
+
+    def cache_params(self) -> dict:
+        return {
+            "limit": self.limit, "page": self.page, "cursor": self.cursor, "sort": self.sort,
+            "direction": self.direction, "statuses": tuple(self.statuses), "fields": tuple(self.fields)
+        }
+
+def _list_sort_key(params: ListParams, sort_fields: set) -> str:
+    if params.sort is None:
+        return "_id"
+    if params.sort not in sort_fields:
+        raise HTTPException(status_code=400, detail=f"Cannot sort by {params.sort}")
+    return params.sort
+
+def _cursor_object_id(value) -> ObjectId:
+    try:
+        return ObjectId(value)
+    except (InvalidId, TypeError):
+        raise HTTPException(status_code=400, detail="Invalid cursor")
+
+def keyset_match(keys: list, token: str, direction: int) -> dict:
+    """Filter for the rows strictly after a cursor position over the given sort keys
+
+    Null and missing values sort before everything else, and $gt/$lt never
+    match them, so they get their own branches: past a null cursor value
+    comes every non-null row (ascending) or nothing (descending), and
+    descending past a value also reaches the null rows.
+    """
+    values = decode_cursor(token, len(keys))
+    values = [_cursor_object_id(v) if k == "_id" else v for k, v in zip(keys, values)]
+    branches = []
+    for i, key in enumerate(keys):
+        # {key: None} matches both null and missing, like the sort does
+        branch = {k: v for k, v in zip(keys[:i], values[:i])}
+        if values[i] is None:
+            if direction == DESCENDING:
+                continue
+            branch[key] = {"$ne": None}
+        elif direction == ASCENDING:
+            branch[key] = {"$gt": values[i]}
+        elif key == "_id":
+            branch[key] = {"$lt": values[i]}
+        else:
+            branch["$or"] = [{key: {"$lt": values[i]}}, {key: None}]
+        branches.append(branch)
+    return branches[0] if len(branches) == 1 else {"$or": branches}
+
+def keyset_cursor(doc: dict, keys: list) -> str:
+    return encode_cursor([str(doc["_id"]) if k == "_id" else doc.get(k) for k in keys])
+
+async def paginate_collection(collection, params: ListParams, sort_fields: set, field_aliases: dict = None):
+    """Run one page of an admin list query; returns (items, headers)
+
+    Sorting is always completed with _id so the opaque cursor is a stable
+    (value, _id) keyset position. Without a cursor, page/limit fall back to skip.
+    """
+    field_aliases = field_aliases or {}
+    sort_key = _list_sort_key(params, sort_fields)
+    sort_key = field_aliases.get(sort_key, sort_key)
+    query = {"status": {"$in": params.statuses}} if params.statuses else {}
+    
+    keys = [sort_key] if sort_key == "_id" else [sort_key, "_id"]
+    page_query = dict(query)
+    if params.cursor:
+        page_query.update(keyset_match(keys, params.cursor, params.direction))
+    
+    projection = None
+    if params.fields:
+        requested = {field_aliases.get(f, f) for f in params.fields} | {"id"}
+        # Sort keys are always fetched so the next cursor can be built from the last row
+        projection = {field: 1 for field in requested | set(keys)}
+    
+    cursor = collection.find(page_query, projection, allow_disk_use=True).sort([(k, params.direction) for k in keys])
+    if params.page and not params.cursor:
+        cursor = cursor.skip((params.page - 1) * params.limit)
+    
+    docs, total = await asyncio.gather(
+        cursor.limit(params.limit + 1).to_list(params.limit + 1),
+        collection.count_documents(query) if query else collection.estimated_document_count()
+    )
+    headers = {"X-Total-Count": str(total)}
+    if len(docs) > params.limit:
+        docs = docs[:params.limit]
+        headers["X-Next-Cursor"] = keyset_cursor(docs[-1], keys)
+    # Sort keys the caller did not ask for are dropped only after the cursor is built
+    hidden = (set(keys) - requested) | {"_id"} if params.fields else {"_id"}
+    for doc in docs:
+        for field in hidden:
+            doc.pop(field, None)
+    return docs, headers
+
+def list_response(response: Response, params: ListParams, items: list, headers: dict):
+    """Return a page as a plain list; projected pages bypass the full response model"""
+    headers = {**headers, "Access-Control-Expose-Headers": "X-Total-Count, X-Next-Cursor"}
+    if params.fields:
+        return JSONResponse(content=items, headers=headers)
+    response.headers.update(headers)
+    return items
+
+# ============== EXPORTS ==============
+
+EXPORT_DATE_PATTERN = re.compile(r"^\d{4}-\d{2}-\d{2}( \d{2}:\d{2})?$")
+
+def date_range_filter(date_from: Optional[str], date_to: Optional[str]) -> dict:
+    """Range over the 'YYYY-MM-DD HH:MM' date strings; a bare date_to includes that whole day"""
+    query = {}
+    for value in (date_from, date_to):
+        if value and not EXPORT_DATE_PATTERN.match(value):
+            raise HTTPException(status_code=400, detail="Dates must be YYYY-MM-DD or YYYY-MM-DD HH:MM")
+    if date_from:
+        query["$gte"] = date_from
+    if date_to:
+        query["$lte"] = date_to if len(date_to) > 10 else date_to + " 23:59"
+    return {"date": query} if query else {}
+
+async def _export_lines(cursor, export_format: str, columns: list, label: str, transform=None):
+    """Encode cursor rows as NDJSON or CSV, yielding one chunk per batch"""
+    started = time.perf_counter()
+    rows = 0
+    buffer = io.StringIO()
+    writer = csv.DictWriter(buffer, fieldnames=columns, extrasaction="ignore") if export_format == "csv" else None
+    if writer:
+        writer.writeheader()
+    try:
+        async for doc in cursor:
+            doc.pop("_id", None)
+            if transform:
+                doc = transform(doc)
+            if writer:
+                writer.writerow(doc)
+            else:
+                buffer.write(json.dumps(doc, ensure_ascii=False, default=str))
+                buffer.write("\n")
+            rows += 1
+            if rows % EXPORT_BATCH_SIZE == 0:
+                yield buffer.getvalue().encode()
+                buffer.seek(0)
+                buffer.truncate()
+        if buffer.tell():
+            yield buffer.getvalue().encode()
+    finally:
+        await cursor.close()
+        elapsed = time.perf_counter() - started
+        logger.info(f"Export {label}.{export_format}: {rows} rows in {elapsed:.1f}s ({rows / max(elapsed, 1e-6):.0f} rows/s)")
+
+def export_response(cursor, export_format: str, columns: list, label: str, transform=None) -> StreamingResponse:
+    media_type = "text/csv; charset=utf-8" if export_format == "csv" else "application/x-ndjson"
+    filename = f"{label}_{datetime.now(timezone.utc).strftime('%Y%m%d_%H%M%S')}.{export_format}"
+    return StreamingResponse(
+        _export_lines(cursor, export_format, columns, label, transform),
+        media_type=media_type,
+        headers={"Content-Disposition": f'attachment; filename="{filename}"'}
+    )
+
+# ============== USER SEARCH ==============
+
+ARABIC_DIACRITICS = re.compile("[\u0610-\u061A\u064B-\u065F\u0670\u06D6-\u06ED\u0640]")
+ARABIC_LETTER_FORMS = str.maketrans({
+    "أ": "ا", "إ": "ا", "آ": "ا", "ٱ": "ا",
+    "ى": "ي", "ئ": "ي",
+    "ؤ": "و",
+    "ة": "ه"
+})
+
+def normalize_search_text(text: str) -> str:
+    """Lowercase, strip Arabic diacritics/tatweel and unify Arabic letter forms"""
+    text = unicodedata.normalize("NFKC", text or "").lower()
+    text = ARABIC_DIACRITICS.sub("", text).translate(ARABIC_LETTER_FORMS)
+    return " ".join(text.split())
+
+def user_search_fields(user_id: str, name: str, email: str) -> dict:
+    """Normalized fields stored on registered_users for indexed search"""
+    name_norm = normalize_search_text(name)
+    return {
+        "userIdNorm": normalize_search_text(user_id),
+        "emailNorm": normalize_search_text(email),
+        "nameNorm": name_norm,
+        "nameTokens": sorted(set(name_norm.split()))
+    }
+
+def rank_search_match(user: dict, query: str) -> int:
+    """Higher is better: exact username, then username, name and email prefixes"""
+    if user.get("userIdNorm") == query:
+        return 100
+    if user.get("userIdNorm", "").startswith(query):
+        return 80
+    if user.get("nameNorm", "").startswith(query):
+        return 60
+    if any(token.startswith(query) for token in user.get("nameTokens", [])):
+        return 50
+    if user.get("emailNorm", "").startswith(query):
+        return 40
+    return 0
+
+class _TrieNode:
+    __slots__ = ("children", "user_ids")
+
+    def __init__(self):
+        self.children = {}
+        self.user_ids = None  # set of userIds whose key ends here
+
+class UserPrefixIndex:
+    """In-process prefix trie over normalized userId, email and name words"""
+    def __init__(self):
+        self.root = _TrieNode()
+        self.users = {}  # userId -> compact record used to build responses
+        self.node_count = 1
+        self.ready = False
+        self.watermark = ""  # createdAt of the newest user loaded
+        self.hits = 0
+        self.fallbacks = 0
+
+    def _insert(self, key: str, user_id: str):
+        node = self.root
+        for char in key:
+            child = node.children.get(char)
+            if child is None:
+                child = node.children[char] = _TrieNode()
+                self.node_count += 1
+            node = child
+        if node.user_ids is None:
+            node.user_ids = set()
+        node.user_ids.add(user_id)
+
+    def add(self, user: dict):
+        user_id = user.get("userId")
+        if not user_id or user_id in self.users:
+            return
+        fields = user_search_fields(user_id, user.get("name", ""), user.get("email", ""))
+        self.users[user_id] = {
+            "userId": user_id,
+            "name": user.get("name", ""),
+            "email": user.get("email", ""),
+            "phone": user.get("phone", ""),
+            "userType": user.get("userType", "rider"),
+            **fields
+        }
+        for key in {fields["userIdNorm"], fields["emailNorm"], fields["nameNorm"], *fields["nameTokens"]}:
+            if key:
+                self._insert(key, user_id)
+        self.watermark = max(self.watermark, user.get("createdAt") or "")
+
+    def search(self, query: str, limit: int = 20, candidates: int = 50) -> List[dict]:
+        node = self.root
+        for char in query:
+            node = node.children.get(char)
+            if node is None:
+                return []
+        # Breadth-first, so shorter (closer) completions are collected first
+        found = []
+        seen = set()
+        level = [node]
+        while level and len(found) < candidates:
+            next_level = []
+            for current in level:
+                if current.user_ids:
+                    for user_id in current.user_ids:
+                        if user_id not in seen:
+                            seen.add(user_id)
+                            found.append(self.users[user_id])
+                next_level.extend(current.children.values())
+            level = next_level
+        found.sort(key=lambda u: (-rank_search_match(u, query), len(u.get("name", ""))))
+        return found[:limit]
+
+    def footprint(self) -> dict:
+        """Approximate memory use, extrapolated from one node and one record"""
+        node_bytes = sys.getsizeof(_TrieNode()) + sys.getsizeof({})
+        sample = next(iter(self.users.values()), None)
+        record_bytes = 0
+        if sample:
+            record_bytes = sys.getsizeof(sample) + sum(sys.getsizeof(v) for v in sample.values())
+        return {
+            "ready": self.ready,
+            "users": len(self.users),
+            "nodes": self.node_count,
+            "approxBytes": self.node_count * node_bytes + len(self.users) * (record_bytes + 64),
+            "hits": self.hits,
+            "fallbacks": self.fallbacks
+        }
+
+user_prefix_index = UserPrefixIndex()
+
+async def load_user_prefix_index():
+    """Build the trie from registered_users in the background"""
+    started = time.perf_counter()
+    async for user in db.registered_users.find(
+        {}, {"_id": 0, "userId": 1, "name": 1, "email": 1, "phone": 1, "userType": 1, "createdAt": 1}
+    ).batch_size(5000):
+        user_prefix_index.add(user)
+    user_prefix_index.ready = True
+    footprint = user_prefix_index.footprint()
+    logger.info(
+        f"User prefix index ready: {footprint['users']} users, {footprint['nodes']} nodes, "
+        f"~{footprint['approxBytes'] // (1024 * 1024)}MB in {time.perf_counter() - started:.1f}s"
+    )
+
+async def user_prefix_index_task():
+    """Load the trie, then pick up users registered through other workers"""
+    try:
+        await load_user_prefix_index()
+    except Exception as e:
+        logger.error(f"User prefix index load failed: {str(e)}")
+        return
+    while True:
+        await asyncio.sleep(USER_SEARCH_INDEX_REFRESH_SECONDS)
+        try:
+            async for user in db.registered_users.find(
+                {"createdAt": {"$gte": user_prefix_index.watermark}},
+                {"_id": 0, "userId": 1, "name": 1, "email": 1, "phone": 1, "userType": 1, "createdAt": 1}
+            ):
+                user_prefix_index.add(user)
+        except Exception as e:
+            logger.error(f"User prefix index refresh error: {str(e)}")
+
+async def backfill_user_search_fields(batch_size: int = 1000):
+    """Add normalized search fields to users registered before they existed"""
+    updates = []
+    migrated = 0
+    async for user in db.registered_users.find(
+        {"nameTokens": {"$exists": False}},
+        {"_id": 1, "userId": 1, "name": 1, "email": 1}
+    ).batch_size(batch_size):
+        updates.append(UpdateOne(
+            {"_id": user["_id"]},
+            {"$set": user_search_fields(user.get("userId", ""), user.get("name", ""), user.get("email", ""))}
+        ))
+        if len(updates) >= batch_size:
+            await db.registered_users.bulk_write(updates, ordered=False)
+            migrated += len(updates)
+            updates = []
+    if updates:
+        await db.registered_users.bulk_write(updates, ordered=False)
+        migrated += len(updates)
+    if migrated:
+        logger.info(f"Backfilled search fields for {migrated} registered users")
+
+# ============== MATERIALIZED METRICS ==============
+
+# Counters behind /api/stats, kept current with $inc by the write routes
+# and periodically recomputed from the source collections.
+METRICS_FILTER = {"type": "stats"}
+METRICS_COUNTERS = [
+    "totalUsers", "totalDrivers", "totalRestaurants", "totalRides", "totalOrders",
+    "totalRevenue", "activeDrivers", "pendingOrders", "ratingSum"
+]
+PENDING_ORDER_STATUSES = ("preparing", "on_way")
+
+async def bump_metrics(deltas: dict):
+    """Atomically apply counter deltas to the metrics document"""
+    inc = {field: value for field, value in deltas.items() if value}
+    if not inc:
+        return
+    # No upsert: until the first reconciliation there is nothing to increment
+    await db.metrics.update_one(METRICS_FILTER, {"$inc": inc})
+    response_cache.invalidate("stats")
+
+def order_metrics(order: dict, sign: int = 1) -> dict:
+    """Counter contribution of one order document"""
+    return {
+        "pendingOrders": sign * (1 if order.get("status") in PENDING_ORDER_STATUSES else 0),
+        "totalRevenue": sign * (order.get("total", 0) if order.get("status") == "delivered" else 0)
+    }
+
+def driver_metrics(driver: dict, sign: int = 1) -> dict:
+    """Counter contribution of one driver document"""
+    return {
+        "activeDrivers": sign * (1 if driver.get("status") == "online" else 0),
+        "ratingSum": sign * driver.get("rating", 0)
+    }
+
+def merge_metrics(*parts: dict) -> dict:
+    merged = {}
+    for part in parts:
+        for field, value in part.items():
+            merged[field] = merged.get(field, 0) + value
+    return merged
+
+async def reconcile_metrics() -> dict:
+    """Recompute the counters from source, correct them and report the drift.
+
+    The correction is applied as an $inc of (source - stored), with the stored
+    values read after the aggregation, so a bump_metrics $inc landing while
+    the reconcile runs is kept instead of being overwritten. The version field
+    stops two concurrent reconciles from applying the same correction twice.
+    """
+    source = await _compute_stats_from_source()
+    current = await db.metrics.find_one(METRICS_FILTER, {"_id": 0}) or {}
+    today = datetime.now(timezone.utc).strftime('%Y-%m-%d')
+    reconciled_at = datetime.now(timezone.utc).isoformat()
+    
+    if not current:
+        await db.metrics.update_one(
+            METRICS_FILTER,
+            {"$setOnInsert": {
+                **{field: source[field] for field in METRICS_COUNTERS},
+                "ridesByDay": {today: source["todayRides"]},
+                "ordersByDay": {today: source["todayOrders"]},
+                "reconciledAt": reconciled_at,
+                "version": 1
+            }},
+            upsert=True
+        )
+        response_cache.invalidate("stats")
+        return {"reconciledAt": reconciled_at, "drift": {}, "initialized": True}
+    
+    drift, correction, stale_days = {}, {}, {}
+    for field in METRICS_COUNTERS:
+        stored = current.get(field, 0)
+        if stored != source[field]:
+            correction[field] = source[field] - stored
+            if field in current:
+                drift[field] = round(stored - source[field], 2)
+    for field, by_day, source_field in (("todayRides", "ridesByDay", "todayRides"), ("todayOrders", "ordersByDay", "todayOrders")):
+        stored_days = current.get(by_day, {})
+        stored = stored_days.get(today, 0)
+        if stored != source[source_field]:
+            correction[f"{by_day}.{today}"] = source[source_field] - stored
+            if today in stored_days:
+                drift[field] = stored - source[source_field]
+        # Per-day maps are pruned to today
+        stale_days.update({f"{by_day}.{day}": "" for day in stored_days if day != today})
+    
+    update = {"$inc": {**correction, "version": 1}, "$set": {"reconciledAt": reconciled_at}}
+    if stale_days:
+        update["$unset"] = stale_days
+    result = await db.metrics.update_one({**METRICS_FILTER, "version": current.get("version")}, update)
+    if result.matched_count == 0:
+        # Another worker reconciled in between; its correction already covers this one
+        return {"reconciledAt": reconciled_at, "drift": {}, "initialized": False, "skipped": True}
+    
+    response_cache.invalidate("stats")
+    if drift:
+        logger.warning(f"Metrics drift corrected: {drift}")
+    return {"reconciledAt": reconciled_at, "drift": drift, "initialized": False}
+
+async def metrics_reconcile_task():
+    """Background task recomputing the stats counters from source"""
+    while True:
+        await asyncio.sleep(METRICS_RECONCILE_INTERVAL_MINUTES * 60)
+        try:
+            await reconcile_metrics()
+        except Exception as e:
+            logger.error(f"Metrics reconcile error: {str(e)}")
 
 # ============== AUTH ROUTES ==============
 
@@ -391,15 +1394,19 @@ async def login(data: AdminLogin):
                 "id": str(uuid.uuid4()),
                 "name": "مدير النظام",
                 "email": "admin@transfers.com",
-                "password": hash_password("admin123"),
+                "password": await hash_password("admin123"),
                 "role": "super_admin"
             }
             await db.admins.insert_one(admin)
         else:
             raise HTTPException(status_code=401, detail="Invalid credentials")
     else:
-        if admin.get("password") != hash_password(data.password):
+        valid, needs_rehash = await verify_password(data.password, admin.get("password"))
+        if not valid:
             raise HTTPException(status_code=401, detail="Invalid credentials")
+        if needs_rehash:
+            # Transparent migration from legacy SHA-256 or outdated cost settings
+            await db.admins.update_one({"id": admin["id"]}, {"$set": {"password": await hash_password(data.password)}})
     
     token = create_token(admin["id"], admin["email"])
     
@@ -432,12 +1439,21 @@ async def register_user(data: UserRegister):
         "name": data.name,
         "email": data.email.lower(),
         "phone": data.phone or "",
-        "password": hash_password(data.password),
+        "password": await hash_password(data.password),
         "userType": data.userType,
-        "createdAt": datetime.now(timezone.utc).isoformat()
+        "createdAt": datetime.now(timezone.utc).isoformat(),
+        **user_search_fields(data.userId, data.name, data.email)
     }
     
-    await db.registered_users.insert_one(new_user)
+    try:
+        await db.registered_users.insert_one(new_user)
+    except DuplicateKeyError:
+        # سباق بين طلبين متزامنين بنفس اسم المستخدم أو البريد
+        raise HTTPException(status_code=400, detail="اسم المستخدم أو البريد الإلكتروني مسجل مسبقاً")
+    response_cache.invalidate("users")
+    await bump_metrics({"totalUsers": 1})
+    if USER_SEARCH_INDEX:
+        user_prefix_index.add(new_user)
     
     # إنشاء التوكن
     token = create_token(data.userId, data.email)
@@ -466,8 +1482,15 @@ async def user_login(data: LoginRequest):
         raise HTTPException(status_code=401, detail="البريد الإلكتروني غير مسجل")
     
     # التحقق من كلمة المرور
-    if user.get("password") != hash_password(data.password):
+    valid, needs_rehash = await verify_password(data.password, user.get("password"))
+    if not valid:
         raise HTTPException(status_code=401, detail="كلمة المرور غير صحيحة")
+    if needs_rehash:
+        # ترحيل شفاف من SHA-256 القديم أو إعدادات كلفة قديمة
+        await db.registered_users.update_one(
+            {"userId": user["userId"]},
+            {"$set": {"password": await hash_password(data.password)}}
+        )
     
     # إنشاء التوكن
     token = create_token(user["userId"], user["email"])
@@ -491,21 +1514,39 @@ async def check_user_exists(user_id: str):
     return {"exists": existing is not None}
 
 @auth_router.get("/search-users")
-async def search_users(q: str = ""):
+async def search_users(q: str = "", mode: str = "prefix"):
     """البحث عن المستخدمين بالاسم أو اسم المستخدم أو البريد"""
-    if not q or len(q) < 2:
+    query_norm = normalize_search_text(q)
+    if len(query_norm) < 2:
         return {"users": []}
     
-    # البحث في registered_users
-    query = {
-        "$or": [
-            {"userId": {"$regex": q, "$options": "i"}},
-            {"name": {"$regex": q, "$options": "i"}},
-            {"email": {"$regex": q, "$options": "i"}}
-        ]
-    }
-    
-    users = await db.registered_users.find(query, {"_id": 0, "password": 0}).to_list(20)
+    projection = {"_id": 0, "password": 0}
+    if mode == "prefix" and USER_SEARCH_INDEX and user_prefix_index.ready:
+        # الفهرس في الذاكرة؛ قاعدة البيانات احتياط طالما الفهرس غير جاهز
+        user_prefix_index.hits += 1
+        users = user_prefix_index.search(query_norm)
+    elif mode == "text" and SEARCH_TEXT_INDEX:
+        # مطابقة كلمات كاملة عبر فهرس النص مرتبة حسب الصلة
+        users = await db.registered_users.find(
+            {"$text": {"$search": query_norm}},
+            {**projection, "score": {"$meta": "textScore"}}
+        ).sort([("score", {"$meta": "textScore"})]).to_list(20)
+    else:
+        # بادئة مثبتة ومهربة على الحقول المطبعة فتستخدم الفهارس
+        prefix = {"$regex": "^" + re.escape(query_norm)}
+        users = await db.registered_users.find(
+            {"$or": [
+                {"userIdNorm": prefix},
+                {"nameNorm": prefix},
+                {"nameTokens": prefix},
+                {"emailNorm": prefix}
+            ]},
+            projection
+        ).limit(50).to_list(50)
+        users.sort(key=lambda u: (-rank_search_match(u, query_norm), len(u.get("name", ""))))
+        users = users[:20]
+        if USER_SEARCH_INDEX:
+            user_prefix_index.fallbacks += 1
     
     # تحويل الحقول للشكل المطلوب للدردشة
     result = []
@@ -524,6 +1565,11 @@ async def search_users(q: str = ""):
     
     return {"users": result}
 
+@auth_router.get("/search-index/stats")
+async def get_search_index_stats(payload: dict = Depends(verify_token)):
+    """حالة فهرس البحث في الذاكرة وحجمه التقريبي (للمدير فقط)"""
+    return {"enabled": USER_SEARCH_INDEX, **user_prefix_index.footprint()}
+
 @auth_router.get("/user/{user_id}")
 async def get_user_by_id(user_id: str):
     """جلب مستخدم بواسطة اسم المستخدم"""
@@ -544,6 +1590,22 @@ async def get_user_by_id(user_id: str):
         "userType": user.get("userType", "rider")
     }
 
+@auth_router.post("/logout")
+async def logout(credentials: HTTPAuthorizationCredentials = Depends(security), payload: dict = Depends(verify_token)):
+    token = credentials.credentials
+    exp = payload.get("exp")
+    token_cache.revoke(token, exp)
+    await db.revoked_tokens.update_one(
+        {"signature": _token_signature(token)},
+        {"$set": {
+            "signature": _token_signature(token),
+            "exp": exp,
+            "expiresAt": datetime.fromtimestamp(exp, timezone.utc) if exp else datetime.now(timezone.utc) + timedelta(hours=JWT_EXPIRATION_HOURS)
+        }},
+        upsert=True
+    )
+    return {"message": "Logged out"}
+
 @auth_router.get("/me")
 async def get_current_admin(payload: dict = Depends(verify_token)):
     admin = await db.admins.find_one({"email": payload["email"]}, {"_id": 0, "password": 0})
@@ -553,37 +1615,102 @@ async def get_current_admin(payload: dict = Depends(verify_token)):
 
 # ============== USERS ROUTES ==============
 
+USER_SORT_FIELDS = {"name", "email", "status", "joined", "rides", "orders"}
+USER_LIST_FIELDS = ["id", "name", "email", "phone", "status", "rides", "orders", "joined", "avatar", "username"]
+
+def _users_union_pipeline() -> list:
+    """users ∪ registered_users in the User shape; registered accounts already
+    present in users (same id or email) are dropped via indexed lookups"""
+    return [
+        {"$project": {**{f: 1 for f in USER_LIST_FIELDS}, "_source": {"$literal": 0}}},
+        {"$unionWith": {"coll": "registered_users", "pipeline": [
+            # let + $expr rather than localField + pipeline, which needs MongoDB 5.0
+            {"$lookup": {"from": "users", "let": {"userId": "$userId"}, "pipeline": [
+                {"$match": {"$expr": {"$eq": ["$id", "$$userId"]}}}, {"$project": {"_id": 1}}, {"$limit": 1}
+            ], "as": "_byId"}},
+            {"$lookup": {"from": "users", "let": {"email": "$email"}, "pipeline": [
+                {"$match": {"$expr": {"$eq": ["$email", "$$email"]}}}, {"$project": {"_id": 1}}, {"$limit": 1}
+            ], "as": "_byEmail"}},
+            {"$match": {"_byId": {"$size": 0}, "_byEmail": {"$size": 0}}},
+            # تحويل الحقول لتتوافق مع نموذج User
+            {"$project": {
+                "id": {"$ifNull": ["$userId", ""]},
+                "name": {"$ifNull": ["$name", ""]},
+                "email": {"$ifNull": ["$email", ""]},
+                "phone": {"$ifNull": ["$phone", ""]},
+                "status": "active",
+                "rides": {"$literal": 0},
+                "orders": {"$literal": 0},
+                "joined": {"$substrCP": [{"$ifNull": ["$createdAt", ""]}, 0, 10]},
+                "avatar": {"$concat": ["https://ui-avatars.com/api/?name=", {"$ifNull": ["$name", ""]}, "&background=6366f1&color=fff"]},
+                "username": {"$ifNull": ["$userId", ""]},
+                "_source": {"$literal": 1}
+            }}
+        ]}}
+    ]
+
 @users_router.get("", response_model=List[User])
-async def get_users(payload: dict = Depends(verify_token)):
-    # جلب المستخدمين من كلا الجدولين
-    users = await db.users.find({}, {"_id": 0}).to_list(1000)
-    
-    # جلب المستخدمين المسجلين وتحويلهم للشكل المطلوب
-    registered = await db.registered_users.find({}, {"_id": 0, "password": 0}).to_list(1000)
-    for reg_user in registered:
-        # تحويل الحقول لتتوافق مع نموذج User
-        user_data = {
-            "id": reg_user.get("userId", ""),
-            "name": reg_user.get("name", ""),
-            "email": reg_user.get("email", ""),
-            "phone": reg_user.get("phone", ""),
-            "status": "active",
-            "rides": 0,
-            "orders": 0,
-            "joined": reg_user.get("createdAt", "")[:10] if reg_user.get("createdAt") else "",
-            "avatar": f"https://ui-avatars.com/api/?name={reg_user.get('name', '')}&background=6366f1&color=fff",
-            "username": reg_user.get("userId", "")
-        }
-        # تجنب التكرار
-        if not any(u.get("id") == user_data["id"] or u.get("email") == user_data["email"] for u in users):
-            users.append(user_data)
+async def get_users(response: Response, params: ListParams = Depends(), payload: dict = Depends(verify_token)):
+    async def load():
+        return await _load_users(params)
+    items, headers = await response_cache.get_or_load("users", params.cache_params(), load)
+    return list_response(response, params, items, headers)
+
+async def _load_users(params: ListParams):
+    """One page of users from both collections, merged and paginated inside MongoDB"""
+    sort_key = _list_sort_key(params, USER_SORT_FIELDS)
+    # الترتيب الافتراضي يحافظ على الترتيب القديم: جدول users أولاً ثم المسجلون
+    keys = ["_source", "_id"] if sort_key == "_id" else [sort_key, "_source", "_id"]
+    
+    pipeline = _users_union_pipeline()
+    if params.statuses:
+        pipeline.append({"$match": {"status": {"$in": params.statuses}}})
+    count_pipeline = pipeline + [{"$count": "total"}]
+    if params.cursor:
+        pipeline.append({"$match": keyset_match(keys, params.cursor, params.direction)})
+    pipeline.append({"$sort": {k: params.direction for k in keys}})
+    if params.page and not params.cursor:
+        pipeline.append({"$skip": (params.page - 1) * params.limit})
+    pipeline.append({"$limit": params.limit + 1})
+    
+    if params.statuses:
+        count_task = db.users.aggregate(count_pipeline, allowDiskUse=True).to_list(1)
+    else:
+        # تقدير: مجموع الجدولين قبل إزالة التكرار
+        count_task = asyncio.gather(db.users.estimated_document_count(), db.registered_users.estimated_document_count())
+    docs, counted = await asyncio.gather(db.users.aggregate(pipeline, allowDiskUse=True).to_list(params.limit + 1), count_task)
+    if params.statuses:
+        total = counted[0]["total"] if counted else 0
+    else:
+        total = sum(counted)
+    
+    headers = {"X-Total-Count": str(total)}
+    if len(docs) > params.limit:
+        docs = docs[:params.limit]
+        headers["X-Next-Cursor"] = keyset_cursor(docs[-1], keys)
     
-    return users
+    keep = set(params.fields) | {"id"} if params.fields else None
+    users = []
+    for doc in docs:
+        doc.pop("_id", None)
+        doc.pop("_source", None)
+        users.append({k: v for k, v in doc.items() if k in keep} if keep else doc)
+    return users, headers
+
+@users_router.get("/export")
+async def export_users(format: str = Query("ndjson", pattern="^(ndjson|csv)$"), payload: dict = Depends(verify_token)):
+    cursor = db.users.aggregate(
+        _users_union_pipeline() + [{"$project": {"_source": 0}}],
+        allowDiskUse=True, batchSize=EXPORT_BATCH_SIZE
+    )
+    return export_response(cursor, format, USER_LIST_FIELDS, "users")
 
 @users_router.post("", response_model=User)
 async def create_user(user: UserCreate, payload: dict = Depends(verify_token)):
     user_obj = User(**user.model_dump())
     await db.users.insert_one(user_obj.model_dump())
+    response_cache.invalidate("users")
+    await bump_metrics({"totalUsers": 1})
     return user_obj
 
 @users_router.put("/{user_id}", response_model=User)
@@ -599,6 +1726,7 @@ async def update_user(user_id: str, update: UserUpdate, payload: dict = Depends(
     )
     if not result:
         raise HTTPException(status_code=404, detail="User not found")
+    response_cache.invalidate("users")
     
     result.pop("_id", None)
     return result
@@ -608,19 +1736,27 @@ async def delete_user(user_id: str, payload: dict = Depends(verify_token)):
     result = await db.users.delete_one({"id": user_id})
     if result.deleted_count == 0:
         raise HTTPException(status_code=404, detail="User not found")
+    response_cache.invalidate("users")
+    await bump_metrics({"totalUsers": -1})
     return {"message": "User deleted"}
 
 # ============== DRIVERS ROUTES ==============
 
+DRIVER_SORT_FIELDS = {"name", "status", "rating", "rides", "earnings"}
+
 @drivers_router.get("", response_model=List[Driver])
-async def get_drivers(payload: dict = Depends(verify_token)):
-    drivers = await db.drivers.find({}, {"_id": 0}).to_list(1000)
-    return drivers
+async def get_drivers(response: Response, params: ListParams = Depends(), payload: dict = Depends(verify_token)):
+    async def load():
+        return await paginate_collection(db.drivers, params, DRIVER_SORT_FIELDS)
+    items, headers = await response_cache.get_or_load("drivers", params.cache_params(), load)
+    return list_response(response, params, items, headers)
 
 @drivers_router.post("", response_model=Driver)
 async def create_driver(driver: DriverCreate, payload: dict = Depends(verify_token)):
     driver_obj = Driver(**driver.model_dump())
     await db.drivers.insert_one(driver_obj.model_dump())
+    response_cache.invalidate("drivers")
+    await bump_metrics(merge_metrics({"totalDrivers": 1}, driver_metrics(driver_obj.model_dump())))
     return driver_obj
 
 @drivers_router.put("/{driver_id}", response_model=Driver)
@@ -629,15 +1765,18 @@ async def update_driver(driver_id: str, update: DriverUpdate, payload: dict = De
     if not update_data:
         raise HTTPException(status_code=400, detail="No data to update")
     
-    result = await db.drivers.find_one_and_update(
+    before = await db.drivers.find_one_and_update(
         {"id": driver_id},
         {"$set": update_data},
-        return_document=True
+        return_document=ReturnDocument.BEFORE
     )
-    if not result:
+    if not before:
         raise HTTPException(status_code=404, detail="Driver not found")
     
-    result.pop("_id", None)
+    before.pop("_id", None)
+    result = {**before, **update_data}
+    response_cache.invalidate("drivers")
+    await bump_metrics(merge_metrics(driver_metrics(result), driver_metrics(before, -1)))
     return result
 
 @drivers_router.put("/{driver_id}/verify")
@@ -649,27 +1788,36 @@ async def verify_driver(driver_id: str, payload: dict = Depends(verify_token)):
     )
     if not result:
         raise HTTPException(status_code=404, detail="Driver not found")
+    response_cache.invalidate("drivers")
     result.pop("_id", None)
     return result
 
 @drivers_router.delete("/{driver_id}")
 async def delete_driver(driver_id: str, payload: dict = Depends(verify_token)):
-    result = await db.drivers.delete_one({"id": driver_id})
-    if result.deleted_count == 0:
+    result = await db.drivers.find_one_and_delete({"id": driver_id})
+    if not result:
         raise HTTPException(status_code=404, detail="Driver not found")
+    response_cache.invalidate("drivers")
+    await bump_metrics(merge_metrics({"totalDrivers": -1}, driver_metrics(result, -1)))
     return {"message": "Driver deleted"}
 
 # ============== RESTAURANTS ROUTES ==============
 
+RESTAURANT_SORT_FIELDS = {"name", "category", "status", "rating", "orders", "commission"}
+
 @restaurants_router.get("", response_model=List[Restaurant])
-async def get_restaurants(payload: dict = Depends(verify_token)):
-    restaurants = await db.restaurants.find({}, {"_id": 0}).to_list(1000)
-    return restaurants
+async def get_restaurants(response: Response, params: ListParams = Depends(), payload: dict = Depends(verify_token)):
+    async def load():
+        return await paginate_collection(db.restaurants, params, RESTAURANT_SORT_FIELDS)
+    items, headers = await response_cache.get_or_load("restaurants", params.cache_params(), load)
+    return list_response(response, params, items, headers)
 
 @restaurants_router.post("", response_model=Restaurant)
 async def create_restaurant(restaurant: RestaurantCreate, payload: dict = Depends(verify_token)):
     restaurant_obj = Restaurant(**restaurant.model_dump())
     await db.restaurants.insert_one(restaurant_obj.model_dump())
+    response_cache.invalidate("restaurants")
+    await bump_metrics({"totalRestaurants": 1})
     return restaurant_obj
 
 @restaurants_router.put("/{restaurant_id}", response_model=Restaurant)
@@ -685,6 +1833,7 @@ async def update_restaurant(restaurant_id: str, update: RestaurantUpdate, payloa
     )
     if not result:
         raise HTTPException(status_code=404, detail="Restaurant not found")
+    response_cache.invalidate("restaurants")
     
     result.pop("_id", None)
     return result
@@ -694,20 +1843,41 @@ async def delete_restaurant(restaurant_id: str, payload: dict = Depends(verify_t
     result = await db.restaurants.delete_one({"id": restaurant_id})
     if result.deleted_count == 0:
         raise HTTPException(status_code=404, detail="Restaurant not found")
+    response_cache.invalidate("restaurants")
+    await bump_metrics({"totalRestaurants": -1})
     return {"message": "Restaurant deleted"}
 
 # ============== RIDES ROUTES ==============
 
+RIDE_SORT_FIELDS = {"date", "status", "fare", "user", "driver"}
+RIDE_FIELD_ALIASES = {"from": "from_location", "to": "to_location"}
+
 @rides_router.get("")
-async def get_rides(payload: dict = Depends(verify_token)):
-    rides = await db.rides.find({}, {"_id": 0}).to_list(1000)
+async def get_rides(response: Response, params: ListParams = Depends(), payload: dict = Depends(verify_token)):
+    rides, headers = await paginate_collection(db.rides, params, RIDE_SORT_FIELDS, RIDE_FIELD_ALIASES)
     # Convert field names for frontend
     for ride in rides:
-        if "from_location" in ride:
-            ride["from"] = ride.pop("from_location")
-        if "to_location" in ride:
-            ride["to"] = ride.pop("to_location")
-    return rides
+        _ride_for_frontend(ride)
+    return list_response(response, params, rides, headers)
+
+RIDE_EXPORT_COLUMNS = ["id", "user", "driver", "from", "to", "status", "fare", "date", "duration"]
+
+def _ride_for_frontend(ride: dict) -> dict:
+    if "from_location" in ride:
+        ride["from"] = ride.pop("from_location")
+    if "to_location" in ride:
+        ride["to"] = ride.pop("to_location")
+    return ride
+
+@rides_router.get("/export")
+async def export_rides(
+    format: str = Query("ndjson", pattern="^(ndjson|csv)$"),
+    date_from: Optional[str] = None,
+    date_to: Optional[str] = None,
+    payload: dict = Depends(verify_token)
+):
+    cursor = db.rides.find(date_range_filter(date_from, date_to), batch_size=EXPORT_BATCH_SIZE).sort("date", ASCENDING)
+    return export_response(cursor, format, RIDE_EXPORT_COLUMNS, "rides", _ride_for_frontend)
 
 @rides_router.post("")
 async def create_ride(ride: RideCreate, payload: dict = Depends(verify_token)):
@@ -723,6 +1893,7 @@ async def create_ride(ride: RideCreate, payload: dict = Depends(verify_token)):
         "duration": "-"
     }
     await db.rides.insert_one(ride_obj)
+    await bump_metrics({"totalRides": 1, f"ridesByDay.{ride_obj['date'][:10]}": 1})
     ride_obj.pop("_id", None)
     ride_obj["from"] = ride_obj.pop("from_location")
     ride_obj["to"] = ride_obj.pop("to_location")
@@ -742,15 +1913,33 @@ async def update_ride_status(ride_id: str, status: str, payload: dict = Depends(
 
 # ============== ORDERS ROUTES ==============
 
+ORDER_SORT_FIELDS = {"date", "status", "total", "items", "user", "restaurant"}
+
 @orders_router.get("")
-async def get_orders(payload: dict = Depends(verify_token)):
-    orders = await db.orders.find({}, {"_id": 0}).to_list(1000)
-    return orders
+async def get_orders(response: Response, params: ListParams = Depends(), payload: dict = Depends(verify_token)):
+    orders, headers = await paginate_collection(db.orders, params, ORDER_SORT_FIELDS)
+    return list_response(response, params, orders, headers)
+
+ORDER_EXPORT_COLUMNS = ["id", "user", "restaurant", "items", "total", "status", "date", "driver"]
+
+@orders_router.get("/export")
+async def export_orders(
+    format: str = Query("ndjson", pattern="^(ndjson|csv)$"),
+    date_from: Optional[str] = None,
+    date_to: Optional[str] = None,
+    payload: dict = Depends(verify_token)
+):
+    cursor = db.orders.find(date_range_filter(date_from, date_to), batch_size=EXPORT_BATCH_SIZE).sort("date", ASCENDING)
+    return export_response(cursor, format, ORDER_EXPORT_COLUMNS, "orders")
 
 @orders_router.post("")
 async def create_order(order: OrderCreate, payload: dict = Depends(verify_token)):
     order_obj = Order(**order.model_dump())
     await db.orders.insert_one(order_obj.model_dump())
+    await bump_metrics(merge_metrics(
+        {"totalOrders": 1, f"ordersByDay.{order_obj.date[:10]}": 1},
+        order_metrics(order_obj.model_dump())
+    ))
     return order_obj
 
 @orders_router.put("/{order_id}/status")
@@ -759,22 +1948,28 @@ async def update_order_status(order_id: str, status: str, driver: Optional[str]
     if driver:
         update_data["driver"] = driver
     
-    result = await db.orders.find_one_and_update(
+    before = await db.orders.find_one_and_update(
         {"id": order_id},
         {"$set": update_data},
-        return_document=True
+        return_document=ReturnDocument.BEFORE
     )
-    if not result:
+    if not before:
         raise HTTPException(status_code=404, detail="Order not found")
-    result.pop("_id", None)
+    before.pop("_id", None)
+    result = {**before, **update_data}
+    await bump_metrics(merge_metrics(order_metrics(result), order_metrics(before, -1)))
     return result
 
 # ============== PROMOTIONS ROUTES ==============
 
+PROMOTION_SORT_FIELDS = {"code", "status", "discount", "used", "maxUses", "expires"}
+
 @promotions_router.get("", response_model=List[Promotion])
-async def get_promotions(payload: dict = Depends(verify_token)):
-    promotions = await db.promotions.find({}, {"_id": 0}).to_list(1000)
-    return promotions
+async def get_promotions(response: Response, params: ListParams = Depends(), payload: dict = Depends(verify_token)):
+    async def load():
+        return await paginate_collection(db.promotions, params, PROMOTION_SORT_FIELDS)
+    items, headers = await response_cache.get_or_load("promotions", params.cache_params(), load)
+    return list_response(response, params, items, headers)
 
 @promotions_router.post("", response_model=Promotion)
 async def create_promotion(promotion: PromotionCreate, payload: dict = Depends(verify_token)):
@@ -784,7 +1979,11 @@ async def create_promotion(promotion: PromotionCreate, payload: dict = Depends(v
         raise HTTPException(status_code=400, detail="Promotion code already exists")
     
     promotion_obj = Promotion(**promotion.model_dump())
-    await db.promotions.insert_one(promotion_obj.model_dump())
+    try:
+        await db.promotions.insert_one(promotion_obj.model_dump())
+    except DuplicateKeyError:
+        raise HTTPException(status_code=400, detail="Promotion code already exists")
+    response_cache.invalidate("promotions")
     return promotion_obj
 
 @promotions_router.put("/{promotion_id}", response_model=Promotion)
@@ -793,13 +1992,17 @@ async def update_promotion(promotion_id: str, update: PromotionUpdate, payload:
     if not update_data:
         raise HTTPException(status_code=400, detail="No data to update")
     
-    result = await db.promotions.find_one_and_update(
-        {"id": promotion_id},
-        {"$set": update_data},
-        return_document=True
-    )
+    try:
+        result = await db.promotions.find_one_and_update(
+            {"id": promotion_id},
+            {"$set": update_data},
+            return_document=True
+        )
+    except DuplicateKeyError:
+        raise HTTPException(status_code=400, detail="Promotion code already exists")
     if not result:
         raise HTTPException(status_code=404, detail="Promotion not found")
+    response_cache.invalidate("promotions")
     
     result.pop("_id", None)
     return result
@@ -809,71 +2012,188 @@ async def delete_promotion(promotion_id: str, payload: dict = Depends(verify_tok
     result = await db.promotions.delete_one({"id": promotion_id})
     if result.deleted_count == 0:
         raise HTTPException(status_code=404, detail="Promotion not found")
+    response_cache.invalidate("promotions")
     return {"message": "Promotion deleted"}
 
 # ============== STATS ROUTES ==============
 
+async def _compute_stats_from_source() -> dict:
+    """Compute dashboard stats from the source collections in one concurrent batch"""
+    today = datetime.now(timezone.utc).strftime('%Y-%m-%d')
+    
+    async def group_by_status(collection, **accumulators):
+        pipeline = [{"$group": {"_id": "$status", "count": {"$sum": 1}, **accumulators}}]
+        return {row["_id"]: row async for row in collection.aggregate(pipeline)}
+    
+    (
+        total_users,
+        total_registered,
+        total_restaurants,
+        total_rides,
+        drivers_by_status,
+        orders_by_status,
+        today_rides,
+        today_orders
+    ) = await asyncio.gather(
+        # Exact counts: collection metadata can lag after unclean shutdowns or
+        # on sharded clusters and would be reported as drift
+        db.users.count_documents({}),
+        db.registered_users.count_documents({}),
+        db.restaurants.count_documents({}),
+        db.rides.count_documents({}),
+        # One pass per collection yields counts, revenue and rating per status
+        group_by_status(db.drivers, ratingSum={"$sum": {"$ifNull": ["$rating", 0]}}),
+        group_by_status(db.orders, totalSum={"$sum": {"$ifNull": ["$total", 0]}}),
+        # Anchored prefix regexes use the date indexes
+        db.rides.count_documents({"date": {"$regex": f"^{today}"}}),
+        db.orders.count_documents({"date": {"$regex": f"^{today}"}})
+    )
+    
+    total_drivers = sum(row["count"] for row in drivers_by_status.values())
+    rating_sum = sum(row["ratingSum"] for row in drivers_by_status.values())
+    
+    return {
+        "totalUsers": total_users + total_registered,
+        "totalDrivers": total_drivers,
+        "totalRestaurants": total_restaurants,
+        "totalRides": total_rides,
+        "totalOrders": sum(row["count"] for row in orders_by_status.values()),
+        "totalRevenue": orders_by_status.get("delivered", {}).get("totalSum", 0),
+        "activeDrivers": drivers_by_status.get("online", {}).get("count", 0),
+        "pendingOrders": sum(orders_by_status.get(s, {}).get("count", 0) for s in ("preparing", "on_way")),
+        "todayRides": today_rides,
+        "todayOrders": today_orders,
+        "ratingSum": rating_sum,
+        "averageRating": round(rating_sum / max(total_drivers, 1), 1)
+    }
+
 @stats_router.get("", response_model=Stats)
 async def get_stats(payload: dict = Depends(verify_token)):
-    # Get counts from database
-    total_users = await db.users.count_documents({})
-    # إضافة المستخدمين المسجلين
-    total_registered = await db.registered_users.count_documents({})
-    total_users = total_users + total_registered
-    
-    total_drivers = await db.drivers.count_documents({})
-    total_restaurants = await db.restaurants.count_documents({})
-    total_rides = await db.rides.count_documents({})
-    total_orders = await db.orders.count_documents({})
-    active_drivers = await db.drivers.count_documents({"status": "online"})
-    pending_orders = await db.orders.count_documents({"status": {"$in": ["preparing", "on_way"]}})
-    
-    # Calculate revenue from completed orders
-    completed_orders = await db.orders.find({"status": "delivered"}, {"_id": 0, "total": 1}).to_list(10000)
-    total_revenue = sum(order.get("total", 0) for order in completed_orders)
-    
-    # Calculate average rating
-    drivers = await db.drivers.find({}, {"_id": 0, "rating": 1}).to_list(1000)
-    avg_rating = sum(d.get("rating", 0) for d in drivers) / max(len(drivers), 1)
-    
-    # Today's stats
-    today = datetime.now(timezone.utc).strftime('%Y-%m-%d')
-    today_rides = await db.rides.count_documents({"date": {"$regex": f"^{today}"}})
-    today_orders = await db.orders.count_documents({"date": {"$regex": f"^{today}"}})
+    return await response_cache.get_or_load("stats", {}, _load_stats)
+
+async def _load_stats() -> Stats:
+    # O(1) read of the materialized counters
+    metrics = await db.metrics.find_one(METRICS_FILTER, {"_id": 0})
+    if not metrics or "reconciledAt" not in metrics:
+        await reconcile_metrics()
+        metrics = await db.metrics.find_one(METRICS_FILTER, {"_id": 0})
     
+    today = datetime.now(timezone.utc).strftime('%Y-%m-%d')
     return Stats(
-        totalUsers=total_users,
-        totalDrivers=total_drivers,
-        totalRestaurants=total_restaurants,
-        totalRides=total_rides,
-        totalOrders=total_orders,
-        totalRevenue=total_revenue,
-        activeDrivers=active_drivers,
-        pendingOrders=pending_orders,
-        todayRides=today_rides,
-        todayOrders=today_orders,
+        totalUsers=metrics.get("totalUsers", 0),
+        totalDrivers=metrics.get("totalDrivers", 0),
+        totalRestaurants=metrics.get("totalRestaurants", 0),
+        totalRides=metrics.get("totalRides", 0),
+        totalOrders=metrics.get("totalOrders", 0),
+        totalRevenue=metrics.get("totalRevenue", 0),
+        activeDrivers=metrics.get("activeDrivers", 0),
+        pendingOrders=metrics.get("pendingOrders", 0),
+        todayRides=metrics.get("ridesByDay", {}).get(today, 0),
+        todayOrders=metrics.get("ordersByDay", {}).get(today, 0),
         monthlyGrowth=12.5,
-        averageRating=round(avg_rating, 1)
+        averageRating=round(metrics.get("ratingSum", 0) / max(metrics.get("totalDrivers", 0), 1), 1)
     )
 
+@stats_router.post("/reconcile")
+async def reconcile_stats(payload: dict = Depends(verify_token)):
+    """Recompute the stats counters from the source collections and report drift"""
+    return await reconcile_metrics()
+
+WEEKDAY_NAMES = ['الإثنين', 'الثلاثاء', 'الأربعاء', 'الخميس', 'الجمعة', 'السبت', 'الأحد']
+MONTH_NAMES = ['يناير', 'فبراير', 'مارس', 'أبريل', 'مايو', 'يونيو', 'يوليو', 'أغسطس', 'سبتمبر', 'أكتوبر', 'نوفمبر', 'ديسمبر']
+
+def _resolve_timezone(tz: str) -> ZoneInfo:
+    try:
+        return ZoneInfo(tz)
+    except (ZoneInfoNotFoundError, ValueError):
+        raise HTTPException(status_code=400, detail=f"Unknown timezone: {tz}")
+
+def _local_bucket(date_field: str, fmt: str, tz: str) -> dict:
+    """Expression converting a stored UTC 'YYYY-MM-DD HH:MM' string to a local date bucket"""
+    return {"$dateToString": {
+        "format": fmt,
+        "timezone": tz,
+        "date": {"$dateFromString": {
+            "dateString": date_field,
+            "format": "%Y-%m-%d %H:%M",
+            "timezone": "UTC",
+            "onError": None,
+            "onNull": None
+        }}
+    }}
+
 @stats_router.get("/weekly")
-async def get_weekly_stats(payload: dict = Depends(verify_token)):
-    # Return weekly chart data
-    days = ['السبت', 'الأحد', 'الإثنين', 'الثلاثاء', 'الأربعاء', 'الخميس', 'الجمعة']
+async def get_weekly_stats(days: int = 7, tz: str = "UTC", payload: dict = Depends(verify_token)):
+    # Rides and orders per local day, grouped in a single aggregation
+    zone = _resolve_timezone(tz)
+    days = max(1, min(days, 366))
+    today_local = datetime.now(zone).date()
+    first_day = today_local - timedelta(days=days - 1)
+    start_utc = datetime(first_day.year, first_day.month, first_day.day, tzinfo=zone).astimezone(timezone.utc)
+    # Stored dates are UTC strings, so the range bound is a plain indexed string comparison
+    date_match = {"$match": {"date": {"$gte": start_utc.strftime('%Y-%m-%d %H:%M')}}}
+    
+    pipeline = [
+        date_match,
+        {"$project": {"_id": 0, "date": 1, "kind": {"$literal": "rides"}}},
+        {"$unionWith": {"coll": "orders", "pipeline": [
+            date_match,
+            {"$project": {"_id": 0, "date": 1, "kind": {"$literal": "orders"}}}
+        ]}},
+        {"$group": {
+            "_id": {"day": _local_bucket("$date", "%Y-%m-%d", tz), "kind": "$kind"},
+            "count": {"$sum": 1}
+        }}
+    ]
+    counts = {}
+    async for row in db.rides.aggregate(pipeline):
+        counts[(row["_id"]["day"], row["_id"]["kind"])] = row["count"]
+    
     weekly = []
-    for i, day in enumerate(days):
-        rides_count = await db.rides.count_documents({}) // 7 + (i * 50)
-        orders_count = await db.orders.count_documents({}) // 7 + (i * 30)
-        weekly.append({"day": day, "rides": rides_count, "orders": orders_count})
+    for i in range(days):
+        day = first_day + timedelta(days=i)
+        key = day.isoformat()
+        weekly.append({
+            "day": WEEKDAY_NAMES[day.weekday()],
+            "date": key,
+            "rides": counts.get((key, "rides"), 0),
+            "orders": counts.get((key, "orders"), 0)
+        })
     return weekly
 
 @stats_router.get("/monthly")
-async def get_monthly_stats(payload: dict = Depends(verify_token)):
-    months = ['يناير', 'فبراير', 'مارس', 'أبريل', 'مايو', 'يونيو']
+async def get_monthly_stats(months: int = 6, tz: str = "UTC", payload: dict = Depends(verify_token)):
+    # Delivered order revenue per local calendar month
+    zone = _resolve_timezone(tz)
+    months = max(1, min(months, 60))
+    now_local = datetime.now(zone)
+    month_index = now_local.year * 12 + now_local.month - 1 - (months - 1)
+    first_year, first_month = divmod(month_index, 12)
+    start_utc = datetime(first_year, first_month + 1, 1, tzinfo=zone).astimezone(timezone.utc)
+    
+    pipeline = [
+        {"$match": {"status": "delivered", "date": {"$gte": start_utc.strftime('%Y-%m-%d %H:%M')}}},
+        {"$group": {
+            "_id": _local_bucket("$date", "%Y-%m", tz),
+            "revenue": {"$sum": {"$ifNull": ["$total", 0]}},
+            "orders": {"$sum": 1}
+        }}
+    ]
+    buckets = {}
+    async for row in db.orders.aggregate(pipeline):
+        buckets[row["_id"]] = row
+    
     monthly = []
-    for i, month in enumerate(months):
-        revenue = 85000 + (i * 10000)
-        monthly.append({"month": month, "revenue": revenue})
+    for i in range(months):
+        year, month = divmod(month_index + i, 12)
+        key = f"{year:04d}-{month + 1:02d}"
+        bucket = buckets.get(key, {})
+        monthly.append({
+            "month": MONTH_NAMES[month],
+            "key": key,
+            "revenue": bucket.get("revenue", 0),
+            "orders": bucket.get("orders", 0)
+        })
     return monthly
 
 # ============== SEED DATA ==============
@@ -951,63 +2271,363 @@ async def seed_database():
     await db.orders.insert_many(orders_data)
     await db.promotions.insert_many(promotions_data)
     
+    response_cache.clear()
+    await reconcile_metrics()
     return {"message": "Database seeded successfully"}
 
 @api_router.get("/")
 async def root():
     return {"message": "Transfers Admin API", "version": "1.0.0"}
 
+# ============== REAL-TIME CHAT ==============
+
+class ChatConnection:
+    """WebSocket of one user with a bounded outgoing queue"""
+    def __init__(self, websocket: WebSocket, user_id: str):
+        self.websocket = websocket
+        self.user_id = user_id
+        self.queue = asyncio.Queue(maxsize=CHAT_WS_QUEUE_SIZE)
+        self.overflowed = False
+        self.sender = None  # pump task
+
+    def offer(self, event: dict) -> bool:
+        """Queue an event without waiting; False when the client is not keeping up"""
+        try:
+            self.queue.put_nowait(event)
+            return True
+        except asyncio.QueueFull:
+            return False
+
+    async def pump(self):
+        """Drain the queue into the socket"""
+        while True:
+            event = await self.queue.get()
+            await self.websocket.send_json(event)
+
+class ChatHub:
+    """In-process fan-out of chat events to the sockets of their recipients"""
+    def __init__(self):
+        self.connections = {}
+        self.delivered = 0
+        self.dropped_connections = 0
+
+    def register(self, connection: ChatConnection):
+        self.connections.setdefault(connection.user_id, set()).add(connection)
+
+    def unregister(self, connection: ChatConnection):
+        user_connections = self.connections.get(connection.user_id)
+        if user_connections:
+            user_connections.discard(connection)
+            if not user_connections:
+                del self.connections[connection.user_id]
+
+    def dispatch(self, event: dict):
+        """Deliver an event to every local socket of its recipients"""
+        payload = {k: v for k, v in event.items() if k != "recipients"}
+        for user_id in event.get("recipients", []):
+            for connection in list(self.connections.get(user_id, ())):
+                if connection.offer(payload):
+                    self.delivered += 1
+                    continue
+                # Backpressure: a slow consumer is disconnected instead of buffering without bound.
+                # The client reconnects and catches up with the `after` cursor of /messages.
+                connection.overflowed = True
+                self.dropped_connections += 1
+                self.unregister(connection)
+                asyncio.create_task(self._close_slow_consumer(connection))
+
+    async def _close_slow_consumer(self, connection: ChatConnection):
+        if connection.sender:
+            connection.sender.cancel()
+        try:
+            await connection.websocket.close(code=1013, reason="Client too slow, reconnect to resync")
+        except Exception:
+            pass
+
+    def stats(self) -> dict:
+        return {
+            "users": len(self.connections),
+            "connections": sum(len(c) for c in self.connections.values()),
+            "delivered": self.delivered,
+            "droppedConnections": self.dropped_connections
+        }
+
+class ChatBroker(ABC):
+    """Transport that carries chat events to the hub of every worker"""
+    @abstractmethod
+    async def start(self, hub: ChatHub):
+        self.hub = hub
+
+    @abstractmethod
+    async def stop(self):
+        pass
+
+    @abstractmethod
+    async def publish(self, event: dict):
+        """Deliver an event to the hub of every worker, this one included"""
+
+class InMemoryChatBroker(ChatBroker):
+    """Local stand-in broker: events only reach sockets held by this process"""
+    async def start(self, hub: ChatHub):
+        await super().start(hub)
+
+    async def stop(self):
+        pass
+
+    async def publish(self, event: dict):
+        self.hub.dispatch(event)
+
+class MongoChatBroker(ChatBroker):
+    """Shares events between uvicorn workers through a tailable capped collection"""
+    def __init__(self, collection_name: str = "chat_events"):
+        self.collection_name = collection_name
+        self._task = None
+
+    async def start(self, hub: ChatHub):
+        await super().start(hub)
+        try:
+            await db.create_collection(self.collection_name, capped=True, size=CHAT_EVENTS_CAPPED_BYTES)
+        except CollectionInvalid:
+            pass  # موجودة مسبقاً
+        self._task = asyncio.create_task(self._tail())
+
+    async def stop(self):
+        if self._task:
+            self._task.cancel()
+
+    async def publish(self, event: dict):
+        await db[self.collection_name].insert_one(dict(event))
+
+    async def _tail(self):
+        collection = db[self.collection_name]
+        # Only events published after this worker started are relevant
+        last = await collection.find_one({}, sort=[("$natural", -1)])
+        last_id = last["_id"] if last else None
+        while True:
+            try:
+                # Resume by position, not by _id: ObjectIds from different workers
+                # are not ordered, but natural order in a capped collection is
+                # insertion order. Replay from the start, skipping up to last_id.
+                if last_id is not None and not await collection.find_one({"_id": last_id}, {"_id": 1}):
+                    logger.warning("Chat events were overwritten while the tail was down; some may be missed")
+                    last = await collection.find_one({}, sort=[("$natural", -1)])
+                    last_id = last["_id"] if last else None
+                skipping = last_id is not None
+                cursor = collection.find({}, cursor_type=CursorType.TAILABLE_AWAIT)
+                while cursor.alive:
+                    async for event in cursor:
+                        event_id = event.pop("_id")
+                        if skipping:
+                            skipping = event_id != last_id
+                            continue
+                        last_id = event_id
+                        self.hub.dispatch(event)
+                    await asyncio.sleep(0.1)
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.error(f"Chat event tail error: {str(e)}")
+            await asyncio.sleep(1)
+
+chat_hub = ChatHub()
+chat_broker = MongoChatBroker() if CHAT_BROKER == "mongo" else InMemoryChatBroker()
+
+async def publish_chat_event(event_type: str, conversation_id: str, data: dict, participants: Optional[List[str]] = None):
+    """نشر حدث دردشة لمشاركي المحادثة دون إفشال عملية الكتابة الأصلية"""
+    try:
+        if participants is None:
+            conversation = await db.conversations.find_one({"id": conversation_id}, {"_id": 0, "participants": 1})
+            participants = conversation.get("participants", []) if conversation else []
+        if not participants:
+            return
+        await chat_broker.publish({
+            "type": event_type,
+            "conversationId": conversation_id,
+            "data": data,
+            "recipients": participants
+        })
+    except Exception as e:
+        logger.error(f"Chat event publish failed: {str(e)}")
+
+def _log_pump_failure(task: asyncio.Task, connection: ChatConnection):
+    """تسجيل أخطاء مهمة الإرسال بدلاً من ضياعها بصمت"""
+    if task.cancelled():
+        return
+    error = task.exception()
+    if error is None:
+        return
+    # الإرسال إلى مقبس مغلق (قطع الاتصال أو إغلاق المستهلك البطيء) متوقع
+    websocket = connection.websocket
+    closed = WebSocketState.DISCONNECTED in (websocket.client_state, websocket.application_state)
+    if connection.overflowed or closed or isinstance(error, WebSocketDisconnect):
+        logger.debug(f"Chat websocket sender stopped for {connection.user_id}: {str(error)}")
+    else:
+        logger.error(f"Chat websocket sender failed for {connection.user_id}: {str(error)}")
+
+@chat_router.websocket("/ws/{user_id}")
+async def chat_websocket(websocket: WebSocket, user_id: str):
+    """قناة فورية لاستقبال الرسائل الجديدة وإشعارات القراءة والحذف
+
+    يُرسل التوكن في ?token= أو في أول إطار {"type": "auth", "token": "..."}
+    """
+    await websocket.accept()
+    token = websocket.query_params.get("token")
+    try:
+        if not token:
+            first = await asyncio.wait_for(websocket.receive_json(), timeout=CHAT_WS_AUTH_TIMEOUT_SECONDS)
+            if isinstance(first, dict) and first.get("type") == "auth":
+                token = first.get("token")
+        payload = decode_access_token(token) if isinstance(token, str) and token else None
+    except (HTTPException, asyncio.TimeoutError, ValueError, WebSocketDisconnect):
+        payload = None
+    if not payload or payload.get("sub") != user_id:
+        try:
+            await websocket.close(code=status.WS_1008_POLICY_VIOLATION, reason="Unauthorized")
+        except Exception:
+            pass
+        return
+    
+    connection = ChatConnection(websocket, user_id)
+    chat_hub.register(connection)
+    sender = connection.sender = asyncio.create_task(connection.pump())
+    sender.add_done_callback(lambda task: _log_pump_failure(task, connection))
+    try:
+        while True:
+            text = await websocket.receive_text()
+            try:
+                message = json.loads(text)
+            except ValueError:
+                continue
+            if isinstance(message, dict) and message.get("type") == "ping":
+                connection.offer({"type": "pong"})
+    except WebSocketDisconnect:
+        pass
+    except Exception as e:
+        if not connection.overflowed:
+            logger.error(f"Chat websocket error for {user_id}: {str(e)}")
+    finally:
+        chat_hub.unregister(connection)
+        sender.cancel()
+
+@chat_router.get("/realtime/stats")
+async def get_realtime_stats(payload: dict = Depends(verify_token)):
+    """إحصائيات الاتصالات الفورية (للمدير فقط)"""
+    return {"broker": CHAT_BROKER, **chat_hub.stats()}
+
 # ============== CHAT ROUTES ==============
 
+async def _last_messages_by_conversation(conversation_ids: List[str]) -> dict:
+    """جلب آخر رسالة لكل محادثة في استعلام تجميعي واحد"""
+    if not conversation_ids:
+        return {}
+    pipeline = [
+        {"$match": {"conversationId": {"$in": conversation_ids}}},
+        {"$sort": {"conversationId": 1, "createdAt": -1}},
+        {"$group": {"_id": "$conversationId", "message": {"$first": "$$ROOT"}}}
+    ]
+    last_messages = {}
+    async for row in db.messages.aggregate(pipeline):
+        row["message"].pop("_id", None)
+        last_messages[row["_id"]] = row["message"]
+    return last_messages
+
+async def _registered_users_by_id(user_ids: List[str]) -> dict:
+    """جلب المستخدمين المسجلين دفعة واحدة بدلاً من استعلام لكل مستخدم"""
+    if not user_ids:
+        return {}
+    users = await db.registered_users.find(
+        {"userId": {"$in": list(set(user_ids))}},
+        {"_id": 0, "password": 0}
+    ).to_list(len(user_ids))
+    return {user["userId"]: user for user in users}
+
+def _last_message_summary(message: dict) -> dict:
+    """ملخص آخر رسالة المخزن على وثيقة المحادثة"""
+    return {
+        "id": message.get("id"),
+        "text": message.get("content"),
+        "senderId": message.get("senderId"),
+        "senderName": message.get("senderName"),
+        "timestamp": message.get("createdAt"),
+        "read": message.get("read", False)
+    }
+
+async def _refresh_last_message(conversation_id: str):
+    """إعادة حساب ملخص آخر رسالة من مجموعة الرسائل (بعد الحذف أو الاستعادة)"""
+    last_msg = await db.messages.find_one(
+        {"conversationId": conversation_id},
+        {"_id": 0},
+        sort=[("createdAt", -1)]
+    )
+    await db.conversations.update_one(
+        {"id": conversation_id},
+        {"$set": {
+            "lastMessage": _last_message_summary(last_msg) if last_msg else None,
+            "lastMessageAt": last_msg.get("createdAt") if last_msg else None
+        }}
+    )
+
+async def _backfill_last_message_summaries(conversations: List[dict]):
+    """ترحيل المحادثات القديمة التي تخزن آخر رسالة كنص مختصر إلى الملخص الكامل"""
+    legacy = [
+        conv for conv in conversations
+        if conv.get("lastMessage") is not None
+        and not (isinstance(conv["lastMessage"], dict) and conv["lastMessage"].get("id"))
+    ]
+    if not legacy:
+        return
+    
+    last_messages = await _last_messages_by_conversation([conv.get("id") for conv in legacy])
+    updates = []
+    for conv in legacy:
+        last_msg = last_messages.get(conv.get("id"))
+        conv["lastMessage"] = _last_message_summary(last_msg) if last_msg else None
+        conv["lastMessageAt"] = last_msg.get("createdAt") if last_msg else None
+        updates.append(UpdateOne(
+            {"id": conv.get("id")},
+            {"$set": {"lastMessage": conv["lastMessage"], "lastMessageAt": conv["lastMessageAt"]}}
+        ))
+    await db.conversations.bulk_write(updates, ordered=False)
+
 @chat_router.get("/conversations/{user_id}")
 async def get_user_conversations(user_id: str):
     """جلب محادثات المستخدم مع بيانات المستخدم الآخر"""
+    # ملخص آخر رسالة محفوظ على المحادثة نفسها، فالقائمة قراءة واحدة مفهرسة
     conversations = await db.conversations.find(
         {"participants": user_id},
         {"_id": 0}
     ).sort("lastMessageAt", -1).to_list(100)
+    await _backfill_last_message_summaries(conversations)
+    
+    # إيجاد المستخدم الآخر في المحادثات الخاصة
+    other_user_ids = {}
+    for conv in conversations:
+        if conv.get("type") == "private":
+            other_user_id = next((p for p in conv.get("participants", []) if p != user_id), None)
+            if other_user_id:
+                other_user_ids[conv.get("id")] = other_user_id
+    
+    other_users = await _registered_users_by_id(list(other_user_ids.values()))
     
-    # إضافة بيانات المستخدم الآخر وآخر رسالة لكل محادثة
     result = []
     for conv in conversations:
         conv_data = dict(conv)
         
-        # جلب آخر رسالة
-        last_msg = await db.messages.find_one(
-            {"conversationId": conv.get("id")},
-            {"_id": 0},
-            sort=[("createdAt", -1)]
-        )
-        if last_msg:
-            conv_data["lastMessage"] = {
-                "id": last_msg.get("id"),
-                "text": last_msg.get("content"),
-                "senderId": last_msg.get("senderId"),
-                "senderName": last_msg.get("senderName"),
-                "timestamp": last_msg.get("createdAt"),
-                "read": last_msg.get("read", False)
-            }
-            conv_data["updatedAt"] = last_msg.get("createdAt")
+        if conv.get("lastMessage"):
+            conv_data["updatedAt"] = conv["lastMessage"].get("timestamp")
         
-        if conv.get("type") == "private":
-            # إيجاد المستخدم الآخر
-            other_user_id = next((p for p in conv.get("participants", []) if p != user_id), None)
-            if other_user_id:
-                other_user = await db.registered_users.find_one(
-                    {"userId": other_user_id}, 
-                    {"_id": 0, "password": 0}
-                )
-                if other_user:
-                    conv_data["otherUser"] = {
-                        "id": other_user.get("userId", ""),
-                        "userId": other_user.get("userId", ""),
-                        "name": other_user.get("name", ""),
-                        "nameEn": other_user.get("name", ""),
-                        "email": other_user.get("email", ""),
-                        "phone": other_user.get("phone", ""),
-                        "photo": f"https://ui-avatars.com/api/?name={other_user.get('name', '')}&background=5288c1&color=fff",
-                        "status": "online"
-                    }
+        other_user = other_users.get(other_user_ids.get(conv.get("id")))
+        if other_user:
+            conv_data["otherUser"] = {
+                "id": other_user.get("userId", ""),
+                "userId": other_user.get("userId", ""),
+                "name": other_user.get("name", ""),
+                "nameEn": other_user.get("name", ""),
+                "email": other_user.get("email", ""),
+                "phone": other_user.get("phone", ""),
+                "photo": f"https://ui-avatars.com/api/?name={other_user.get('name', '')}&background=5288c1&color=fff",
+                "status": "online"
+            }
         result.append(conv_data)
     
     return result
@@ -1034,13 +2654,69 @@ async def create_conversation(data: ConversationCreate):
     return new_conv.model_dump()
 
 @chat_router.get("/messages/{conversation_id}")
-async def get_conversation_messages(conversation_id: str, limit: int = 50, skip: int = 0):
+async def get_conversation_messages(
+    conversation_id: str,
+    limit: int = 50,
+    skip: int = 0,
+    before: Optional[str] = None,
+    after: Optional[str] = None,
+    cursor: bool = False
+):
     """جلب رسائل المحادثة"""
-    messages = await db.messages.find(
-        {"conversationId": conversation_id},
-        {"_id": 0}
-    ).sort("createdAt", -1).skip(skip).limit(limit).to_list(limit)
-    return messages[::-1]  # عكس الترتيب ليكون من الأقدم للأحدث
+    # الوضع القديم (skip/limit) يعيد قائمة؛ مع before أو after أو cursor=true
+    # يتم الترقيم بالمؤشر على (createdAt, id) ويعاد كائن يحتوي على مؤشرات الصفحات
+    if not (before or after or cursor):
+        messages = await db.messages.find(
+            {"conversationId": conversation_id},
+            {"_id": 0}
+        ).sort("createdAt", -1).skip(skip).limit(limit).to_list(limit)
+        return messages[::-1]  # عكس الترتيب ليكون من الأقدم للأحدث
+    
+    if before and after:
+        raise HTTPException(status_code=400, detail="لا يمكن استخدام before و after معاً")
+    limit = max(1, min(limit, 200))
+    query = {"conversationId": conversation_id}
+    
+    if after:
+        # رسائل أحدث من المؤشر (للرسائل الجديدة دون تكرار)
+        created_at, message_id = decode_cursor(after, 2)
+        query["$or"] = [
+            {"createdAt": {"$gt": created_at}},
+            {"createdAt": created_at, "id": {"$gt": message_id}}
+        ]
+        messages = await db.messages.find(query, {"_id": 0}).sort(
+            [("createdAt", 1), ("id", 1)]
+        ).limit(limit + 1).to_list(limit + 1)
+        has_more = len(messages) > limit
+        messages = messages[:limit]
+        has_older = True
+        has_newer = has_more
+    else:
+        # الصفحة الأحدث أو رسائل أقدم من المؤشر عند التمرير للأعلى
+        if before:
+            created_at, message_id = decode_cursor(before, 2)
+            query["$or"] = [
+                {"createdAt": {"$lt": created_at}},
+                {"createdAt": created_at, "id": {"$lt": message_id}}
+            ]
+        messages = await db.messages.find(query, {"_id": 0}).sort(
+            [("createdAt", -1), ("id", -1)]
+        ).limit(limit + 1).to_list(limit + 1)
+        has_more = len(messages) > limit
+        messages = messages[:limit][::-1]  # من الأقدم للأحدث
+        has_older = has_more
+        has_newer = bool(before)
+    
+    oldest = messages[0] if messages else None
+    newest = messages[-1] if messages else None
+    return {
+        "messages": messages,
+        "hasOlder": has_older,
+        "hasNewer": has_newer,
+        "beforeCursor": encode_cursor([oldest.get("createdAt"), oldest.get("id")]) if oldest and has_older else None,
+        # مؤشر after متاح دائماً لجلب الرسائل الجديدة لاحقاً
+        "afterCursor": encode_cursor([newest.get("createdAt"), newest.get("id")]) if newest else (after or None)
+    }
 
 @chat_router.post("/messages")
 async def send_message(data: MessageCreate):
@@ -1057,24 +2733,36 @@ async def send_message(data: MessageCreate):
     )
     await db.messages.insert_one(new_message.model_dump())
     
-    # تحديث آخر رسالة في المحادثة
-    await db.conversations.update_one(
+    # تحديث ملخص آخر رسالة في المحادثة
+    conversation = await db.conversations.find_one_and_update(
         {"id": data.conversationId},
         {"$set": {
-            "lastMessage": data.content[:50],
+            "lastMessage": _last_message_summary(new_message.model_dump()),
             "lastMessageAt": new_message.createdAt
-        }}
+        }},
+        projection={"_id": 0, "participants": 1}
     )
     
+    if conversation:
+        await publish_chat_event("message.created", data.conversationId, new_message.model_dump(), conversation.get("participants", []))
+    
     return new_message.model_dump()
 
 @chat_router.put("/messages/{message_id}/read")
 async def mark_message_read(message_id: str):
     """تحديد الرسالة كمقروءة"""
-    await db.messages.update_one(
+    message = await db.messages.find_one_and_update(
         {"id": message_id},
-        {"$set": {"read": True}}
+        {"$set": {"read": True}},
+        projection={"_id": 0, "conversationId": 1}
+    )
+    # مزامنة حالة القراءة في ملخص آخر رسالة إن كانت هي الأخيرة
+    await db.conversations.update_one(
+        {"lastMessage.id": message_id},
+        {"$set": {"lastMessage.read": True}}
     )
+    if message:
+        await publish_chat_event("message.read", message.get("conversationId"), {"messageId": message_id})
     return {"success": True}
 
 @chat_router.delete("/messages/{message_id}")
@@ -1105,8 +2793,72 @@ async def delete_message(message_id: str, deleted_by: str = "unknown"):
     
     # حذف الرسالة الأصلية
     await db.messages.delete_one({"id": message_id})
+    
+    # إعادة حساب ملخص آخر رسالة إن كانت الرسالة المحذوفة هي الأخيرة
+    if await db.conversations.find_one({"lastMessage.id": message_id}, {"_id": 0, "id": 1}):
+        await _refresh_last_message(message.get("conversationId"))
+    
+    await publish_chat_event("message.deleted", message.get("conversationId"), {"messageId": message_id})
     return {"success": True, "canRestore": True, "expiresIn": "30 days"}
 
+async def _archive_messages_to_trash(conversation_id: str, deleted_by: str, deleted_at: str) -> int:
+    """نسخ رسائل المحادثة إلى سلة المهملات وإرجاع عددها"""
+    query = {"conversationId": conversation_id}
+    
+    if TRASH_MOVE_MODE == "merge":
+        # النسخ يتم بالكامل داخل MongoDB فتبقى ذاكرة الخادم ثابتة مهما كان حجم المحادثة
+        count = await db.messages.count_documents(query)
+        pipeline = [
+            {"$match": query},
+            {"$project": {
+                "_id": 0,  # يولد $merge معرفاً جديداً لكل نسخة
+                "id": {"$toString": "$_id"},
+                "originalMessageId": "$id",
+                "originalConversationId": {"$literal": conversation_id},
+                "conversationId": "$conversationId",
+                "senderId": "$senderId",
+                "senderName": "$senderName",
+                "content": "$content",
+                "type": {"$ifNull": ["$type", "text"]},
+                "fileUrl": {"$ifNull": ["$fileUrl", None]},
+                "fileName": {"$ifNull": ["$fileName", None]},
+                "deletedBy": {"$literal": deleted_by},
+                "deletedAt": {"$literal": deleted_at},
+                "createdAt": {"$ifNull": ["$createdAt", None]}
+            }},
+            {"$merge": {"into": "deleted_messages", "whenMatched": "keepExisting", "whenNotMatched": "insert"}}
+        ]
+        await db.messages.aggregate(pipeline).to_list(None)
+        return count
+    
+    # الوضع batch: قراءة المؤشر على دفعات والكتابة عبر insert_many غير مرتبة
+    count = 0
+    chunk = []
+    async for message in db.messages.find(query, {"_id": 0}).batch_size(TRASH_INSERT_CHUNK_SIZE):
+        chunk.append({
+            "id": str(uuid.uuid4()),
+            "originalMessageId": message.get("id"),
+            "originalConversationId": conversation_id,
+            "conversationId": message.get("conversationId"),
+            "senderId": message.get("senderId"),
+            "senderName": message.get("senderName"),
+            "content": message.get("content"),
+            "type": message.get("type", "text"),
+            "fileUrl": message.get("fileUrl"),
+            "fileName": message.get("fileName"),
+            "deletedBy": deleted_by,
+            "deletedAt": deleted_at,
+            "createdAt": message.get("createdAt")
+        })
+        if len(chunk) >= TRASH_INSERT_CHUNK_SIZE:
+            await db.deleted_messages.insert_many(chunk, ordered=False)
+            count += len(chunk)
+            chunk = []
+    if chunk:
+        await db.deleted_messages.insert_many(chunk, ordered=False)
+        count += len(chunk)
+    return count
+
 @chat_router.delete("/conversations/{conversation_id}")
 async def delete_conversation(conversation_id: str, deleted_by: str = "unknown"):
     """حذف محادثة ونقلها لسلة المهملات مع رسائلها"""
@@ -1115,8 +2867,9 @@ async def delete_conversation(conversation_id: str, deleted_by: str = "unknown")
     if not conversation:
         raise HTTPException(status_code=404, detail="المحادثة غير موجودة")
     
-    # جلب كل الرسائل قبل الحذف
-    messages = await db.messages.find({"conversationId": conversation_id}, {"_id": 0}).to_list(10000)
+    # توقيت واحد للعملية كاملة
+    now = datetime.now(timezone.utc)
+    deleted_at = now.isoformat()
     
     # جلب اسم المستخدم الآخر (للمحادثات الخاصة)
     other_user_name = None
@@ -1128,6 +2881,9 @@ async def delete_conversation(conversation_id: str, deleted_by: str = "unknown")
             if other_user:
                 other_user_name = other_user.get("name", other_user_id)
     
+    # حفظ الرسائل في سلة المهملات للأرشيف
+    messages_count = await _archive_messages_to_trash(conversation_id, deleted_by, deleted_at)
+    
     # إنشاء سجل المحادثة المحذوفة
     deleted_conv = {
         "id": str(uuid.uuid4()),
@@ -1137,63 +2893,26 @@ async def delete_conversation(conversation_id: str, deleted_by: str = "unknown")
         "participants": conversation.get("participants", []),
         "otherUserName": other_user_name,
         "otherUserId": other_user_id,
-        "messagesCount": len(messages),
+        "messagesCount": messages_count,
         "deletedBy": deleted_by,
-        "deletedAt": datetime.now(timezone.utc).isoformat(),
-        "expiresAt": (datetime.now(timezone.utc) + timedelta(days=30)).isoformat(),
+        "deletedAt": deleted_at,
+        "expiresAt": (now + timedelta(days=30)).isoformat(),
         "status": "deleted"
     }
     await db.deleted_conversations.insert_one(deleted_conv)
     
-    # حفظ الرسائل في سلة المهملات للأرشيف
-    for message in messages:
-        deleted_message = {
-            "id": str(uuid.uuid4()),
-            "originalMessageId": message.get("id"),
-            "originalConversationId": conversation_id,
-            "conversationId": message.get("conversationId"),
-            "senderId": message.get("senderId"),
-            "senderName": message.get("senderName"),
-            "content": message.get("content"),
-            "type": message.get("type", "text"),
-            "fileUrl": message.get("fileUrl"),
-            "fileName": message.get("fileName"),
-            "deletedBy": deleted_by,
-            "deletedAt": datetime.now(timezone.utc).isoformat(),
-            "createdAt": message.get("createdAt")
-        }
-        await db.deleted_messages.insert_one(deleted_message)
-    
     # حذف الرسائل والمحادثة
     await db.messages.delete_many({"conversationId": conversation_id})
     await db.conversations.delete_one({"id": conversation_id})
     
-    return {"success": True, "deletedMessages": len(messages), "canRestore": True, "expiresIn": "30 days"}
+    await publish_chat_event("conversation.deleted", conversation_id, {"deletedBy": deleted_by}, conversation.get("participants", []))
+    return {"success": True, "deletedMessages": messages_count, "canRestore": True, "expiresIn": "30 days"}
 
 @chat_router.delete("/conversations/{conversation_id}/messages")
 async def clear_conversation_history(conversation_id: str, deleted_by: str = "unknown"):
     """مسح سجل المحادثة (حذف الرسائل فقط مع الإبقاء على المحادثة)"""
-    # جلب كل الرسائل قبل الحذف
-    messages = await db.messages.find({"conversationId": conversation_id}, {"_id": 0}).to_list(10000)
-    
     # حفظ الرسائل في سلة المهملات
-    for message in messages:
-        deleted_message = {
-            "id": str(uuid.uuid4()),
-            "originalMessageId": message.get("id"),
-            "originalConversationId": conversation_id,
-            "conversationId": message.get("conversationId"),
-            "senderId": message.get("senderId"),
-            "senderName": message.get("senderName"),
-            "content": message.get("content"),
-            "type": message.get("type", "text"),
-            "fileUrl": message.get("fileUrl"),
-            "fileName": message.get("fileName"),
-            "deletedBy": deleted_by,
-            "deletedAt": datetime.now(timezone.utc).isoformat(),
-            "createdAt": message.get("createdAt")
-        }
-        await db.deleted_messages.insert_one(deleted_message)
+    await _archive_messages_to_trash(conversation_id, deleted_by, datetime.now(timezone.utc).isoformat())
     
     # حذف الرسائل
     result = await db.messages.delete_many({"conversationId": conversation_id})
@@ -1202,6 +2921,7 @@ async def clear_conversation_history(conversation_id: str, deleted_by: str = "un
         {"id": conversation_id},
         {"$set": {"lastMessage": None, "lastMessageAt": None}}
     )
+    await publish_chat_event("conversation.cleared", conversation_id, {"deletedBy": deleted_by})
     return {"success": True, "deleted_count": result.deleted_count}
 
 # ============== DELETED CONVERSATIONS ROUTES ==============
@@ -1268,9 +2988,68 @@ async def get_all_deleted_conversations(payload: dict = Depends(verify_token)):
     ).sort("deletedAt", -1).to_list(1000)
     return deleted
 
+async def _restore_messages_from_trash(conversation_id: str, restored_at: str) -> int:
+    """إعادة رسائل المحادثة من سلة المهملات إلى الرسائل وإرجاع عددها"""
+    query = {"originalConversationId": conversation_id}
+    
+    if TRASH_MOVE_MODE == "merge":
+        count = await db.deleted_messages.count_documents(query)
+        pipeline = [
+            {"$match": query},
+            {"$project": {
+                "_id": 0,
+                "id": "$originalMessageId",
+                "conversationId": {"$literal": conversation_id},
+                "senderId": "$senderId",
+                "senderName": "$senderName",
+                "content": "$content",
+                "type": {"$ifNull": ["$type", "text"]},
+                "fileUrl": {"$ifNull": ["$fileUrl", None]},
+                "fileName": {"$ifNull": ["$fileName", None]},
+                "read": {"$literal": True},
+                "createdAt": {"$ifNull": ["$createdAt", restored_at]}
+            }},
+            {"$merge": {"into": "messages", "whenMatched": "keepExisting", "whenNotMatched": "insert"}}
+        ]
+        await db.deleted_messages.aggregate(pipeline).to_list(None)
+        return count
+    
+    count = 0
+    chunk = []
+    async for msg in db.deleted_messages.find(query, {"_id": 0}).batch_size(TRASH_INSERT_CHUNK_SIZE):
+        chunk.append({
+            "id": msg.get("originalMessageId"),
+            "conversationId": conversation_id,
+            "senderId": msg.get("senderId"),
+            "senderName": msg.get("senderName"),
+            "content": msg.get("content"),
+            "type": msg.get("type", "text"),
+            "fileUrl": msg.get("fileUrl"),
+            "fileName": msg.get("fileName"),
+            "read": True,
+            "createdAt": msg.get("createdAt") or restored_at
+        })
+        if len(chunk) >= TRASH_INSERT_CHUNK_SIZE:
+            await db.messages.insert_many(chunk, ordered=False)
+            count += len(chunk)
+            chunk = []
+    if chunk:
+        await db.messages.insert_many(chunk, ordered=False)
+        count += len(chunk)
+    return count
+
 @chat_router.post("/trash/approve-conversation-restore/{conversation_id}")
 async def approve_conversation_restore(conversation_id: str, payload: dict = Depends(verify_token)):
     """موافقة المدير على استعادة محادثة"""
+    timings = {}
+    phase_start = time.perf_counter()
+    
+    def end_phase(name):
+        nonlocal phase_start
+        now = time.perf_counter()
+        timings[name] = round((now - phase_start) * 1000, 2)
+        phase_start = now
+    
     # جلب المحادثة المحذوفة
     deleted_conv = await db.deleted_conversations.find_one(
         {"originalConversationId": conversation_id, "status": "restore_requested"},
@@ -1278,6 +3057,9 @@ async def approve_conversation_restore(conversation_id: str, payload: dict = Dep
     )
     if not deleted_conv:
         raise HTTPException(status_code=404, detail="طلب الاستعادة غير موجود")
+    end_phase("lookup")
+    
+    restored_at = datetime.now(timezone.utc).isoformat()
     
     # استعادة المحادثة
     restored_conv = {
@@ -1288,57 +3070,41 @@ async def approve_conversation_restore(conversation_id: str, payload: dict = Dep
         "createdBy": deleted_conv.get("deletedBy"),  # من حذفها سابقاً
         "lastMessage": None,
         "lastMessageAt": None,
-        "createdAt": datetime.now(timezone.utc).isoformat(),
+        "createdAt": restored_at,
         "restored": True,
-        "restoredAt": datetime.now(timezone.utc).isoformat()
+        "restoredAt": restored_at
     }
     await db.conversations.insert_one(restored_conv)
+    end_phase("conversation")
     
-    # استعادة الرسائل
-    deleted_messages = await db.deleted_messages.find(
-        {"originalConversationId": conversation_id},
-        {"_id": 0}
-    ).to_list(10000)
+    # استعادة الرسائل دفعة واحدة
+    restored_count = await _restore_messages_from_trash(conversation_id, restored_at)
+    end_phase("messages")
     
-    for msg in deleted_messages:
-        restored_msg = {
-            "id": msg.get("originalMessageId"),
-            "conversationId": conversation_id,
-            "senderId": msg.get("senderId"),
-            "senderName": msg.get("senderName"),
-            "content": msg.get("content"),
-            "type": msg.get("type", "text"),
-            "fileUrl": msg.get("fileUrl"),
-            "fileName": msg.get("fileName"),
-            "read": True,
-            "createdAt": msg.get("createdAt") or datetime.now(timezone.utc).isoformat()
-        }
-        await db.messages.insert_one(restored_msg)
-    
-    # تحديث آخر رسالة في المحادثة
-    if deleted_messages:
-        last_msg = sorted(deleted_messages, key=lambda x: x.get("createdAt", ""), reverse=True)[0]
-        await db.conversations.update_one(
-            {"id": conversation_id},
-            {"$set": {
-                "lastMessage": {
-                    "text": last_msg.get("content", "")[:50],
-                    "senderId": last_msg.get("senderId"),
-                    "timestamp": last_msg.get("createdAt")
-                }
-            }}
-        )
+    # ملخص آخر رسالة تحسبه قاعدة البيانات عبر الفهرس (conversationId, createdAt)
+    if restored_count:
+        await _refresh_last_message(conversation_id)
+    end_phase("summary")
     
     # تحديث حالة المحادثة في سلة المهملات
     await db.deleted_conversations.update_one(
         {"originalConversationId": conversation_id},
-        {"$set": {"status": "restored", "restoredAt": datetime.now(timezone.utc).isoformat()}}
+        {"$set": {"status": "restored", "restoredAt": restored_at}}
     )
     
     # حذف الرسائل من سلة المهملات
     await db.deleted_messages.delete_many({"originalConversationId": conversation_id})
+    end_phase("trash_cleanup")
     
-    return {"success": True, "message": "تم استعادة المحادثة بنجاح", "restoredMessages": len(deleted_messages)}
+    timings["total"] = round(sum(timings.values()), 2)
+    logger.info(f"Conversation {conversation_id} restored: {restored_count} messages, timings(ms)={timings}")
+    
+    return {
+        "success": True,
+        "message": "تم استعادة المحادثة بنجاح",
+        "restoredMessages": restored_count,
+        "timings": timings
+    }
 
 @chat_router.post("/trash/reject-conversation-restore/{conversation_id}")
 async def reject_conversation_restore(conversation_id: str, payload: dict = Depends(verify_token)):
@@ -1489,6 +3255,15 @@ async def approve_restore(message_id: str, payload: dict = Depends(verify_token)
     }
     await db.messages.insert_one(restored_message)
     
+    # الرسالة المستعادة تحمل أحدث تاريخ فتصبح آخر رسالة في المحادثة
+    await db.conversations.update_one(
+        {"id": restored_message["conversationId"]},
+        {"$set": {
+            "lastMessage": _last_message_summary(restored_message),
+            "lastMessageAt": restored_message["createdAt"]
+        }}
+    )
+    
     # تحديث حالة الرسالة في سلة المهملات
     await db.deleted_messages.update_one(
         {"originalMessageId": message_id},
@@ -1529,69 +3304,347 @@ async def cleanup_expired_messages(payload: dict = Depends(verify_token)):
 
 # ============== BACKUP ROUTES ==============
 
-async def perform_backup(backup_type: str = "manual") -> BackupInfo:
-    """Perform database backup"""
-    global last_auto_backup
+BACKUP_COLLECTIONS = ['users', 'drivers', 'restaurants', 'rides', 'orders', 'promotions', 'admins']
+BACKUP_EXTENSIONS = {"zstd": ".ndjson.zst", "gzip": ".ndjson.gz", "none": ".ndjson"}
+
+def open_backup_stream(path: Path, compression: str, mode: str):
+    """Text stream over a (possibly compressed) NDJSON backup file; mode is 'r' or 'w'"""
+    if compression == "zstd":
+        if zstandard is None:
+            raise RuntimeError("zstandard is not installed")
+        raw = open(path, mode + 'b')
+        if mode == 'w':
+            stream = zstandard.ZstdCompressor(level=BACKUP_COMPRESSION_LEVEL).stream_writer(raw)
+        else:
+            stream = zstandard.ZstdDecompressor().stream_reader(raw)
+        return io.TextIOWrapper(stream, encoding='utf-8')
+    if compression == "gzip":
+        return gzip.open(path, mode + 't', encoding='utf-8', compresslevel=BACKUP_COMPRESSION_LEVEL)
+    return open(path, mode, encoding='utf-8')
+
+# Serialization, compression and disk I/O of backups run here, never on the event loop
+backup_executor = ThreadPoolExecutor(max_workers=BACKUP_IO_WORKERS, thread_name_prefix="backup-io")
+
+async def run_backup_io(func, *args):
+    return await asyncio.get_running_loop().run_in_executor(backup_executor, func, *args)
+
+def _write_ndjson_batch(f, documents: list):
+    f.write("\n".join(json_util.dumps(d, json_options=json_util.RELAXED_JSON_OPTIONS) for d in documents) + "\n")
+
+def _write_json_file(path: Path, data: dict):
+    with open(path, 'w', encoding='utf-8') as f:
+        json.dump(data, f, ensure_ascii=False, indent=2)
+
+def _read_json_file(path: Path) -> dict:
+    with open(path, 'r', encoding='utf-8') as f:
+        return json.load(f)
+
+async def write_ndjson(path: Path, compression: str, documents, on_batch=None) -> int:
+    """Write an async stream of documents as extended JSON lines (keeps _id, dates and ObjectIds).
+
+    Each batch is encoded and written on the backup I/O thread while the next
+    one is read from MongoDB.
+    """
+    f = await run_backup_io(open_backup_stream, path, compression, 'w')
+    count = 0
+    pending = None
+    batch = []
+    try:
+        async for document in documents:
+            batch.append(document)
+            if len(batch) >= BACKUP_BATCH_SIZE:
+                if pending:
+                    await pending
+                pending = asyncio.ensure_future(run_backup_io(_write_ndjson_batch, f, batch))
+                count += len(batch)
+                if on_batch:
+                    on_batch(len(batch))
+                batch = []
+        if pending:
+            await pending
+            pending = None
+        if batch:
+            await run_backup_io(_write_ndjson_batch, f, batch)
+            count += len(batch)
+            if on_batch:
+                on_batch(len(batch))
+    finally:
+        if pending:
+            await asyncio.wait([pending])
+        await run_backup_io(f.close)
+    return count
+
+def read_backup_batches(path: Path, compression: str, batch_size: int = BACKUP_BATCH_SIZE):
+    """Yield lists of decoded documents from an NDJSON backup file"""
+    with open_backup_stream(path, compression, 'r') as f:
+        batch = []
+        for line in f:
+            if line.strip():
+                batch.append(json_util.loads(line))
+            if len(batch) >= batch_size:
+                yield batch
+                batch = []
+        if batch:
+            yield batch
+
+async def iterate_backup_batches(path: Path, compression: str):
+    """Async view of read_backup_batches; decompression and decoding run on the backup I/O thread"""
+    batches = read_backup_batches(path, compression)
+    try:
+        while True:
+            batch = await run_backup_io(next, batches, None)
+            if batch is None:
+                break
+            yield batch
+    finally:
+        await run_backup_io(batches.close)
+
+def new_backup_job(operation: str, params: dict, status: str = "running") -> dict:
+    """Job document; queued jobs are persisted in backup_jobs, the running copy holds live progress"""
+    return {
+        "id": f"JOB{uuid.uuid4().hex[:10].upper()}",
+        "operation": operation,  # backup or restore
+        "params": params,
+        "status": status,  # queued, running, completed, failed or cancelled
+        "collection": None,
+        "processed": {},  # collection -> documents written or restored
+        "created_at": datetime.now(timezone.utc).isoformat(),
+        "started_at": None,
+        "finished_at": None,
+        "result": None,
+        "error": None,
+        "cancel_requested": False
+    }
+
+def advance_backup_job(job: dict, collection_name: str, count: int):
+    job["collection"] = collection_name
+    job["processed"][collection_name] = job["processed"].get(collection_name, 0) + count
+
+def finish_backup_job(job: dict, result: Optional[str] = None, error: Optional[str] = None):
+    job["status"] = "failed" if error else "completed"
+    job["result"] = result
+    job["error"] = error
+    job["collection"] = None
+    job["finished_at"] = datetime.now(timezone.utc).isoformat()
+
+def backup_path_size(path: Path) -> int:
+    if path.is_dir():
+        return sum(p.stat().st_size for p in path.iterdir() if p.is_file())
+    return path.stat().st_size if path.exists() else 0
+
+CHANGE_STREAM_OPERATIONS = ["insert", "update", "replace", "delete"]
+
+async def capture_resume_token() -> Optional[dict]:
+    """Current change stream position, or None when MongoDB is not a replica set"""
+    try:
+        async with db.watch(max_await_time_ms=1) as stream:
+            await stream.try_next()
+            return stream.resume_token
+    except OperationFailure:
+        return None
+
+async def perform_backup(backup_type: str = "manual", mode: str = "full", job: Optional[dict] = None) -> BackupInfo:
+    """Perform database backup, reporting progress on a backup job"""
+    job = job or new_backup_job("backup", {"backup_type": backup_type, "mode": mode})
+    try:
+        free = (await run_backup_io(shutil.disk_usage, BACKUP_DIR)).free
+        if free < BACKUP_MIN_FREE_MB * 1024 * 1024:
+            raise HTTPException(status_code=507, detail=f"Not enough disk space for a backup ({free // (1024 * 1024)}MB free)")
+        if mode == "incremental":
+            backup = await perform_incremental_backup(backup_type, job)
+        else:
+            backup = await perform_full_backup(backup_type, job)
+    except HTTPException as e:
+        finish_backup_job(job, error=str(e.detail))
+        raise
+    except Exception as e:
+        finish_backup_job(job, error=str(e))
+        raise
+    finish_backup_job(job, result=backup.id)
+    return backup
+
+async def perform_full_backup(backup_type: str, job: dict) -> BackupInfo:
+    """Full backup, one compressed NDJSON file per collection"""
+    # Taken before the dump: changes made while it runs are replayed by the next increment
+    resume_token = await capture_resume_token()
+    # The job id keeps backups started within the same second apart
+    timestamp = datetime.now(timezone.utc).strftime('%Y%m%d_%H%M%S') + "_" + job["id"].removeprefix("JOB")
+    dirname = f"backup_{backup_type}_{timestamp}"
+    backup_path = BACKUP_DIR / dirname
+    backup_path.mkdir()
     
-    timestamp = datetime.now(timezone.utc).strftime('%Y%m%d_%H%M%S')
-    filename = f"backup_{backup_type}_{timestamp}.json"
-    filepath = BACKUP_DIR / filename
+    compression = BACKUP_COMPRESSION
+    started = time.perf_counter()
+    manifest = {
+        'created_at': datetime.now(timezone.utc).isoformat(),
+        'type': backup_type,
+        'version': '2.0',
+        'kind': 'full',
+        'compression': compression,
+        'collections': {}
+    }
     
-    # Collections to backup
-    collections = ['users', 'drivers', 'restaurants', 'rides', 'orders', 'promotions', 'admins']
+    try:
+        for collection_name in BACKUP_COLLECTIONS:
+            filename = collection_name + BACKUP_EXTENSIONS[compression]
+            count = await write_ndjson(
+                backup_path / filename, compression,
+                db[collection_name].find({}, batch_size=BACKUP_BATCH_SIZE),
+                lambda n, name=collection_name: advance_backup_job(job, name, n)
+            )
+            manifest['collections'][collection_name] = {
+                'file': filename,
+                'documents': count,
+                'size': (backup_path / filename).stat().st_size
+            }
+        # The manifest is written last: a directory without one is an incomplete backup
+        await run_backup_io(_write_json_file, backup_path / 'manifest.json', manifest)
+    except (Exception, asyncio.CancelledError):
+        await run_backup_io(shutil.rmtree, backup_path, True)
+        raise
     
-    backup_data = {
-        'metadata': {
-            'created_at': datetime.now(timezone.utc).isoformat(),
-            'type': backup_type,
-            'version': '1.0'
-        },
-        'data': {}
+    file_size = await run_backup_io(backup_path_size, backup_path)
+    total_documents = sum(c['documents'] for c in manifest['collections'].values())
+    elapsed = time.perf_counter() - started
+    logger.info(
+        f"Backup {dirname}: {total_documents} documents, {file_size / 1024 / 1024:.1f}MB "
+        f"in {elapsed:.1f}s ({total_documents / max(elapsed, 1e-6):.0f} docs/s)"
+    )
+    
+    # Save backup info to database
+    backup_info = {
+        'id': f"BK{timestamp}",
+        'filename': dirname,
+        'created_at': datetime.now(timezone.utc).isoformat(),
+        'size': file_size,
+        'type': backup_type,
+        'collections': BACKUP_COLLECTIONS,
+        'format': 'ndjson',
+        'compression': compression,
+        'documents': {name: c['documents'] for name, c in manifest['collections'].items()},
+        'kind': 'full',
+        'resume_token': resume_token
     }
+    await db.backups.insert_one(backup_info)
+    backup_info.pop("_id", None)
     
-    for collection_name in collections:
-        collection = db[collection_name]
-        documents = await collection.find({}, {"_id": 0}).to_list(100000)
-        backup_data['data'][collection_name] = documents
+    return BackupInfo(**backup_info)
+
+async def perform_incremental_backup(backup_type: str, job: dict) -> BackupInfo:
+    """Write only the changes since the previous backup, read from the change stream"""
+    parent = await db.backups.find_one({"resume_token": {"$ne": None}}, {"_id": 0}, sort=[("created_at", -1)])
+    if not parent:
+        raise HTTPException(status_code=400, detail="No backup to continue from; create a full backup first")
     
-    # Save to file
-    with open(filepath, 'w', encoding='utf-8') as f:
-        json.dump(backup_data, f, ensure_ascii=False, indent=2, default=str)
+    timestamp = datetime.now(timezone.utc).strftime('%Y%m%d_%H%M%S') + "_" + job["id"].removeprefix("JOB")
+    dirname = f"backup_{backup_type}_incremental_{timestamp}"
+    backup_path = BACKUP_DIR / dirname
+    backup_path.mkdir()
     
-    file_size = filepath.stat().st_size
+    compression = BACKUP_COMPRESSION
+    filename = "changes" + BACKUP_EXTENSIONS[compression]
+    started = time.perf_counter()
+    # Changes committed after this point belong to the next increment
+    stop_at = (await db.command("ping")).get("operationTime")
+    position = {"resume_token": parent["resume_token"]}
+    counts = {}
+    pipeline = [{"$match": {
+        "operationType": {"$in": CHANGE_STREAM_OPERATIONS},
+        "ns.coll": {"$in": BACKUP_COLLECTIONS}
+    }}]
     
-    # Update last backup time
-    last_auto_backup = datetime.now(timezone.utc)
+    async def changes():
+        async with db.watch(pipeline, full_document="updateLookup", resume_after=position["resume_token"],
+                            max_await_time_ms=500, batch_size=BACKUP_BATCH_SIZE) as stream:
+            while True:
+                change = await stream.try_next()
+                if change is None:
+                    position["resume_token"] = stream.resume_token
+                    return
+                if stop_at and change["clusterTime"] > stop_at:
+                    return
+                collection_name = change["ns"]["coll"]
+                counts[collection_name] = counts.get(collection_name, 0) + 1
+                position["resume_token"] = change["_id"]
+                yield {
+                    "op": change["operationType"],
+                    "coll": collection_name,
+                    "key": change["documentKey"],
+                    "doc": change.get("fullDocument")
+                }
+    
+    try:
+        await write_ndjson(backup_path / filename, compression, changes(),
+                           lambda n: advance_backup_job(job, "changes", n))
+        manifest = {
+            'created_at': datetime.now(timezone.utc).isoformat(),
+            'type': backup_type,
+            'version': '2.0',
+            'kind': 'incremental',
+            'compression': compression,
+            'file': filename,
+            'base_id': parent.get('base_id') or parent['id'],
+            'parent_id': parent['id'],
+            'changes': counts
+        }
+        await run_backup_io(_write_json_file, backup_path / 'manifest.json', manifest)
+    except OperationFailure as e:
+        await run_backup_io(shutil.rmtree, backup_path, True)
+        # Not a replica set, or the oplog no longer reaches back to the parent backup
+        raise HTTPException(status_code=400, detail=f"Incremental backup unavailable: {e}")
+    except (Exception, asyncio.CancelledError):
+        await run_backup_io(shutil.rmtree, backup_path, True)
+        raise
+    
+    file_size = await run_backup_io(backup_path_size, backup_path)
+    total_changes = sum(counts.values())
+    logger.info(f"Incremental backup {dirname}: {total_changes} changes since {parent['id']} in {time.perf_counter() - started:.1f}s")
     
-    # Save backup info to database
     backup_info = {
         'id': f"BK{timestamp}",
-        'filename': filename,
+        'filename': dirname,
         'created_at': datetime.now(timezone.utc).isoformat(),
         'size': file_size,
         'type': backup_type,
-        'collections': collections
+        'collections': BACKUP_COLLECTIONS,
+        'format': 'ndjson',
+        'compression': compression,
+        'documents': counts,
+        'kind': 'incremental',
+        'base_id': manifest['base_id'],
+        'parent_id': parent['id'],
+        'resume_token': position['resume_token']
     }
     await db.backups.insert_one(backup_info)
+    backup_info.pop("_id", None)
     
     return BackupInfo(**backup_info)
 
-@backup_router.post("/create", response_model=BackupInfo)
-async def create_backup(payload: dict = Depends(verify_token)):
-    """Create manual backup"""
-    try:
-        backup = await perform_backup("manual")
-        return backup
-    except Exception as e:
-        logger.error(f"Backup failed: {str(e)}")
-        raise HTTPException(status_code=500, detail=f"Backup failed: {str(e)}")
+@backup_router.post("/create")
+async def create_backup(mode: str = Query("full", pattern="^(full|incremental)$"), payload: dict = Depends(verify_token)):
+    """Queue a manual backup; poll /api/backup/jobs/{id} for progress"""
+    return await enqueue_backup_job("backup", {"backup_type": "manual", "mode": mode})
 
 @backup_router.get("/list", response_model=List[BackupInfo])
-async def list_backups(payload: dict = Depends(verify_token)):
-    """List all backups"""
-    backups = await db.backups.find({}, {"_id": 0}).sort("created_at", -1).to_list(100)
+async def list_backups(
+    response: Response,
+    limit: Optional[int] = Query(None, ge=1),
+    skip: int = Query(0, ge=0),
+    payload: dict = Depends(verify_token)
+):
+    """List backups, newest first; all of them unless limit is given"""
+    cursor = db.backups.find({}, {"_id": 0, "resume_token": 0}).sort("created_at", -1).skip(skip)
+    if limit:
+        cursor = cursor.limit(limit)
+    backups, total = await asyncio.gather(cursor.to_list(limit), db.backups.count_documents({}))
+    response.headers["X-Total-Count"] = str(total)
     return backups
 
+async def last_auto_backup_time() -> Optional[datetime]:
+    """Creation time of the newest automatic backup, whichever worker ran it"""
+    latest = await db.backups.find_one({"type": "auto"}, {"_id": 0, "created_at": 1}, sort=[("created_at", -1)])
+    return datetime.fromisoformat(latest["created_at"]) if latest else None
+
 @backup_router.get("/settings", response_model=BackupSettings)
 async def get_backup_settings(payload: dict = Depends(verify_token)):
     """Get backup settings"""
@@ -1604,35 +3657,102 @@ async def get_backup_settings(payload: dict = Depends(verify_token)):
         }
         await db.settings.insert_one(settings)
     
-    # Calculate next backup time
+    # Calculate next backup time from the backups table, which every worker sees alike
+    last_auto_backup = await last_auto_backup_time()
     if last_auto_backup:
         next_backup = last_auto_backup + timedelta(hours=settings.get("interval_hours", 6))
         settings["last_backup"] = last_auto_backup.isoformat()
         settings["next_backup"] = next_backup.isoformat()
     
+    # Disk usage accounting
+    disk = await run_backup_io(shutil.disk_usage, BACKUP_DIR)
+    totals = await db.backups.aggregate([
+        {"$group": {"_id": None, "count": {"$sum": 1}, "size": {"$sum": "$size"}}}
+    ]).to_list(1)
+    totals = totals[0] if totals else {"count": 0, "size": 0}
+    
     return BackupSettings(
         auto_backup_enabled=settings.get("auto_backup_enabled", True),
         interval_hours=settings.get("interval_hours", 6),
         last_backup=settings.get("last_backup"),
-        next_backup=settings.get("next_backup")
+        next_backup=settings.get("next_backup"),
+        retention_enabled=settings.get("retention_enabled", True),
+        keep_hourly=settings.get("keep_hourly", BACKUP_KEEP_HOURLY),
+        keep_daily=settings.get("keep_daily", BACKUP_KEEP_DAILY),
+        keep_weekly=settings.get("keep_weekly", BACKUP_KEEP_WEEKLY),
+        backup_count=totals["count"],
+        backups_size=totals["size"],
+        disk_total=disk.total,
+        disk_free=disk.free
     )
 
 @backup_router.put("/settings")
 async def update_backup_settings(
     auto_backup_enabled: bool = True,
     interval_hours: int = 6,
+    retention_enabled: Optional[bool] = None,
+    keep_hourly: Optional[int] = Query(None, ge=0),
+    keep_daily: Optional[int] = Query(None, ge=0),
+    keep_weekly: Optional[int] = Query(None, ge=0),
     payload: dict = Depends(verify_token)
 ):
     """Update backup settings"""
+    update = {
+        "auto_backup_enabled": auto_backup_enabled,
+        "interval_hours": interval_hours
+    }
+    # Retention fields are only changed when given
+    retention = {"retention_enabled": retention_enabled, "keep_hourly": keep_hourly,
+                 "keep_daily": keep_daily, "keep_weekly": keep_weekly}
+    update.update({k: v for k, v in retention.items() if v is not None})
     await db.settings.update_one(
         {"type": "backup"},
-        {"$set": {
-            "auto_backup_enabled": auto_backup_enabled,
-            "interval_hours": interval_hours
-        }},
+        {"$set": update},
         upsert=True
     )
-    return {"message": "Settings updated", "auto_backup_enabled": auto_backup_enabled, "interval_hours": interval_hours}
+    return {"message": "Settings updated", **update}
+
+@backup_router.post("/retention/run")
+async def run_backup_retention(payload: dict = Depends(verify_token)):
+    """Apply the retention policy now"""
+    result = await apply_backup_retention()
+    if result is None:
+        raise HTTPException(status_code=409, detail="Retention is already running")
+    return result
+
+@backup_router.get("/jobs")
+async def list_backup_jobs(limit: int = Query(50, ge=1, le=500), payload: dict = Depends(verify_token)):
+    """Queued, running and recent backup/restore jobs, newest first"""
+    return await db.backup_jobs.find({}, {"_id": 0}).sort("created_at", -1).to_list(limit)
+
+@backup_router.get("/jobs/{job_id}")
+async def get_backup_job(job_id: str, payload: dict = Depends(verify_token)):
+    """Progress of one backup/restore job"""
+    job = await db.backup_jobs.find_one({"id": job_id}, {"_id": 0})
+    if not job:
+        raise HTTPException(status_code=404, detail="Job not found")
+    return job
+
+@backup_router.post("/jobs/{job_id}/cancel")
+async def cancel_backup_job(job_id: str, payload: dict = Depends(verify_token)):
+    """Cancel a queued job, or ask the worker to stop a running one"""
+    job = await db.backup_jobs.find_one_and_update(
+        {"id": job_id, "status": "queued"},
+        {"$set": {"status": "cancelled", "finished_at": datetime.now(timezone.utc).isoformat()}},
+        projection={"_id": 0}, return_document=ReturnDocument.AFTER
+    )
+    if job:
+        return job
+    job = await db.backup_jobs.find_one_and_update(
+        {"id": job_id, "status": "running"},
+        {"$set": {"cancel_requested": True}},
+        projection={"_id": 0}, return_document=ReturnDocument.AFTER
+    )
+    if job:
+        return job
+    if not await db.backup_jobs.find_one({"id": job_id}, {"_id": 1}):
+        raise HTTPException(status_code=404, detail="Job not found")
+    raise HTTPException(status_code=400, detail="Job already finished")
 
 @backup_router.delete("/{backup_id}")
 async def delete_backup(backup_id: str, payload: dict = Depends(verify_token)):
@@ -1640,19 +3760,300 @@ async def delete_backup(backup_id: str, payload: dict = Depends(verify_token)):
     backup = await db.backups.find_one({"id": backup_id}, {"_id": 0})
     if not backup:
         raise HTTPException(status_code=404, detail="Backup not found")
+    if await db.backups.find_one({"parent_id": backup_id}, {"_id": 1}):
+        raise HTTPException(status_code=400, detail="Backup has incremental backups depending on it")
     
-    # Delete file
+    await remove_backup(backup)
+    return {"message": "Backup deleted"}
+
+async def remove_backup(backup: dict):
+    """Delete a backup's file or directory, then its metadata"""
     filepath = BACKUP_DIR / backup["filename"]
-    if filepath.exists():
-        filepath.unlink()
+    # Tolerate paths that are already gone (an earlier, interrupted removal)
+    if filepath.is_dir():
+        await run_backup_io(shutil.rmtree, filepath, True)
+    else:
+        await run_backup_io(filepath.unlink, True)
     
     # Delete from database
-    await db.backups.delete_one({"id": backup_id})
-    return {"message": "Backup deleted"}
+    await db.backups.delete_one({"id": backup["id"]})
+
+def select_backups_to_keep(backups: list, keep_hourly: int, keep_daily: int, keep_weekly: int, pinned: set = frozenset()) -> set:
+    """Tiered retention: the newest backup of each of the last N hours, days and ISO weeks.
+
+    The newest backup and pinned ids are always kept, and a kept incremental
+    keeps every backup back to its base.
+    """
+    ordered = sorted(backups, key=lambda b: b["created_at"], reverse=True)
+    keep = set(pinned)
+    if ordered:
+        keep.add(ordered[0]["id"])
+    tiers = [
+        (keep_hourly, lambda t: (t.date(), t.hour)),
+        (keep_daily, lambda t: t.date()),
+        (keep_weekly, lambda t: t.isocalendar()[:2]),
+    ]
+    for limit, bucket_of in tiers:
+        buckets = set()
+        for backup in ordered:
+            if len(buckets) >= limit:
+                break
+            bucket = bucket_of(datetime.fromisoformat(backup["created_at"]))
+            if bucket not in buckets:
+                buckets.add(bucket)
+                keep.add(backup["id"])
+    
+    by_id = {b["id"]: b for b in backups}
+    for backup_id in list(keep):
+        parent_id = by_id.get(backup_id, {}).get("parent_id")
+        while parent_id and parent_id not in keep:
+            keep.add(parent_id)
+            parent_id = by_id.get(parent_id, {}).get("parent_id")
+    return keep
+
+def _is_ndjson_backup_dir(path: Path) -> bool:
+    """A directory in the layout perform_*_backup writes: NDJSON files plus an optional manifest"""
+    if not path.is_dir():
+        return False
+    suffixes = tuple(BACKUP_EXTENSIONS.values())
+    return all(p.name == "manifest.json" or p.name.endswith(suffixes) for p in path.iterdir())
+
+def _orphan_backup_paths(referenced: set, older_than: float) -> list:
+    """Backup directories no metadata points to (failed or interrupted runs).
+
+    Only the NDJSON directory layout is considered; legacy .json files and
+    anything copied in by hand are logged and left alone.
+    """
+    orphans = []
+    for path in BACKUP_DIR.iterdir():
+        if not path.name.startswith("backup_") or path.name in referenced or path.stat().st_mtime >= older_than:
+            continue
+        if _is_ndjson_backup_dir(path):
+            orphans.append(path)
+        else:
+            logger.debug(f"Backup retention: leaving unreferenced {path.name} in place")
+    return orphans
+
+BACKUP_RETENTION_LOCK = "backup-retention"
+
+async def apply_backup_retention() -> Optional[dict]:
+    """Run one retention pass under a lease lock; None when another worker holds it"""
+    owner = f"{BACKUP_WORKER_ID}-{uuid.uuid4().hex[:8]}"
+    if not await try_backup_lock(BACKUP_RETENTION_LOCK, owner):
+        return None
+    try:
+        return await _apply_backup_retention()
+    finally:
+        await db.backup_locks.delete_one({"_id": BACKUP_RETENTION_LOCK, "owner": owner})
+
+async def _apply_backup_retention() -> dict:
+    """Prune backups outside the retention tiers, files and metadata together"""
+    settings = await db.settings.find_one({"type": "backup"}, {"_id": 0}) or {}
+    if not settings.get("retention_enabled", True):
+        return {"deleted": [], "freed": 0}
+    
+    backups = await db.backups.find(
+        {}, {"_id": 0, "id": 1, "filename": 1, "created_at": 1, "parent_id": 1, "size": 1}
+    ).to_list(None)
+    # Backups a queued or running restore is about to read
+    pinned = {job["params"]["backup_id"] async for job in db.backup_jobs.find(
+        {"operation": "restore", "status": {"$in": ["queued", "running"]}}, {"_id": 0, "params": 1}
+    )}
+    keep = select_backups_to_keep(
+        backups,
+        settings.get("keep_hourly", BACKUP_KEEP_HOURLY),
+        settings.get("keep_daily", BACKUP_KEEP_DAILY),
+        settings.get("keep_weekly", BACKUP_KEEP_WEEKLY),
+        pinned
+    )
+    
+    deleted, freed = [], 0
+    # Newest first, so increments go before the backups they depend on
+    for backup in sorted(backups, key=lambda b: b["created_at"], reverse=True):
+        if backup["id"] in keep:
+            continue
+        await remove_backup(backup)
+        deleted.append(backup["id"])
+        freed += backup.get("size", 0)
+    
+    referenced = {b["filename"] for b in backups if b["id"] in keep}
+    grace = time.time() - BACKUP_ORPHAN_GRACE_HOURS * 3600
+    for path in await run_backup_io(_orphan_backup_paths, referenced, grace):
+        freed += await run_backup_io(backup_path_size, path)
+        await run_backup_io(shutil.rmtree, path, True)
+        deleted.append(path.name)
+    
+    if deleted:
+        logger.info(f"Backup retention removed {len(deleted)} backups, freed {freed / 1024 / 1024:.1f}MB")
+    return {"deleted": deleted, "freed": freed, "kept": len(keep)}
+
+async def create_staging_collection(collection_name: str, job: dict, staging: dict):
+    """Fresh staging collection the restore fills before it replaces the live one"""
+    staging_name = f"restore_{job['id']}_{collection_name}"
+    await db.drop_collection(staging_name)
+    await db.create_collection(staging_name)
+    staging[collection_name] = staging_name
+    return db[staging_name]
+
+async def build_staging_indexes(collection_name: str, staging_name: str):
+    """Recreate the live collection's indexes (and any registered in INDEXES) on the staging copy"""
+    models = {model.document["name"]: model for model in INDEXES.get(collection_name, [])}
+    for name, info in (await db[collection_name].index_information()).items():
+        if name == "_id_" or name in models:
+            continue
+        options = {k: v for k, v in info.items() if k not in ("key", "v", "ns")}
+        models[name] = IndexModel(info["key"], name=name, **options)
+    if models:
+        await db[staging_name].create_indexes(list(models.values()))
+
+class PartialRestoreError(Exception):
+    """A rename failed after some live collections were already replaced"""
+
+async def _rename_staged_collections(staging: dict, swapped: list):
+    for collection_name, staging_name in list(staging.items()):
+        await db[staging_name].rename(collection_name, dropTarget=True)
+        del staging[collection_name]
+        swapped.append(collection_name)
+
+async def swap_staged_collections(staging: dict, job: dict):
+    """Build indexes on every staging collection, then rename each over its live collection.
+
+    The renames are shielded: once the first live collection is replaced a
+    cancellation waits for the rest instead of leaving a mix of old and new
+    data. If a rename fails, the collections not yet swapped stay staged and
+    PartialRestoreError says which is which.
+    """
+    for collection_name, staging_name in staging.items():
+        await build_staging_indexes(collection_name, staging_name)
+    
+    # Last point at which a cancel leaves production untouched
+    current = await db.backup_jobs.find_one({"id": job["id"]}, {"_id": 0, "cancel_requested": 1})
+    if current and current.get("cancel_requested"):
+        raise asyncio.CancelledError()
+    
+    swapped = []
+    swap = asyncio.create_task(_rename_staged_collections(staging, swapped))
+    while not swap.done():
+        try:
+            await asyncio.shield(swap)
+        except asyncio.CancelledError:
+            if not swap.done():
+                logger.warning(f"Restore job {job['id']} cancelled while swapping; finishing the swap first")
+        except Exception:
+            pass  # reported below
+    if swap.exception():
+        remaining = ", ".join(f"{name} (staged as {staged})" for name, staged in staging.items())
+        message = (f"Restore partially applied: swapped {', '.join(swapped) or 'nothing'}; "
+                   f"not swapped {remaining}; rename failed: {swap.exception()}")
+        logger.error(message)
+        raise PartialRestoreError(message)
+
+async def restore_legacy_backup(filepath: Path, job: dict, staging: dict) -> List[str]:
+    """Stage a version 1.0 single-file JSON backup"""
+    backup_data = await run_backup_io(_read_json_file, filepath)
+    
+    # Restore each collection
+    # Empty collections are staged too, so the swap empties the live collection
+    for collection_name, documents in backup_data['data'].items():
+        collection = await create_staging_collection(collection_name, job, staging)
+        for i in range(0, len(documents), BACKUP_BATCH_SIZE):
+            chunk = documents[i:i + BACKUP_BATCH_SIZE]
+            await collection.insert_many(chunk, ordered=False)
+            advance_backup_job(job, collection_name, len(chunk))
+    return list(backup_data['data'].keys())
+
+async def restore_ndjson_backup(backup_path: Path, job: dict, staging: dict) -> List[str]:
+    """Stage a version 2.0 backup directory, streaming each collection in batches"""
+    manifest_path = backup_path / 'manifest.json'
+    if not manifest_path.exists():
+        raise HTTPException(status_code=400, detail="Backup is incomplete (no manifest)")
+    manifest = await run_backup_io(_read_json_file, manifest_path)
+    
+    for collection_name, entry in manifest['collections'].items():
+        collection = await create_staging_collection(collection_name, job, staging)
+        async for batch in iterate_backup_batches(backup_path / entry['file'], manifest['compression']):
+            await collection.insert_many(batch, ordered=False)
+            advance_backup_job(job, collection_name, len(batch))
+    return list(manifest['collections'].keys())
+
+async def replay_incremental_backup(backup_path: Path, job: dict, staging: dict):
+    """Apply one increment's changes in order to the staged collections: upsert the post-image or delete"""
+    manifest = await run_backup_io(_read_json_file, backup_path / 'manifest.json')
+    
+    async for batch in iterate_backup_batches(backup_path / manifest['file'], manifest['compression']):
+        # Order only matters per document, so each collection gets its own ordered bulk write
+        operations = {}
+        for change in batch:
+            if change["op"] == "delete":
+                operation = DeleteOne(change["key"])
+            elif change.get("doc") is not None:
+                operation = ReplaceOne(change["key"], change["doc"], upsert=True)
+            else:
+                continue  # updated, then deleted before the post-image was read
+            operations.setdefault(change["coll"], []).append(operation)
+        for collection_name, ops in operations.items():
+            if collection_name not in staging:
+                await create_staging_collection(collection_name, job, staging)
+            await db[staging[collection_name]].bulk_write(ops, ordered=True)
+        advance_backup_job(job, "changes", len(batch))
+
+async def restore_incremental_chain(backup: dict, job: dict, staging: dict) -> List[str]:
+    """Stage the base full backup, then replay every increment up to this one"""
+    chain = [backup]
+    while chain[-1].get("kind") == "incremental":
+        parent = await db.backups.find_one({"id": chain[-1]["parent_id"]}, {"_id": 0})
+        if not parent:
+            raise HTTPException(status_code=400, detail=f"Backup chain is broken at {chain[-1]['parent_id']}")
+        chain.append(parent)
+    chain.reverse()
+    
+    for link in chain:
+        if not (BACKUP_DIR / link["filename"]).is_dir():
+            raise HTTPException(status_code=404, detail=f"Backup file not found: {link['filename']}")
+    collections = await restore_ndjson_backup(BACKUP_DIR / chain[0]["filename"], job, staging)
+    for link in chain[1:]:
+        await replay_incremental_backup(BACKUP_DIR / link["filename"], job, staging)
+    return collections
+
+async def perform_restore(backup: dict, job: Optional[dict] = None) -> List[str]:
+    """Restore any backup format, reporting progress on a backup job.
+
+    Data is loaded into staging collections and only renamed over the live
+    collections once every collection (and, for a chain, every increment)
+    has loaded, so a failed or cancelled restore leaves production untouched.
+    The one exception is a rename failing mid-swap: that is reported as a
+    partial restore and the collections not yet swapped are kept staged.
+    """
+    job = job or new_backup_job("restore", {"backup_id": backup["id"]})
+    filepath = BACKUP_DIR / backup["filename"]
+    staging = {}  # live collection name -> staging collection name
+    try:
+        if backup.get("kind") == "incremental":
+            collections = await restore_incremental_chain(backup, job, staging)
+        elif filepath.is_dir():
+            collections = await restore_ndjson_backup(filepath, job, staging)
+        else:
+            collections = await restore_legacy_backup(filepath, job, staging)
+        await swap_staged_collections(staging, job)
+        
+        response_cache.clear()
+        await reconcile_metrics()
+    except (Exception, asyncio.CancelledError) as e:
+        if isinstance(e, PartialRestoreError):
+            # Live data already changed; the remaining staged copies are needed to finish by hand
+            response_cache.clear()
+        else:
+            for staging_name in staging.values():
+                await db.drop_collection(staging_name)
+        if not isinstance(e, asyncio.CancelledError):
+            finish_backup_job(job, error=str(e.detail) if isinstance(e, HTTPException) else str(e))
+        raise
+    finish_backup_job(job, result=backup["id"])
+    return collections
 
 @backup_router.post("/restore/{backup_id}")
 async def restore_backup(backup_id: str, payload: dict = Depends(verify_token)):
-    """Restore database from backup"""
+    """Queue a database restore from a backup; poll /api/backup/jobs/{id} for progress"""
     backup = await db.backups.find_one({"id": backup_id}, {"_id": 0})
     if not backup:
         raise HTTPException(status_code=404, detail="Backup not found")
@@ -1661,37 +4062,188 @@ async def restore_backup(backup_id: str, payload: dict = Depends(verify_token)):
     if not filepath.exists():
         raise HTTPException(status_code=404, detail="Backup file not found")
     
+    return await enqueue_backup_job("restore", {"backup_id": backup_id})
+
+# ============== BACKUP JOB QUEUE ==============
+
+BACKUP_WORKER_ID = f"{socket.gethostname()}-{os.getpid()}"
+
+async def enqueue_backup_job(operation: str, params: dict) -> dict:
+    job = new_backup_job(operation, params, status="queued")
+    await db.backup_jobs.insert_one(job)
+    job.pop("_id", None)
+    return job
+
+async def try_backup_lock(lock_id: str, owner: str) -> bool:
+    """Take a lease lock unless a live holder has it; the _id unique index makes this atomic"""
+    now = datetime.now(timezone.utc)
     try:
-        with open(filepath, 'r', encoding='utf-8') as f:
-            backup_data = json.load(f)
+        await db.backup_locks.update_one(
+            {"_id": lock_id, "expiresAt": {"$lt": now}},
+            {"$set": {"owner": owner, "expiresAt": now + timedelta(seconds=BACKUP_JOB_LEASE_SECONDS)}},
+            upsert=True
+        )
+        return True
+    except DuplicateKeyError:
+        return False  # held by a live job
+
+async def acquire_backup_slot(owner: str) -> Optional[str]:
+    """Take one of BACKUP_JOB_CONCURRENCY lease locks"""
+    for slot in range(BACKUP_JOB_CONCURRENCY):
+        lock_id = f"backup-{slot}"
+        if await try_backup_lock(lock_id, owner):
+            return lock_id
+    return None
+
+async def backup_job_heartbeat(job: dict, task: asyncio.Task, lock_id: str, owner: str):
+    """Renew the lease, publish progress and honour cancellation requests
+
+    A failed renewal is logged and retried on the next beat; a lease that is
+    no longer ours (expired and taken over) stops the job.
+    """
+    while not task.done():
+        await asyncio.sleep(BACKUP_JOB_HEARTBEAT_SECONDS)
+        expires = datetime.now(timezone.utc) + timedelta(seconds=BACKUP_JOB_LEASE_SECONDS)
+        try:
+            renewed = await db.backup_locks.update_one({"_id": lock_id, "owner": owner}, {"$set": {"expiresAt": expires}})
+            if renewed.matched_count == 0:
+                logger.error(f"Backup job {job['id']} lost its lease on {lock_id}; stopping it")
+                job["lease_lost"] = True
+                task.cancel()
+                return
+            current = await db.backup_jobs.find_one_and_update(
+                {"id": job["id"]},
+                {"$set": {"processed": job["processed"], "collection": job["collection"], "lease_expires_at": expires}},
+                projection={"_id": 0, "cancel_requested": 1}
+            )
+        except Exception as e:
+            logger.error(f"Backup job {job['id']} heartbeat failed: {str(e)}")
+            continue
+        if current and current.get("cancel_requested"):
+            task.cancel()
+            return
+
+async def _run_backup_job(job: dict):
+    params = job["params"]
+    if job["operation"] == "restore":
+        backup = await db.backups.find_one({"id": params["backup_id"]}, {"_id": 0})
+        if not backup:
+            finish_backup_job(job, error="Backup not found")
+            return
+        await perform_restore(backup, job)
+        return
+    try:
+        await perform_backup(params["backup_type"], params["mode"], job)
+    except HTTPException as e:
+        if not params.get("fallback_full"):
+            raise
+        logger.warning(f"Incremental backup failed ({e.detail}); taking a full backup")
+        job["status"] = "running"
+        await perform_backup(params["backup_type"], "full", job)
+
+async def run_next_backup_job() -> bool:
+    """Claim and run the oldest queued job if a concurrency slot is free"""
+    if not await db.backup_jobs.find_one({"status": "queued"}, {"_id": 1}):
+        return False
+    owner = f"{BACKUP_WORKER_ID}-{uuid.uuid4().hex[:8]}"
+    lock_id = await acquire_backup_slot(owner)
+    if lock_id is None:
+        return False
+    try:
+        job = await db.backup_jobs.find_one_and_update(
+            {"status": "queued"},
+            {"$set": {
+                "status": "running",
+                "worker": BACKUP_WORKER_ID,
+                "started_at": datetime.now(timezone.utc).isoformat(),
+                "lease_expires_at": datetime.now(timezone.utc) + timedelta(seconds=BACKUP_JOB_LEASE_SECONDS)
+            }},
+            projection={"_id": 0}, sort=[("created_at", ASCENDING)], return_document=ReturnDocument.AFTER
+        )
+        if not job:
+            return False
         
-        # Restore each collection
-        for collection_name, documents in backup_data['data'].items():
-            if documents:
-                collection = db[collection_name]
-                await collection.delete_many({})
-                await collection.insert_many(documents)
+        logger.info(f"Backup job {job['id']} started ({job['operation']} {job['params']})")
+        task = asyncio.create_task(_run_backup_job(job))
+        heartbeat = asyncio.create_task(backup_job_heartbeat(job, task, lock_id, owner))
+        try:
+            await asyncio.wait([task])
+        finally:
+            heartbeat.cancel()
+            if not task.done():
+                task.cancel()  # the worker itself is shutting down
         
-        return {"message": "Database restored successfully", "collections": list(backup_data['data'].keys())}
-    except Exception as e:
-        logger.error(f"Restore failed: {str(e)}")
-        raise HTTPException(status_code=500, detail=f"Restore failed: {str(e)}")
+        if task.cancelled() and job.get("lease_lost"):
+            finish_backup_job(job, error="Lease lost; another worker may have taken over")
+        elif task.cancelled():
+            job["status"] = "cancelled"
+            job["finished_at"] = datetime.now(timezone.utc).isoformat()
+        elif task.exception() and job["status"] == "running":
+            finish_backup_job(job, error=str(task.exception()))
+        await db.backup_jobs.update_one({"id": job["id"]}, {"$set": {
+            k: job[k] for k in ("status", "collection", "processed", "finished_at", "result", "error")
+        }})
+        logger.info(f"Backup job {job['id']} {job['status']}" + (f": {job['error']}" if job['error'] else ""))
+        return True
+    finally:
+        await db.backup_locks.delete_one({"_id": lock_id, "owner": owner})
+
+async def backup_job_worker():
+    """Background worker draining the backup_jobs queue"""
+    while True:
+        try:
+            # Jobs whose worker stopped renewing the lease will never finish
+            async for job in db.backup_jobs.find(
+                {"status": "running", "lease_expires_at": {"$lt": datetime.now(timezone.utc)}}, {"_id": 0, "id": 1}
+            ):
+                await db.backup_jobs.update_one({"id": job["id"], "status": "running"}, {"$set": {
+                    "status": "failed", "error": "Worker stopped before the job finished",
+                    "finished_at": datetime.now(timezone.utc).isoformat()
+                }})
+                # Drop what an interrupted restore had staged
+                for name in await db.list_collection_names(filter={"name": {"$regex": f"^restore_{job['id']}_"}}):
+                    await db.drop_collection(name)
+            if not await run_next_backup_job():
+                await asyncio.sleep(BACKUP_JOB_POLL_SECONDS)
+        except Exception as e:
+            logger.error(f"Backup job worker error: {str(e)}")
+            await asyncio.sleep(BACKUP_JOB_POLL_SECONDS)
+
+async def auto_backup_mode() -> str:
+    """Incremental while the newest full backup with a change stream position is recent enough"""
+    if BACKUP_FULL_INTERVAL_HOURS <= 0:
+        return "full"
+    base = await db.backups.find_one(
+        {"kind": "full", "resume_token": {"$ne": None}}, {"_id": 0, "created_at": 1}, sort=[("created_at", -1)]
+    )
+    if not base:
+        return "full"
+    age = datetime.now(timezone.utc) - datetime.fromisoformat(base["created_at"])
+    return "incremental" if age < timedelta(hours=BACKUP_FULL_INTERVAL_HOURS) else "full"
 
 # Background task for auto backup
 async def auto_backup_task():
     """Background task for automatic backups"""
-    global last_auto_backup
     while True:
         try:
             settings = await db.settings.find_one({"type": "backup"})
             if settings and settings.get("auto_backup_enabled", True):
                 interval = settings.get("interval_hours", AUTO_BACKUP_INTERVAL_HOURS)
                 
-                if last_auto_backup is None or \
-                   datetime.now(timezone.utc) - last_auto_backup >= timedelta(hours=interval):
-                    logger.info("Starting automatic backup...")
-                    await perform_backup("auto")
-                    logger.info("Automatic backup completed")
+                pending = await db.backup_jobs.find_one(
+                    {"operation": "backup", "params.backup_type": "auto", "status": {"$in": ["queued", "running"]}},
+                    {"_id": 1}
+                )
+                last_auto_backup = await last_auto_backup_time()
+                if not pending and (last_auto_backup is None or
+                                    datetime.now(timezone.utc) - last_auto_backup >= timedelta(hours=interval)):
+                    mode = await auto_backup_mode()
+                    job = await enqueue_backup_job("backup", {
+                        "backup_type": "auto", "mode": mode, "fallback_full": mode == "incremental"
+                    })
+                    logger.info(f"Automatic {mode} backup queued as {job['id']}")
+            
+            await apply_backup_retention()
             
             # Check every 5 minutes
             await asyncio.sleep(300)
@@ -1730,9 +4282,22 @@ logger = logging.getLogger(__name__)
 @app.on_event("startup")
 async def startup_event():
     """Start background tasks on startup"""
+    asyncio.create_task(ensure_indexes())
+    logger.info("Index build started")
+    asyncio.create_task(backfill_user_search_fields())
+    if USER_SEARCH_INDEX:
+        asyncio.create_task(user_prefix_index_task())
+    asyncio.create_task(backup_job_worker())
     asyncio.create_task(auto_backup_task())
     logger.info("Auto backup task started")
+    asyncio.create_task(metrics_reconcile_task())
+    asyncio.create_task(token_revocation_task())
+    await chat_broker.start(chat_hub)
+    logger.info(f"Chat broker started ({CHAT_BROKER})")
 
 @app.on_event("shutdown")
 async def shutdown_db_client():
+    await chat_broker.stop()
+    password_executor.shutdown(wait=False)
+    backup_executor.shutdown(wait=False)
     client.close()
@@ -0,0 +1,279 @@
+#!/usr/bin/env python3
+"""
+Backend API Testing for Backup Latency
+Verifies that request latency stays flat while a large backup is running,
+and that backup progress is reported through /api/backup/jobs.
+"""
+
+import requests
+import sys
+import os
+import statistics
+import threading
+import time
+import uuid
+from datetime import datetime
+
+class BackupLatencyTester:
+    def __init__(self, base_url="https://signup-db-connect-1.preview.emergentagent.com"):
+        self.base_url = base_url
+        self.token = None
+        self.tests_run = 0
+        self.tests_passed = 0
+        self.test_results = []
+        self.run_id = uuid.uuid4().hex[:8]
+        self.backup_id = None
+
+        # Rows seeded directly so the backup runs long enough to overlap with requests
+        self.seed_count = int(os.environ.get('BACKUP_TEST_DOCUMENTS', 300000))
+        # Allowed slowdown of p95 latency while the backup runs
+        self.max_slowdown = 3.0
+        self.slack_ms = 100
+        # DB-backed read sampled before and during the backup
+        self.sample_endpoint = 'orders?limit=50&sort=total'
+
+    def log_result(self, test_name, success, details="", error=""):
+        """Log test result"""
+        self.tests_run += 1
+        if success:
+            self.tests_passed += 1
+            print(f"✅ {test_name} - PASSED")
+            if details:
+                print(f"   Details: {details}")
+        else:
+            print(f"❌ {test_name} - FAILED")
+            if error:
+                print(f"   Error: {error}")
+            if details:
+                print(f"   Details: {details}")
+
+        self.test_results.append({
+            "test": test_name,
+            "success": success,
+            "details": details,
+            "error": error,
+            "timestamp": datetime.now().isoformat()
+        })
+
+    def make_request(self, method, endpoint, data=None, timeout=10):
+        """Make HTTP request and return (response, elapsed_ms)"""
+        url = f"{self.base_url}/api/{endpoint}"
+        headers = {'Content-Type': 'application/json'}
+        if self.token:
+            headers['Authorization'] = f'Bearer {self.token}'
+
+        start = time.perf_counter()
+        response = requests.request(method, url, json=data, headers=headers, timeout=timeout)
+        return response, (time.perf_counter() - start) * 1000
+
+    def sample_latency(self, duration=None, stop_event=None, interval=0.05):
+        """Read a page of orders repeatedly; returns latency samples in ms
+
+        The orders list queries the collection the backup is streaming, so the
+        samples include MongoDB round trips competing with the backup cursor.
+        """
+        samples = []
+        deadline = time.monotonic() + duration if duration else None
+        while True:
+            if deadline and time.monotonic() >= deadline:
+                break
+            if stop_event and stop_event.is_set():
+                break
+            response, elapsed_ms = self.make_request('GET', self.sample_endpoint)
+            if response.status_code == 200:
+                samples.append(elapsed_ms)
+            time.sleep(interval)
+        return samples
+
+    @staticmethod
+    def p95(samples):
+        ordered = sorted(samples)
+        return ordered[max(int(len(ordered) * 0.95) - 1, 0)]
+
+    def test_admin_login(self):
+        """Log in as the default admin"""
+        print(f"\n🔐 Testing admin login...")
+        response, _ = self.make_request('POST', 'auth/login', {
+            "email": "admin@transfers.com",
+            "password": "admin123"
+        })
+        if response.status_code == 200 and response.json().get('token'):
+            self.token = response.json()['token']
+            self.log_result("Admin Login", True)
+            return True
+        self.log_result("Admin Login", False, error=f"Status {response.status_code}")
+        return False
+
+    def seed_orders(self):
+        """Insert a large batch of orders directly into MongoDB"""
+        print(f"\n📦 Seeding {self.seed_count} orders...")
+        from pymongo import MongoClient
+        collection = MongoClient(os.environ['MONGO_URL'])[os.environ['DB_NAME']].orders
+        batch = []
+        for i in range(self.seed_count):
+            batch.append({
+                "id": f"latency{self.run_id}_O{i}",
+                "user": f"User {i % 1000}",
+                "restaurant": f"Restaurant {i % 50}",
+                "items": i % 5 + 1,
+                "total": float(i % 200 + 15),
+                "status": "delivered",
+                "date": "2024-06-01 12:00",
+                "driver": "-"
+            })
+            if len(batch) >= 10000:
+                collection.insert_many(batch, ordered=False)
+                batch = []
+        if batch:
+            collection.insert_many(batch, ordered=False)
+        self.log_result("Seed Orders", True, f"{self.seed_count} orders")
+        return collection
+
+    def test_latency_during_backup(self):
+        """p95 latency while a backup runs stays close to the idle baseline"""
+        print(f"\n⏱️ Measuring baseline latency...")
+        baseline = self.sample_latency(duration=5)
+        baseline_p95 = self.p95(baseline)
+        print(f"   Baseline: median={statistics.median(baseline):.1f}ms p95={baseline_p95:.1f}ms")
+
+        print(f"\n💾 Running backup while sampling latency...")
+        result = {}
+        done = threading.Event()
+
+        response, elapsed_ms = self.make_request('POST', 'backup/create')
+        if response.status_code != 200 or not response.json().get('id'):
+            self.log_result("Backup Queued", False, error=f"Status {response.status_code}: {response.text[:200]}")
+            return False
+        job_id = response.json()['id']
+        self.log_result("Backup Queued", elapsed_ms < 1000, f"Job {job_id} returned in {elapsed_ms:.0f}ms",
+                        "" if elapsed_ms < 1000 else "Backup request did not return immediately")
+
+        def watch_job():
+            try:
+                result['progress_seen'], result['job'] = self.poll_job_progress(job_id)
+            finally:
+                done.set()
+
+        started = time.perf_counter()
+        thread = threading.Thread(target=watch_job)
+        thread.start()
+        during = self.sample_latency(stop_event=done)
+        thread.join()
+        progress_seen = result.get('progress_seen', False)
+
+        job = result.get('job') or {}
+        if job.get('status') != 'completed':
+            self.log_result("Backup Completes", False, error=f"Job ended as {job.get('status')}: {job.get('error')}")
+            return False
+        self.backup_id = job['result']
+        self.log_result("Backup Completes", True,
+                        f"{self.backup_id} in {time.perf_counter() - started:.1f}s, "
+                        f"{sum(job.get('processed', {}).values())} documents")
+
+        self.log_result("Backup Progress Reported", progress_seen,
+                        "processed counts increased while running" if progress_seen else "",
+                        "" if progress_seen else "No running job with progress observed")
+
+        if len(during) < 5:
+            self.log_result("Latency During Backup", False, error=f"Only {len(during)} samples; backup too short to judge")
+            return False
+        during_p95 = self.p95(during)
+        limit = max(baseline_p95 * self.max_slowdown, baseline_p95 + self.slack_ms)
+        self.log_result(
+            "Latency During Backup",
+            during_p95 <= limit,
+            f"p95 {during_p95:.1f}ms vs baseline {baseline_p95:.1f}ms (limit {limit:.1f}ms, {len(during)} samples)",
+            "" if during_p95 <= limit else "Requests slowed down while the backup was running"
+        )
+        return during_p95 <= limit
+
+    def poll_job_progress(self, job_id, timeout=1800):
+        """Follow a backup job until it finishes; returns (progress_seen, final job)"""
+        deadline = time.monotonic() + timeout
+        previous = None
+        progress_seen = False
+        job = {}
+        while time.monotonic() < deadline:
+            response, _ = self.make_request('GET', f'backup/jobs/{job_id}')
+            if response.status_code == 200:
+                job = response.json()
+                if job.get('status') == 'running':
+                    processed = sum(job.get('processed', {}).values())
+                    if previous is not None and processed > previous:
+                        progress_seen = True
+                    previous = processed
+                elif job.get('status') in ('completed', 'failed', 'cancelled'):
+                    return progress_seen, job
+            time.sleep(0.5)
+        return progress_seen, job
+
+    def cleanup(self, collection):
+        """Remove the seeded orders and the test backup"""
+        print(f"\n🧹 Cleaning up...")
+        if self.backup_id:
+            self.make_request('DELETE', f'backup/{self.backup_id}')
+        if collection is not None:
+            collection.delete_many({"id": {"$regex": f"^latency{self.run_id}_"}})
+
+    def run_all_tests(self):
+        """Run backup latency tests"""
+        print("=" * 80)
+        print("🧪 BACKUP LATENCY TESTING")
+        print("=" * 80)
+        print(f"Testing API: {self.base_url}")
+        print("=" * 80)
+
+        if not self.test_admin_login():
+            print("❌ Cannot proceed without authentication")
+            return False
+
+        collection = None
+        try:
+            collection = self.seed_orders()
+            self.test_latency_during_backup()
+        finally:
+            self.cleanup(collection)
+        return True
+
+    def print_summary(self):
+        """Print test summary"""
+        print("\n" + "=" * 80)
+        print("📊 TEST SUMMARY")
+        print("=" * 80)
+        print(f"Total Tests: {self.tests_run}")
+        print(f"Passed: {self.tests_passed}")
+        print(f"Failed: {self.tests_run - self.tests_passed}")
+        print(f"Success Rate: {(self.tests_passed/self.tests_run*100):.1f}%" if self.tests_run > 0 else "0%")
+
+        if self.tests_run - self.tests_passed > 0:
+            print("\n❌ FAILED TESTS:")
+            for result in self.test_results:
+                if not result['success']:
+                    print(f"  - {result['test']}: {result['error']}")
+
+        print("=" * 80)
+
+def main():
+    """Main test execution"""
+    tester = BackupLatencyTester()
+
+    try:
+        tester.run_all_tests()
+        tester.print_summary()
+
+        if tester.tests_passed == tester.tests_run:
+            print("🎉 All tests passed!")
+            return 0
+        else:
+            print("⚠️ Some tests failed!")
+            return 1
+
+    except KeyboardInterrupt:
+        print("\n⏹️ Tests interrupted by user")
+        return 1
+    except Exception as e:
+        print(f"\n💥 Unexpected error: {str(e)}")
+        return 1
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,589 @@
+#!/usr/bin/env python3
+"""
+Backend API Performance Benchmarks
+Measures endpoint latency against a running backend.
+
+Usage: python backend_benchmark.py [scenario ...]
+"""
+
+import requests
+import sys
+import os
+import json
+import base64
+import hashlib
+import time
+import uuid
+import statistics
+from datetime import datetime, timezone, timedelta
+
+class PerformanceBenchmark:
+    def __init__(self, base_url="https://signup-db-connect-1.preview.emergentagent.com"):
+        self.base_url = base_url
+        self.results = []
+        self.run_id = uuid.uuid4().hex[:8]
+        self._db = None
+
+    @property
+    def db(self):
+        """Direct database handle for bulk seeding (MONGO_URL / DB_NAME)"""
+        if self._db is None:
+            from pymongo import MongoClient
+            self._db = MongoClient(os.environ['MONGO_URL'])[os.environ['DB_NAME']]
+        return self._db
+
+    def seed(self, collection_name, documents, chunk_size=10000):
+        """Bulk insert generated documents without going through the API"""
+        batch = []
+        for document in documents:
+            batch.append(document)
+            if len(batch) >= chunk_size:
+                self.db[collection_name].insert_many(batch, ordered=False)
+                batch = []
+        if batch:
+            self.db[collection_name].insert_many(batch, ordered=False)
+
+    def make_request(self, method, endpoint, data=None, params=None, token=None):
+        """Make HTTP request and return (response, elapsed_ms)"""
+        url = f"{self.base_url}/api/{endpoint}"
+        headers = {'Content-Type': 'application/json'}
+        if token:
+            headers['Authorization'] = f'Bearer {token}'
+
+        start = time.perf_counter()
+        response = requests.request(method, url, json=data, params=params, headers=headers, timeout=120)
+        elapsed_ms = (time.perf_counter() - start) * 1000
+        return response, elapsed_ms
+
+    def measure(self, method, endpoint, runs=20, params=None, token=None):
+        """Call an endpoint repeatedly and return latency statistics in ms"""
+        samples = []
+        # Warm up connection pools and caches
+        self.make_request(method, endpoint, params=params, token=token)
+        for _ in range(runs):
+            response, elapsed_ms = self.make_request(method, endpoint, params=params, token=token)
+            if response.status_code != 200:
+                raise RuntimeError(f"{method} {endpoint} returned {response.status_code}: {response.text[:200]}")
+            samples.append(elapsed_ms)
+        samples.sort()
+        return {
+            "median_ms": round(statistics.median(samples), 2),
+            "p95_ms": round(samples[int(len(samples) * 0.95) - 1], 2),
+            "min_ms": round(samples[0], 2)
+        }
+
+    def log_result(self, scenario, label, stats):
+        """Log benchmark result"""
+        print(f"📊 {scenario} [{label}] median={stats['median_ms']}ms p95={stats['p95_ms']}ms min={stats['min_ms']}ms")
+        self.results.append({
+            "scenario": scenario,
+            "label": label,
+            **stats,
+            "timestamp": datetime.now().isoformat()
+        })
+
+    def register_user(self, suffix):
+        """Register a throwaway user and return its userId"""
+        user_id = f"bench_{self.run_id}_{suffix}"
+        self.make_request('POST', 'auth/register', data={
+            "name": f"Bench {suffix}",
+            "email": f"{user_id}@bench.example.com",
+            "userId": user_id,
+            "password": "bench123456"
+        })
+        return user_id
+
+    def admin_token(self):
+        """Log in as the default admin and return a bearer token"""
+        response, _ = self.make_request('POST', 'auth/login', data={
+            "email": "admin@transfers.com",
+            "password": "admin123"
+        })
+        return response.json()["token"]
+
+    def wait_for_job(self, job_id, token, timeout=3600):
+        """Poll a backup/restore job until it finishes"""
+        deadline = time.monotonic() + timeout
+        while time.monotonic() < deadline:
+            job = self.make_request('GET', f'backup/jobs/{job_id}', token=token)[0].json()
+            if job.get('status') == 'completed':
+                return job
+            if job.get('status') in ('failed', 'cancelled'):
+                raise RuntimeError(f"Job {job_id} {job['status']}: {job.get('error')}")
+            time.sleep(0.5)
+        raise RuntimeError(f"Job {job_id} did not finish within {timeout}s")
+
+    @staticmethod
+    def cursor_for(message):
+        """Build the same opaque (createdAt, id) cursor token the API returns"""
+        raw = json.dumps([message["createdAt"], message["id"]], separators=(",", ":")).encode()
+        return base64.urlsafe_b64encode(raw).decode().rstrip("=")
+
+    # ============== SCENARIOS ==============
+
+    def bench_chat_list(self, counts=(10, 50, 100)):
+        """Chat list screen latency versus number of conversations"""
+        owner = self.register_user("owner")
+        created = 0
+        for count in counts:
+            while created < count:
+                peer = self.register_user(f"peer{created}")
+                response, _ = self.make_request('POST', 'chat/conversations', data={
+                    "type": "private",
+                    "participants": [owner, peer],
+                    "createdBy": owner
+                })
+                conversation_id = response.json()["id"]
+                self.make_request('POST', 'chat/messages', data={
+                    "conversationId": conversation_id,
+                    "senderId": peer,
+                    "senderName": f"Bench {created}",
+                    "content": f"benchmark message {created}"
+                })
+                created += 1
+            stats = self.measure('GET', f'chat/conversations/{owner}')
+            self.log_result("chat_list", f"{count} conversations", stats)
+
+    def bench_message_pagination(self, total=100000, limit=50, depths=(0, 1000, 10000, 50000, 99000)):
+        """Offset (skip) versus keyset (cursor) paging through a long conversation"""
+        conversation_id = f"bench_conv_{self.run_id}"
+        base = datetime.now(timezone.utc) - timedelta(seconds=total)
+        self.seed('messages', ({
+            "id": str(uuid.uuid4()),
+            "conversationId": conversation_id,
+            "senderId": "bench_sender",
+            "senderName": "Bench",
+            "content": f"message {i}",
+            "type": "text",
+            "read": False,
+            "createdAt": (base + timedelta(seconds=i)).isoformat()
+        } for i in range(total)))
+        print(f"   Seeded {total} messages in {conversation_id}")
+
+        try:
+            for depth in depths:
+                offset_stats = self.measure('GET', f'chat/messages/{conversation_id}',
+                                            params={"limit": limit, "skip": depth})
+
+                # Locate the message that sits just above this depth to build the equivalent cursor
+                anchor = None
+                if depth:
+                    anchor = self.db.messages.find(
+                        {"conversationId": conversation_id}, {"_id": 0, "createdAt": 1, "id": 1}
+                    ).sort([("createdAt", -1), ("id", -1)]).skip(depth - 1).limit(1).next()
+                params = {"limit": limit, "cursor": "true"}
+                if anchor:
+                    params = {"limit": limit, "before": self.cursor_for(anchor)}
+                cursor_stats = self.measure('GET', f'chat/messages/{conversation_id}', params=params)
+
+                self.log_result("message_pagination", f"skip depth={depth}", offset_stats)
+                self.log_result("message_pagination", f"cursor depth={depth}", cursor_stats)
+        finally:
+            self.db.messages.delete_many({"conversationId": conversation_id})
+
+    def seed_conversation_messages(self, conversation_id, total):
+        """Seed a conversation document and `total` messages directly in MongoDB"""
+        base = datetime.now(timezone.utc) - timedelta(seconds=total)
+        self.db.conversations.insert_one({
+            "id": conversation_id,
+            "type": "group",
+            "name": "Benchmark",
+            "participants": ["bench_sender"],
+            "createdBy": "bench_sender",
+            "lastMessage": None,
+            "lastMessageAt": None,
+            "createdAt": base.isoformat()
+        })
+        self.seed('messages', ({
+            "id": str(uuid.uuid4()),
+            "conversationId": conversation_id,
+            "senderId": "bench_sender",
+            "senderName": "Bench",
+            "content": f"message {i}",
+            "type": "text",
+            "read": False,
+            "createdAt": (base + timedelta(seconds=i)).isoformat()
+        } for i in range(total)))
+
+    def bench_trash_move(self, sizes=(1000, 10000, 100000)):
+        """Moving a whole conversation to the trash (clear history and delete)"""
+        for size in sizes:
+            for action in ("clear", "delete"):
+                conversation_id = f"bench_trash_{self.run_id}_{action}_{size}"
+                self.seed_conversation_messages(conversation_id, size)
+                try:
+                    endpoint = f'chat/conversations/{conversation_id}'
+                    if action == "clear":
+                        endpoint += '/messages'
+                    response, elapsed_ms = self.make_request('DELETE', endpoint, params={"deleted_by": "bench_sender"})
+                    if response.status_code != 200:
+                        raise RuntimeError(f"DELETE {endpoint} returned {response.status_code}: {response.text[:200]}")
+                    archived = self.db.deleted_messages.count_documents({"originalConversationId": conversation_id})
+                    print(f"   {action} {size}: archived {archived} messages")
+                    stats = {"median_ms": round(elapsed_ms, 2), "p95_ms": round(elapsed_ms, 2), "min_ms": round(elapsed_ms, 2)}
+                    self.log_result("trash_move", f"{action} {size} messages", stats)
+                finally:
+                    self.db.messages.delete_many({"conversationId": conversation_id})
+                    self.db.conversations.delete_many({"id": conversation_id})
+                    self.db.deleted_messages.delete_many({"originalConversationId": conversation_id})
+                    self.db.deleted_conversations.delete_many({"originalConversationId": conversation_id})
+
+    def bench_dashboard_stats(self, total=1000000):
+        """Dashboard stats latency with a large orders collection
+
+        GET /stats reads the materialized counters, so the aggregation over the
+        source collections is measured separately through /stats/reconcile.
+        """
+        token = self.admin_token()
+        self.log_result("dashboard_stats", "baseline aggregation", self.measure('POST', 'stats/reconcile', runs=5, token=token))
+        self.log_result("dashboard_stats", "baseline cached", self.measure('GET', 'stats', token=token))
+
+        marker = f"bench_{self.run_id}"
+        statuses = ["delivered", "preparing", "on_way", "cancelled"]
+        base = datetime.now(timezone.utc) - timedelta(minutes=total)
+        self.seed('orders', ({
+            "id": f"{marker}_{i}",
+            "user": marker,
+            "restaurant": "Bench",
+            "items": 1 + i % 5,
+            "total": float(20 + i % 200),
+            "status": statuses[i % len(statuses)],
+            "date": (base + timedelta(minutes=i)).strftime('%Y-%m-%d %H:%M'),
+            "driver": "-"
+        } for i in range(total)))
+        print(f"   Seeded {total} orders")
+
+        try:
+            # Seeded rows bypass the write routes; the first reconcile folds them into the counters
+            aggregation = self.measure('POST', 'stats/reconcile', runs=5, token=token)
+            self.log_result("dashboard_stats", f"{total} orders aggregation", aggregation)
+            stats = self.measure('GET', 'stats', token=token)
+            self.log_result("dashboard_stats", f"{total} orders cached", stats)
+        finally:
+            self.db.orders.delete_many({"user": marker})
+            self.make_request('POST', 'stats/reconcile', token=token)
+
+    @staticmethod
+    def load_server():
+        """Import backend/server.py in-process for microbenchmarks (needs MONGO_URL / DB_NAME)"""
+        sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), 'backend'))
+        import server
+        return server
+
+    def bench_password_hashing(self, logins=64):
+        """Logins per second through the bounded hashing pool at each cost setting"""
+        import asyncio
+        server = self.load_server()
+        hashers = [server.LegacySha256Hasher()]
+        hashers += [server.BcryptHasher(rounds) for rounds in (10, 11, 12, 13)]
+        hashers += [server.ScryptHasher(n) for n in (2 ** 13, 2 ** 14, 2 ** 15)]
+
+        async def storm(hasher, hashed):
+            loop = asyncio.get_running_loop()
+            start = time.perf_counter()
+            await asyncio.gather(*[
+                loop.run_in_executor(server.password_executor, hasher.verify, "bench123456", hashed)
+                for _ in range(logins)
+            ])
+            return time.perf_counter() - start
+
+        for hasher in hashers:
+            if isinstance(hasher, server.LegacySha256Hasher):
+                hashed, label = hashlib.sha256(b"bench123456").hexdigest(), "sha256 (legacy)"
+            else:
+                hashed = hasher.hash("bench123456")
+                label = f"bcrypt rounds={hasher.rounds}" if hasher.scheme == "bcrypt" else f"scrypt n={hasher.n}"
+            elapsed = asyncio.run(storm(hasher, hashed))
+            per_login_ms = elapsed * 1000 / logins
+            print(f"   {label}: {logins / elapsed:.1f} logins/s with {server.PASSWORD_HASH_WORKERS} workers")
+            self.log_result("password_hashing", label, {
+                "median_ms": round(per_login_ms, 2), "p95_ms": round(per_login_ms, 2), "min_ms": round(per_login_ms, 2)
+            })
+
+    def bench_token_verification(self, iterations=20000):
+        """Per-request auth overhead of verify_token with and without the verified-token cache"""
+        import asyncio
+        server = self.load_server()
+        from fastapi.security import HTTPAuthorizationCredentials
+        token = server.create_token("bench-admin", "bench@transfers.com")
+        credentials = HTTPAuthorizationCredentials(scheme="Bearer", credentials=token)
+
+        def uncached():
+            server.jwt.decode(token, server.JWT_SECRET, algorithms=[server.JWT_ALGORITHM])
+
+        async def run_cached():
+            await server.verify_token(credentials)  # populate
+            start = time.perf_counter()
+            for _ in range(iterations):
+                await server.verify_token(credentials)
+            return time.perf_counter() - start
+
+        start = time.perf_counter()
+        for _ in range(iterations):
+            uncached()
+        decode_elapsed = time.perf_counter() - start
+        cached_elapsed = asyncio.run(run_cached())
+
+        for label, elapsed in (("jwt.decode per request", decode_elapsed), ("cached verify_token", cached_elapsed)):
+            per_call_us = elapsed * 1e6 / iterations
+            print(f"   {label}: {per_call_us:.2f}µs per request")
+            self.log_result("token_verification", label, {
+                "median_ms": round(per_call_us / 1000, 4), "p95_ms": round(per_call_us / 1000, 4), "min_ms": round(per_call_us / 1000, 4)
+            })
+
+    def bench_user_search(self, total=1000000, queries=("bench", "محمد", "user12", "noone-matches")):
+        """User picker search latency over a large registered_users collection"""
+        server = self.load_server()
+        marker = f"bench{self.run_id}"
+        first_names = ["أحمد", "محمد", "فاطمة", "سارة", "خالد", "يوسف", "Omar", "Lina"]
+        last_names = ["العمري", "الحربي", "القحطاني", "Hassan", "Saleh"]
+
+        def generate():
+            for i in range(total):
+                user_id = f"{marker}_user{i}"
+                name = f"{first_names[i % len(first_names)]} {last_names[i % len(last_names)]} {i}"
+                email = f"{user_id}@bench.example.com"
+                yield {
+                    "userId": user_id,
+                    "name": name,
+                    "email": email,
+                    "phone": "",
+                    "password": "-",
+                    "userType": "rider",
+                    "createdAt": datetime.now(timezone.utc).isoformat(),
+                    **server.user_search_fields(user_id, name, email)
+                }
+
+        self.seed('registered_users', generate())
+        print(f"   Seeded {total} registered users")
+
+        try:
+            for query in queries:
+                if query == "bench":
+                    query = marker
+                stats = self.measure('GET', 'auth/search-users', params={"q": query})
+                self.log_result("user_search", f"q={query}", stats)
+        finally:
+            self.db.registered_users.delete_many({"userId": {"$regex": f"^{marker}_"}})
+
+    def bench_users_merge(self, total=100000, overlap=0.1, limit=50):
+        """Admin users list over users + registered_users with overlapping accounts"""
+        marker = f"bench{self.run_id}"
+        token = self.admin_token()
+
+        def admin_users():
+            for i in range(total):
+                yield {
+                    "id": f"{marker}_u{i}",
+                    "name": f"Admin User {i}",
+                    "email": f"{marker}_u{i}@bench.example.com",
+                    "phone": "",
+                    "status": "active" if i % 4 else "inactive",
+                    "rides": i % 50,
+                    "orders": i % 20,
+                    "joined": "2024-01-01",
+                    "avatar": "",
+                    "username": ""
+                }
+
+        def registered_users():
+            shared = int(total * overlap)
+            for i in range(total):
+                # The first `shared` accounts reuse an admin-side email and must be deduplicated
+                email = f"{marker}_u{i}@bench.example.com" if i < shared else f"{marker}_r{i}@bench.example.com"
+                yield {
+                    "userId": f"{marker}_r{i}",
+                    "name": f"Registered User {i}",
+                    "email": email,
+                    "phone": "",
+                    "password": "-",
+                    "userType": "rider",
+                    "createdAt": datetime.now(timezone.utc).isoformat()
+                }
+
+        self.seed('users', admin_users())
+        self.seed('registered_users', registered_users())
+        print(f"   Seeded {total} users and {total} registered users ({int(total * overlap)} overlapping)")
+
+        try:
+            stats = self.measure('GET', 'users', runs=10, params={"limit": limit}, token=token)
+            self.log_result("users_merge", "first page", stats)
+            stats = self.measure('GET', 'users', runs=10, params={"limit": limit, "page": total // limit}, token=token)
+            self.log_result("users_merge", f"page={total // limit}", stats)
+            stats = self.measure('GET', 'users', runs=10, params={"limit": limit, "sort": "name"}, token=token)
+            self.log_result("users_merge", "sort=name", stats)
+            stats = self.measure('GET', 'users', runs=5, params={"limit": limit, "status": "inactive"}, token=token)
+            self.log_result("users_merge", "status=inactive", stats)
+
+            # Walk a stretch of the union with cursors; each page must cost the same
+            cursor, samples = None, []
+            for _ in range(20):
+                params = {"limit": limit, **({"cursor": cursor} if cursor else {})}
+                response, elapsed_ms = self.make_request('GET', 'users', params=params, token=token)
+                samples.append(elapsed_ms)
+                cursor = response.headers.get("X-Next-Cursor")
+                if not cursor:
+                    break
+            self.log_result("users_merge", "cursor walk", {
+                "median_ms": round(statistics.median(samples), 2),
+                "p95_ms": round(sorted(samples)[int(len(samples) * 0.95) - 1], 2),
+                "min_ms": round(min(samples), 2)
+            })
+        finally:
+            self.db.users.delete_many({"id": {"$regex": f"^{marker}_"}})
+            self.db.registered_users.delete_many({"userId": {"$regex": f"^{marker}_"}})
+
+    def bench_exports(self, total=500000):
+        """Streaming ride export throughput and time to first byte"""
+        marker = f"bench{self.run_id}"
+        token = self.admin_token()
+        start_day = datetime(2024, 1, 1, tzinfo=timezone.utc)
+
+        def rides():
+            for i in range(total):
+                yield {
+                    "id": f"{marker}_R{i}",
+                    "user": f"User {i % 1000}",
+                    "driver": f"Driver {i % 100}",
+                    "from_location": "Downtown",
+                    "to_location": "Airport",
+                    "status": "completed",
+                    "fare": float(i % 90 + 10),
+                    "date": (start_day + timedelta(minutes=i)).strftime('%Y-%m-%d %H:%M'),
+                    "duration": "25 min"
+                }
+
+        self.seed('rides', rides())
+        print(f"   Seeded {total} rides")
+
+        try:
+            for export_format in ("ndjson", "csv"):
+                url = f"{self.base_url}/api/rides/export"
+                start = time.perf_counter()
+                first_byte_ms, rows, size = None, 0, 0
+                with requests.get(url, params={"format": export_format}, headers={'Authorization': f'Bearer {token}'},
+                                  stream=True, timeout=600) as response:
+                    response.raise_for_status()
+                    for chunk in response.iter_content(chunk_size=64 * 1024):
+                        if first_byte_ms is None:
+                            first_byte_ms = (time.perf_counter() - start) * 1000
+                        rows += chunk.count(b"\n")
+                        size += len(chunk)
+                elapsed = time.perf_counter() - start
+                if export_format == "csv":
+                    rows -= 1  # header
+                print(f"📊 exports [{export_format}] rows={rows} size={size / 1024 / 1024:.1f}MB "
+                      f"first_byte={first_byte_ms:.0f}ms throughput={rows / elapsed:.0f} rows/s")
+                self.results.append({
+                    "scenario": "exports",
+                    "label": export_format,
+                    "rows": rows,
+                    "bytes": size,
+                    "first_byte_ms": round(first_byte_ms, 2),
+                    "rows_per_second": round(rows / elapsed)
+                })
+        finally:
+            self.db.rides.delete_many({"id": {"$regex": f"^{marker}_"}})
+
+    def bench_backup_format(self, total=500000):
+        """Streaming compressed backup vs the legacy pretty-printed JSON dump"""
+        marker = f"bench{self.run_id}"
+        token = self.admin_token()
+
+        def orders():
+            for i in range(total):
+                yield {
+                    "id": f"{marker}_O{i}",
+                    "user": f"User {i % 1000}",
+                    "restaurant": f"Restaurant {i % 50}",
+                    "items": i % 5 + 1,
+                    "total": float(i % 200 + 15),
+                    "status": "delivered",
+                    "date": "2024-06-01 12:00",
+                    "driver": f"Driver {i % 100}"
+                }
+
+        self.seed('orders', orders())
+        print(f"   Seeded {total} orders")
+
+        collections = ['users', 'drivers', 'restaurants', 'rides', 'orders', 'promotions', 'admins']
+        backup_ids = []
+        try:
+            # Legacy format, reproduced locally: load everything, then json.dump(indent=2)
+            start = time.perf_counter()
+            data = {name: list(self.db[name].find({}, {"_id": 0})) for name in collections}
+            legacy = json.dumps({'metadata': {}, 'data': data}, ensure_ascii=False, indent=2, default=str).encode()
+            legacy_seconds = time.perf_counter() - start
+            documents = sum(len(docs) for docs in data.values())
+            del data
+
+            start = time.perf_counter()
+            response, _ = self.make_request('POST', 'backup/create', token=token)
+            if response.status_code != 200:
+                raise RuntimeError(f"backup/create returned {response.status_code}: {response.text[:200]}")
+            job = self.wait_for_job(response.json()['id'], token)
+            backup_seconds = time.perf_counter() - start
+            backup_ids.append(job['result'])
+            backup = next(b for b in self.make_request('GET', 'backup/list', token=token)[0].json()
+                          if b['id'] == job['result'])
+
+            for label, seconds, size in (("legacy json", legacy_seconds, len(legacy)),
+                                         (f"ndjson+{backup.get('compression')}", backup_seconds, backup['size'])):
+                print(f"📊 backup_format [{label}] documents={documents} size={size / 1024 / 1024:.1f}MB "
+                      f"time={seconds:.1f}s throughput={documents / seconds:.0f} docs/s")
+                self.results.append({
+                    "scenario": "backup_format",
+                    "label": label,
+                    "documents": documents,
+                    "bytes": size,
+                    "seconds": round(seconds, 2),
+                    "docs_per_second": round(documents / seconds)
+                })
+            print(f"   Size reduction: {100 * (1 - backup['size'] / len(legacy)):.1f}%")
+        finally:
+            for backup_id in backup_ids:
+                self.make_request('DELETE', f'backup/{backup_id}', token=token)
+            self.db.orders.delete_many({"id": {"$regex": f"^{marker}_"}})
+
+    def run(self, scenarios):
+        available = {
+            "chat_list": self.bench_chat_list,
+            "message_pagination": self.bench_message_pagination,
+            "trash_move": self.bench_trash_move,
+            "dashboard_stats": self.bench_dashboard_stats,
+            "password_hashing": self.bench_password_hashing,
+            "token_verification": self.bench_token_verification,
+            "user_search": self.bench_user_search,
+            "users_merge": self.bench_users_merge,
+            "exports": self.bench_exports,
+            "backup_format": self.bench_backup_format,
+        }
+        for name in scenarios or available.keys():
+            print(f"\n🚀 Running benchmark: {name}")
+            available[name]()
+
+    def print_summary(self):
+        """Print benchmark summary"""
+        print("\n" + "=" * 80)
+        print("📊 BENCHMARK SUMMARY")
+        print("=" * 80)
+        print(json.dumps(self.results, ensure_ascii=False, indent=2))
+        print("=" * 80)
+
+def main():
+    """Main benchmark execution"""
+    benchmark = PerformanceBenchmark()
+    
+    try:
+        benchmark.run(sys.argv[1:])
+        benchmark.print_summary()
+        return 0
+    except KeyboardInterrupt:
+        print("\n⏹️ Benchmark interrupted by user")
+        return 1
+    except Exception as e:
+        print(f"\n💥 Unexpected error: {str(e)}")
+        return 1
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,203 @@
+#!/usr/bin/env python3
+"""
+Backend API Testing for Keyset Pagination
+Pages through /api/orders with a projection that leaves out the sort key and
+checks that the X-Next-Cursor chain visits every row exactly once.
+"""
+
+import requests
+import sys
+import os
+import uuid
+from datetime import datetime
+
+class PaginationTester:
+    def __init__(self, base_url="https://signup-db-connect-1.preview.emergentagent.com"):
+        self.base_url = base_url
+        self.token = None
+        self.tests_run = 0
+        self.tests_passed = 0
+        self.test_results = []
+        self.run_id = uuid.uuid4().hex[:8]
+
+        # Few distinct totals so most rows tie on the sort key
+        self.seed_count = 57
+        self.page_size = 7
+
+    def log_result(self, test_name, success, details="", error=""):
+        """Log test result"""
+        self.tests_run += 1
+        if success:
+            self.tests_passed += 1
+            print(f"✅ {test_name} - PASSED")
+            if details:
+                print(f"   Details: {details}")
+        else:
+            print(f"❌ {test_name} - FAILED")
+            if error:
+                print(f"   Error: {error}")
+            if details:
+                print(f"   Details: {details}")
+
+        self.test_results.append({
+            "test": test_name,
+            "success": success,
+            "details": details,
+            "error": error,
+            "timestamp": datetime.now().isoformat()
+        })
+
+    def make_request(self, method, endpoint, data=None, params=None):
+        """Make HTTP request"""
+        url = f"{self.base_url}/api/{endpoint}"
+        headers = {'Content-Type': 'application/json'}
+        if self.token:
+            headers['Authorization'] = f'Bearer {self.token}'
+        return requests.request(method, url, json=data, params=params, headers=headers, timeout=30)
+
+    def test_admin_login(self):
+        """Log in as the default admin"""
+        print(f"\n🔐 Testing admin login...")
+        response = self.make_request('POST', 'auth/login', {
+            "email": "admin@transfers.com",
+            "password": "admin123"
+        })
+        if response.status_code == 200 and response.json().get('token'):
+            self.token = response.json()['token']
+            self.log_result("Admin Login", True)
+            return True
+        self.log_result("Admin Login", False, error=f"Status {response.status_code}")
+        return False
+
+    def seed_orders(self):
+        """Insert orders with heavily tied totals directly into MongoDB"""
+        print(f"\n📦 Seeding {self.seed_count} orders...")
+        from pymongo import MongoClient
+        collection = MongoClient(os.environ['MONGO_URL'])[os.environ['DB_NAME']].orders
+        collection.insert_many([{
+            "id": f"page{self.run_id}_O{i}",
+            "user": f"Pagination User {i}",
+            "restaurant": f"Restaurant {i % 5}",
+            "items": 1,
+            "total": float(i % 3 + 10),
+            "status": "delivered",
+            "date": "2024-06-01 12:00",
+            "driver": "-"
+        } for i in range(self.seed_count)])
+        self.log_result("Seed Orders", True, f"{self.seed_count} orders")
+        return collection
+
+    def page_through(self, params):
+        """Follow X-Next-Cursor from the first page; returns (ids, total, error)"""
+        ids = []
+        cursor = None
+        total = None
+        for _ in range(10000):
+            query = dict(params, limit=self.page_size)
+            if cursor:
+                query['cursor'] = cursor
+            response = self.make_request('GET', 'orders', params=query)
+            if response.status_code != 200:
+                return ids, total, f"Status {response.status_code}: {response.text[:200]}"
+            total = int(response.headers.get('X-Total-Count', -1))
+            rows = response.json()
+            for row in rows:
+                unexpected = set(row) - set(params.get('fields', '').split(',')) - {'id'}
+                if 'fields' in params and unexpected:
+                    return ids, total, f"Unrequested fields returned: {sorted(unexpected)}"
+                ids.append(row['id'])
+            cursor = response.headers.get('X-Next-Cursor')
+            if not cursor:
+                return ids, total, None
+        return ids, total, "Cursor chain did not terminate"
+
+    def test_paging_with_projection(self, sort, order):
+        """Every row is visited exactly once when the sort key is not in fields"""
+        name = f"Paging sort={sort} order={order} fields=user"
+        print(f"\n📄 {name}...")
+        ids, total, error = self.page_through({"sort": sort, "order": order, "fields": "user"})
+        if error:
+            self.log_result(name, False, error=error)
+            return False
+
+        seeded = {f"page{self.run_id}_O{i}" for i in range(self.seed_count)}
+        duplicates = len(ids) - len(set(ids))
+        missing = seeded - set(ids)
+        success = not duplicates and not missing and len(ids) == total
+        self.log_result(
+            name, success,
+            f"{len(ids)} rows over {total} total, {duplicates} duplicates, {len(missing)} seeded rows missing",
+            "" if success else "Cursor chain skipped or repeated rows"
+        )
+        return success
+
+    def cleanup(self, collection):
+        """Remove the seeded orders"""
+        print(f"\n🧹 Cleaning up...")
+        if collection is not None:
+            collection.delete_many({"id": {"$regex": f"^page{self.run_id}_"}})
+
+    def run_all_tests(self):
+        """Run pagination tests"""
+        print("=" * 80)
+        print("🧪 KEYSET PAGINATION TESTING")
+        print("=" * 80)
+        print(f"Testing API: {self.base_url}")
+        print("=" * 80)
+
+        if not self.test_admin_login():
+            print("❌ Cannot proceed without authentication")
+            return False
+
+        collection = None
+        try:
+            collection = self.seed_orders()
+            self.test_paging_with_projection("total", "asc")
+            self.test_paging_with_projection("total", "desc")
+            self.test_paging_with_projection("restaurant", "asc")
+        finally:
+            self.cleanup(collection)
+        return True
+
+    def print_summary(self):
+        """Print test summary"""
+        print("\n" + "=" * 80)
+        print("📊 TEST SUMMARY")
+        print("=" * 80)
+        print(f"Total Tests: {self.tests_run}")
+        print(f"Passed: {self.tests_passed}")
+        print(f"Failed: {self.tests_run - self.tests_passed}")
+        print(f"Success Rate: {(self.tests_passed/self.tests_run*100):.1f}%" if self.tests_run > 0 else "0%")
+
+        if self.tests_run - self.tests_passed > 0:
+            print("\n❌ FAILED TESTS:")
+            for result in self.test_results:
+                if not result['success']:
+                    print(f"  - {result['test']}: {result['error']}")
+
+        print("=" * 80)
+
+def main():
+    """Main test execution"""
+    tester = PaginationTester()
+
+    try:
+        tester.run_all_tests()
+        tester.print_summary()
+
+        if tester.tests_passed == tester.tests_run:
+            print("🎉 All tests passed!")
+            return 0
+        else:
+            print("⚠️ Some tests failed!")
+            return 1
+
+    except KeyboardInterrupt:
+        print("\n⏹️ Tests interrupted by user")
+        return 1
+    except Exception as e:
+        print(f"\n💥 Unexpected error: {str(e)}")
+        return 1
+
+if __name__ == "__main__":
+    sys.exit(main())
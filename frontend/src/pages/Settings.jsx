@@ -68,6 +68,22 @@ export default function Settings() {
 
   const getToken = () => localStorage.getItem('token');
 
+  // Backup and restore run as background jobs; poll until the job finishes
+  const waitForJob = async (jobId) => {
+    while (true) {
+      await new Promise((resolve) => setTimeout(resolve, 2000));
+      const response = await fetch(`${API_URL}/api/backup/jobs/${jobId}`, {
+        headers: { 'Authorization': `Bearer ${getToken()}` }
+      });
+      if (!response.ok) throw new Error('Job status unavailable');
+      const job = await response.json();
+      if (job.status === 'completed') return job;
+      if (job.status === 'failed' || job.status === 'cancelled') {
+        throw new Error(job.error || job.status);
+      }
+    }
+  };
+
   // Fetch backups
   const fetchBackups = async () => {
     try {
@@ -114,10 +130,10 @@ export default function Settings() {
         headers: { 'Authorization': `Bearer ${getToken()}` }
       });
       if (response.ok) {
-        const data = await response.json();
+        const job = await waitForJob((await response.json()).id);
         toast({
           title: 'تم إنشاء النسخة الاحتياطية',
-          description: `تم حفظ النسخة: ${data.filename}`,
+          description: `تم حفظ النسخة: ${job.result}`,
         });
         fetchBackups();
         fetchBackupSettings();
@@ -166,6 +182,7 @@ export default function Settings() {
         headers: { 'Authorization': `Bearer ${getToken()}` }
       });
       if (response.ok) {
+        await waitForJob((await response.json()).id);
         toast({
           title: 'تم استعادة قاعدة البيانات',
           description: 'تمت استعادة البيانات بنجاح',
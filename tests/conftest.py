@@ -0,0 +1,19 @@
+import os
+import sys
+from pathlib import Path
+
+import pytest
+
+BACKEND_DIR = Path(__file__).resolve().parent.parent / "backend"
+
+
+@pytest.fixture(scope="session")
+def server():
+    """backend/server.py imported without touching MongoDB (the Motor client connects lazily)"""
+    for module in ("fastapi", "motor", "bcrypt", "jwt", "dotenv"):
+        pytest.importorskip(module)
+    os.environ.setdefault("MONGO_URL", "mongodb://localhost:27017")
+    os.environ.setdefault("DB_NAME", "unit_tests")
+    sys.path.insert(0, str(BACKEND_DIR))
+    import server as server_module
+    return server_module
@@ -0,0 +1,90 @@
+from datetime import datetime, timedelta, timezone
+
+NOW = datetime(2024, 6, 12, 15, 30, tzinfo=timezone.utc)  # a Wednesday
+
+
+def backup(backup_id, age, parent_id=None):
+    return {"id": backup_id, "created_at": (NOW - age).isoformat(), "parent_id": parent_id}
+
+
+def test_newest_backup_per_hour_is_kept(server):
+    backups = [
+        backup("15:30", timedelta(0)),
+        backup("15:05", timedelta(minutes=25)),
+        backup("14:59", timedelta(minutes=31)),
+        backup("14:00", timedelta(minutes=90)),
+        backup("13:59", timedelta(minutes=91)),
+    ]
+    assert server.select_backups_to_keep(backups, 3, 0, 0) == {"15:30", "14:59", "13:59"}
+
+
+def test_hour_buckets_do_not_merge_across_days(server):
+    # 00:10 today and 23:50 yesterday are twenty minutes apart but in different hours and days
+    midnight = NOW.replace(hour=0, minute=0)
+    backups = [
+        {"id": "today", "created_at": (midnight + timedelta(minutes=10)).isoformat()},
+        {"id": "yesterday", "created_at": (midnight - timedelta(minutes=10)).isoformat()},
+    ]
+    assert server.select_backups_to_keep(backups, 2, 0, 0) == {"today", "yesterday"}
+    assert server.select_backups_to_keep(backups, 0, 2, 0) == {"today", "yesterday"}
+
+
+def test_daily_tier_keeps_newest_of_each_day(server):
+    backups = [backup(f"d{day}h{hour}", timedelta(days=day, hours=hour)) for day in range(5) for hour in (0, 6)]
+    assert server.select_backups_to_keep(backups, 0, 3, 0) == {"d0h0", "d1h0", "d2h0"}
+
+
+def test_weekly_tier_uses_iso_weeks(server):
+    # Monday 2024-06-10 and Sunday 2024-06-09 are one day apart but in different ISO weeks
+    monday = NOW - timedelta(days=2)
+    backups = [
+        {"id": "monday", "created_at": monday.isoformat()},
+        {"id": "sunday", "created_at": (monday - timedelta(days=1)).isoformat()},
+        {"id": "saturday", "created_at": (monday - timedelta(days=2)).isoformat()},
+    ]
+    assert server.select_backups_to_keep(backups, 0, 0, 2) == {"monday", "sunday"}
+
+
+def test_tiers_overlap_instead_of_adding_up(server):
+    backups = [backup(f"h{hour}", timedelta(hours=hour)) for hour in range(10)]
+    # h0 is the newest backup of its hour, its day and its week
+    assert server.select_backups_to_keep(backups, 1, 1, 1) == {"h0"}
+
+
+def test_newest_and_pinned_are_always_kept(server):
+    backups = [backup("newest", timedelta(0)), backup("old", timedelta(days=30)), backup("older", timedelta(days=60))]
+    assert server.select_backups_to_keep(backups, 0, 0, 0, pinned={"older"}) == {"newest", "older"}
+
+
+def test_kept_incremental_keeps_its_chain(server):
+    backups = [
+        backup("inc2", timedelta(hours=1), parent_id="inc1"),
+        backup("inc1", timedelta(hours=2), parent_id="full"),
+        backup("full", timedelta(hours=3)),
+        backup("stale", timedelta(days=40)),
+    ]
+    assert server.select_backups_to_keep(backups, 1, 0, 0) == {"inc2", "inc1", "full"}
+
+
+def test_empty_input(server):
+    assert server.select_backups_to_keep([], 24, 7, 4) == set()
+
+
+def test_orphan_sweep_only_recognises_ndjson_directories(server, tmp_path):
+    full = tmp_path / "backup_auto_20240612_153000"
+    full.mkdir()
+    (full / "orders.ndjson.gz").write_text("")
+    (full / "manifest.json").write_text("{}")
+    interrupted = tmp_path / "backup_auto_incremental_20240612_160000"
+    interrupted.mkdir()
+    (interrupted / "changes.ndjson.zst").write_text("")
+    copied_in = tmp_path / "backup_restored_by_hand"
+    copied_in.mkdir()
+    (copied_in / "dump.bson").write_text("")
+    legacy = tmp_path / "backup_manual_20240101_000000.json"
+    legacy.write_text("{}")
+
+    assert server._is_ndjson_backup_dir(full)
+    assert server._is_ndjson_backup_dir(interrupted)
+    assert not server._is_ndjson_backup_dir(copied_in)
+    assert not server._is_ndjson_backup_dir(legacy)
@@ -0,0 +1,114 @@
+import pytest
+
+ObjectId = pytest.importorskip("bson").ObjectId
+
+
+def page(server, rows, keys, direction, token=None):
+    """Apply keyset_match to in-memory rows the way MongoDB would for these filters
+
+    Missing fields read as None; null sorts first, matches {field: None} and
+    {"$ne": None} is its negation, while $gt/$lt never match it.
+    """
+    ops = {
+        "$gt": lambda a, b: a is not None and a > b,
+        "$lt": lambda a, b: a is not None and a < b,
+        "$ne": lambda a, b: a != b,
+    }
+
+    def matches(row, condition):
+        for field, expected in condition.items():
+            if field == "$or":
+                if not any(matches(row, branch) for branch in expected):
+                    return False
+            elif isinstance(expected, dict):
+                (op, value), = expected.items()
+                if not ops[op](row.get(field), value):
+                    return False
+            elif row.get(field) != expected:
+                return False
+        return True
+
+    def sort_key(row):
+        return [(0, 0) if row.get(k) is None else (1, row[k]) for k in keys]
+
+    condition = server.keyset_match(keys, token, direction) if token else {}
+    ordered = sorted(rows, key=sort_key, reverse=direction == server.DESCENDING)
+    return [row for row in ordered if matches(row, condition)]
+
+
+def page_through(server, rows, keys, direction, size=3):
+    seen, token = [], None
+    while True:
+        batch = page(server, rows, keys, direction, token)[:size]
+        seen.extend(row["_id"] for row in batch)
+        if len(batch) < size:
+            return seen
+        token = server.keyset_cursor(batch[-1], keys)
+
+
+@pytest.fixture
+def rows():
+    # Three distinct totals over ten rows: most positions tie on the sort key
+    return [{"_id": ObjectId(), "total": float(i % 3)} for i in range(10)]
+
+
+@pytest.mark.parametrize("direction_name", ["ASCENDING", "DESCENDING"])
+def test_ties_on_sort_key_are_neither_skipped_nor_repeated(server, rows, direction_name):
+    seen = page_through(server, rows, ["total", "_id"], getattr(server, direction_name))
+    assert sorted(seen) == sorted(row["_id"] for row in rows)
+    assert len(seen) == len(set(seen))
+
+
+@pytest.mark.parametrize("direction_name", ["ASCENDING", "DESCENDING"])
+def test_null_and_missing_sort_values_are_paged_through(server, direction_name):
+    # Legacy rows without the sort field, some explicitly null, mixed with set values
+    rows = [{"_id": ObjectId()} for _ in range(4)]
+    rows += [{"_id": ObjectId(), "joined": None} for _ in range(3)]
+    rows += [{"_id": ObjectId(), "joined": f"2024-06-0{i % 3 + 1}"} for i in range(6)]
+    seen = page_through(server, rows, ["joined", "_id"], getattr(server, direction_name))
+    assert sorted(seen) == sorted(row["_id"] for row in rows)
+    assert len(seen) == len(set(seen))
+
+
+def test_null_cursor_value_is_encoded_and_branched(server):
+    row = {"_id": ObjectId()}
+    token = server.keyset_cursor(row, ["joined", "_id"])
+    assert server.decode_cursor(token, 2)[0] is None
+    assert server.keyset_match(["joined", "_id"], token, server.ASCENDING) == {"$or": [
+        {"joined": {"$ne": None}},
+        {"joined": None, "_id": {"$gt": row["_id"]}},
+    ]}
+    assert server.keyset_match(["joined", "_id"], token, server.DESCENDING) == {
+        "joined": None, "_id": {"$lt": row["_id"]}
+    }
+
+
+def test_branches_pin_earlier_keys(server, rows):
+    keys = ["total", "_id"]
+    token = server.keyset_cursor(rows[4], keys)
+    condition = server.keyset_match(keys, token, server.ASCENDING)
+    assert condition == {"$or": [
+        {"total": {"$gt": rows[4]["total"]}},
+        {"total": rows[4]["total"], "_id": {"$gt": rows[4]["_id"]}},
+    ]}
+
+
+def test_single_key_has_no_or(server, rows):
+    token = server.keyset_cursor(rows[0], ["_id"])
+    assert server.keyset_match(["_id"], token, server.DESCENDING) == {"_id": {"$lt": rows[0]["_id"]}}
+
+
+@pytest.mark.parametrize("values", [
+    [{"$gt": ""}, "5f0000000000000000000000"],
+    [["a"], "5f0000000000000000000000"],
+    [1.0],
+])
+def test_malformed_cursors_are_rejected(server, values):
+    with pytest.raises(server.HTTPException) as raised:
+        server.keyset_match(["total", "_id"], server.encode_cursor(values), server.ASCENDING)
+    assert raised.value.status_code == 400
+
+
+def test_non_object_id_cursor_is_rejected(server):
+    with pytest.raises(server.HTTPException):
+        server.keyset_match(["_id"], server.encode_cursor(["not-an-id"]), server.ASCENDING)